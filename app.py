@@ -1,106 +1,170 @@
 # app.py — DTMF language selection, language-first, full question set (aptitude + values)
 import os
+import hmac
 import time
+import atexit
 import json
 import re
-import traceback
-from flask import Flask, request, Response
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from flask import Blueprint, Flask, request, Response, g
 from twilio.twiml.voice_response import VoiceResponse, Gather
 from dotenv import load_dotenv
-from twilio.rest import Client
+from session_store import make_session_store
+from gemini_client import GeminiClient
+from rec_cache import RecommendationCache, answers_fingerprint
+from dedup import WebhookDedup
+from event_log import EventLog
+from audio_cache import AudioCache, make_synthesizer
+from prompt_builder import build_answers_block, estimate_tokens
+from session_model import Answer, Session, seed_question_ids
+from scoring import CATEGORIES, EXPLICIT_INDEX, add_answer_score, score_answers, session_scores
+from flow import compile_flow, load_flow
+from transcribe import TranscriptionPool, fetch_recording, make_transcriber
+from tracing import CallTracer, CURRENT_CALL, SLOWEST_KEYS, bind, slowest, timeline
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from logs import DEBUG_CALLS, get_logger, setup_logging, stats as log_stats
 
 load_dotenv()
 # ----- Config -----
-NGROK_URL = os.getenv("NGROK_URL")
-if not NGROK_URL:
-    raise RuntimeError("Set NGROK_URL in .env (example: https://abc123.ngrok.io)")
+# public base URL for TwiML callbacks (example: https://abc123.ngrok.io); when empty the TwiML
+# uses relative URLs, which Twilio resolves against the webhook it just called
+NGROK_URL = os.getenv("NGROK_URL", "").rstrip("/")
 
-# Gemini config (optional)
+# Gemini config (optional); the SDK is imported and the models built on first use, see gemini_models()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai_model = None
-if GEMINI_API_KEY:
-    try:
-        import google.generativeai as genai
-        genai.configure(api_key=GEMINI_API_KEY)
-        genai_model = genai.GenerativeModel("models/gemini-2.5-pro")
-        print("Gemini configured (models/gemini-2.5-pro).")
-    except Exception as e:
-        print("Warning: could not configure Gemini:", e)
-        genai_model = None
-else:
-    print("GEMINI_API_KEY not set — running with rule-based fallbacks only.")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "models/gemini-2.5-pro")
+GEMINI_REFINE_MODEL = os.getenv("GEMINI_REFINE_MODEL", "models/gemini-2.5-flash")   # only refines speculative drafts
+genai_model = None               # tools and tests may assign a stub here before first use
+genai_refine_model = None
+GEMINI_MODELS_READY = False
+GEMINI_INIT_LOCK = threading.Lock()
 
 # runtime controls
-GENIE_DISABLED_UNTIL = 0.0       # epoch until we avoid Gemini after an error
 USE_GEMINI_FOR_ACKS = False      # keep False by default to avoid many small calls
 MAX_GEMINI_RETRIES = 1
 
-# Twilio / app state
-app = Flask(__name__)
-SESSIONS = {}
-PROCESSED_RECORDINGS = set()
-
-# ------------------ QUESTION FLOW (your list) ------------------
-QUESTION_FLOW = [
-    {"id": "q0"},  # language prompt
-    {"id":"q1", "text": {
-        "en":"Hello — what is your name?",
-        "hi":"नमस्ते — आपका नाम क्या है?",
-        "gu":"નમસ્તે — તમારું નામ શું છે?"
-    }},
-    {"id":"q2",  "text": { "en":"When you are given some work or homework, do you like doing it by yourself, or with friends or classmates?",
-                            "hi":"जब आपको कोई काम या होमवर्क दिया जाता है, क्या आपको अकेले करना पसंद है या दोस्तों या क्लासमेट्स के साथ करना अच्छा लगता है?",
-                            "gu":"જ્યારે તમને કોઈ કામ અથવા હોમવર્ક આપવામાં આવે છે, ત્યારે તમને એકલા કરવું ગમે છે કે મિત્રો અને ક્લાસમેટ્સ સાથે કરવું ગમે છે?" }},
-    {"id":"q3",  "text": { "en":"Do you enjoy talking or discussing different topics with others even if they don’t agree with you?",
-                            "hi":"क्या आपको दूसरों से अलग-अलग विषयों पर बात करना या चर्चा करना अच्छा लगता है — भले ही वे आपसे सहमत न हों?",
-                            "gu":"શું તમને અન્ય લોકો સાથે અલગ વિષયો પર વાત કરવી કે ચર્ચા કરવી ગમે છે — ભલે તેઓ вашей સાથે સહમત ન હોય?" }},
-    {"id":"q4",  "text": { "en":"If you started a small project or club with friends, what would it focus on?",
-                            "hi":"अगर आप अपने दोस्तों के साथ कोई छोटा प्रोजेक्ट या क्लब शुरू करें, तो वह किस विषय पर होगा?",
-                            "gu":"જો તમે મિત્રો સાથે કોઈ નાનું પ્રોજેક્ટ કે ક્લબ શરૂ કરો, તો તે કયા વિષય પર હશે?" }},
-    {"id":"q5",  "text": { "en":"When you get something new — like a phone or a tool — do you like finding out how it works, or just start using it?",
-                            "hi":"जब आपको कोई नई चीज़ मिलती है — जैसे मोबाइल या नया औज़ार — क्या आप जानना पसंद करते हैं कि यह कैसे चलता है, या बस इस्तेमाल करना शुरू कर देते हैं?",
-                            "gu":"જ્યારે તમને નવી વસ્તુ મળે — મોબાઈલ કે સાધન — તો શું તમે જાણવું ગમે છે કે તે કઈ રીતે કામ કરે છે કે સીધા વાપરવું શરૂ કરો છો?" }},
-    {"id":"q6",  "text": { "en":"Do you enjoy solving puzzles, math questions, or riddles that make you think hard? Which kind do you like most?",
-                            "hi":"क्या आपको पहेलियाँ, गणित के सवाल या ऐसी चीज़ें हल करना पसंद है जो दिमाग लगवाती हैं? किस तरह की पसंद है?",
-                            "gu":"શું તમને પઝલ્સ, ગણિતના પ્રશ્નો કે પહેલીઓ ઉકેલવી ગમે છે? કયો પ્રકાર ગમે છે?" }},
-    {"id":"q7",  "text": { "en":"Do you find it easy or confusing to understand maps, diagrams, or visual directions?",
-                            "hi":"क्या आपको नक्शे, चार्ट या चित्र देखकर समझना आसान लगता है या उलझन भरा?",
-                            "gu":"શું તમને નકશા, ચાર્ટ કે ચિત્ર જોઈને સમજવું સરળ લાગે છે કે કઠિન?" }},
-    {"id":"q8",  "text": { "en":"Which kind of work do you like more — creative (drawing, writing) or careful (measuring, calculating, planning)?",
-                            "hi":"आपको किस तरह का काम ज़्यादा पसंद है — रचनात्मक जैसे ड्राइंग, लिखना या सावधानी वाला जैसे नापना, गणना?",
-                            "gu":"તમને કયું કામ વધુ ગમે છે — સર્જનાત્મક કે ધ્યાનપૂર્વકનું?" }},
-    {"id":"q9",  "text": { "en":"If your younger sibling didn’t understand something in school, how would you explain it?",
-                            "hi":"अगर आपके छोटे भाई/बहन को कुछ समझ न आए, तो आप उसे कैसे बतायेंगे?",
-                            "gu":"જો તમારા નાનો ભાઈ/બહેનને કંઈ સમજાતું ન હોય તો તમે કેવી રીતે સમજાવશો?" }},
-    {"id":"q10", "text": { "en":"Would you rather build something with your hands, or come up with a new idea or plan for something?",
-                            "hi":"क्या आप अपने हाथों से कुछ बनाना पसंद करेंगे, या नया विचार/योजना बनाना?",
-                            "gu":"શું તમે હાથથી કંઈ બનાવવું ગમશે કે નવો વિચાર બનાવવો ગમશે?" }},
-    {"id":"q11", "text": { "en":"What activities make you lose track of time because you enjoy them so much?",
-                            "hi":"कौन-सी गतिविधियाँ करते समय आपको समय का ध्यान नहीं रहता क्योंकि आपको वो बहुत पसंद हैं?",
-                            "gu":"કઈ પ્રવૃત્તિઓ કરતી વખતે તમને સમયનો ખ્યાલ નથી રહેતા?" }},
-    {"id":"q12", "text": { "en":"Do you like being outdoors (playing, exploring) or indoors (reading, crafts)?",
-                            "hi":"क्या आपको बाहर रहना पसंद है या अंदर रहकर focused काम करना?",
-                            "gu":"શું તમને બહાર રહેવું ગમે છે કે અંદર રહીને કામ કરવું ગમે છે?" }},
-    {"id":"q13", "text": { "en":"Do you often help family or friends with fixing tools, using phones, arranging events, or solving small problems?",
-                            "hi":"क्या आप अक्सर परिवार या दोस्तों की मदद करते हैं जैसे चीजें ठीक करना, मोबाइल सिखाना या प्रोग्राम में मदद?",
-                            "gu":"શું તમે વારંવાર પરિવાર/મિત્રોને મદદ કરો છો જેવી વસ્તુઓ ઠીક કરવી અથવા કામોમાં મદદ કરવી?" }},
-    {"id":"q14", "text": { "en":"When you think about your future, what matters most: earning money, steady job, or chances to learn and grow?",
-                            "hi":"जब आप अपने भविष्य के बारे में सोचते हैं, तो आपके लिए क्या सबसे ज़्यादा महत्वपूर्ण है: पैसा, स्थिरता या सीखना?",
-                            "gu":"તમારા માટે ભવિષ્યમાં કયો પરિબળ વધુ મહત્વનો છે? પૈસા, સ્થિરતા કે શીખવાનાં અવસર?" }},
-    {"id":"q15", "text": { "en":"Would you prefer a safe permanent job (government/school/bank) or something uncertain like starting your own business?",
-                            "hi":"क्या आप सुरक्षित नौकरी पसंद करेंगे या कुछ नया और अनिश्चित (जैसे अपना व्यवसाय)?",
-                            "gu":"શું તમે સુરક્ષિત નોકરી ગમશો કે અનિશ્ચિત વ્યવસાય શરુ કરવો ગમશે?" }},
-    {"id":"q16", "text": { "en":"How important is it that your work helps people — e.g., teaching, health, farming?",
-                            "hi":"क्या आपके लिए यह ज़रूरी है कि आपका काम लोगों की मदद करे?",
-                            "gu":"તમારા માટે શું તમારું કામ લોકોની મદદ કરે એવા કામ મહત્વના છે?" }},
-    {"id":"q17", "text": { "en":"When a project ends, what makes you happiest — praise, good results, or the whole team doing well together?",
-                            "hi":"जब कोई प्रोजेक्ट खत्म होता है, तो आपको क्या सबसे ज़्यादा खुशी देता है?",
-                            "gu":"પ્રોજેક્ટ પૂરો થૈએ તો તમને સૌથી વધુ કઈ બાબત ખુશ કરે છે?" }},
-    {"id":"q18", "text": { "en":"In your dream future, would you like plenty of free time, busy active work, or a balanced life?",
-                            "hi":"भविष्य में आप बहुत फुर्सत चाहते हैं, व्यस्त काम या संतुलित जीवन?",
-                            "gu":"તમારા સ્વપ્નમાં શું કંઈક એવી નોકરી જોઈએ કે જે ઘણો સમય આપે કે વ્યસ્ત રાખે કે સંતુલન હોય?" }},
-    {"id":"end", "text": {"en":"Thanks — preparing recommendation.", "hi":"धन्यवाद — सिफारिश तैयार कर रहे हैं।", "gu":"આભાર — ભલામણ તૈયાર કરી રહ્યા છીએ."}}
-]
+# shared Gemini gate (see gemini_client.py): quota, concurrency and circuit breaker settings
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))              # requests per minute our quota allows
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+GEMINI_MAX_CONCURRENT = int(os.getenv("GEMINI_MAX_CONCURRENT", "8"))
+GEMINI_FAILURE_THRESHOLD = 5     # consecutive failures before the circuit opens
+GEMINI_RESET_TIMEOUT = 30        # seconds the circuit stays open (longer if the API asks)
+
+# final recommendation runs in the background; the call polls /recommendation_status
+# threads for final jobs; a job holds one while its Gemini call waits for a slot or runs, so the
+# default leaves room for every slot plus jobs still waiting on recordings being transcribed
+RECOMMENDATION_WORKERS = int(os.getenv("RECOMMENDATION_WORKERS", str(2 * GEMINI_MAX_CONCURRENT)))
+RECOMMENDATION_DEADLINE = float(os.getenv("RECOMMENDATION_DEADLINE", "25"))  # seconds before rule-based fallback
+RECOMMENDATION_POLL_PAUSE = 2    # seconds of silence between status polls
+# a job nobody polled for this long (the caller hung up during the hold) is dropped with its result
+RECOMMENDATION_JOB_TTL = float(os.getenv("RECOMMENDATION_JOB_TTL", "300"))
+
+# cache of generated recommendations keyed on normalized answers (+ language)
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "5000"))
+RECOMMENDATION_CACHE_TTL = int(os.getenv("RECOMMENDATION_CACHE_TTL", str(7 * 24 * 3600)))
+RECOMMENDATION_CACHE_FILE = os.getenv("RECOMMENDATION_CACHE_FILE")   # optional JSONL persistence
+
+# estimated-token budget for the answers block of the recommendation prompts (see prompt_builder.py)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "400"))
+
+# per-call deadlines (seconds) by kind of request, including queueing for rate budget and retries
+GEMINI_DEADLINES = {"ack": 3, "final": RECOMMENDATION_DEADLINE, "draft": RECOMMENDATION_DEADLINE, "refine": 10}
+
+# merged mode: handle_answer/skip_question return the ack plus the next question's <Gather>
+# directly instead of redirecting to /ask_question (one webhook hit per question instead of two)
+MERGE_ACK_AND_QUESTION = os.getenv("MERGE_ACK_AND_QUESTION", "0") == "1"
+
+# speculative mode: draft a recommendation once the aptitude block (up to the flow file's
+# "speculative_after" question) is answered, then reuse or cheaply refine it when the values answers arrive
+SPECULATIVE_RECOMMENDATIONS = os.getenv("SPECULATIVE_RECOMMENDATIONS", "0") == "1"
+
+# question order, branches, skip and early-exit rules (JSON, or YAML with PyYAML installed)
+QUESTION_FLOW_FILE = os.getenv("QUESTION_FLOW_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "question_flow.json"))
+
+# session storage: "memory" (single process), "sqlite" (shared WAL file) or "redis"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))           # seconds since last webhook
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))          # LRU bound for the memory backend
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Twilio retries slow webhooks; state-changing ones are keyed on (CallSid, q_index, endpoint)
+# and a retry gets the first response replayed instead of being processed again
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", "600"))
+WEBHOOK_DEDUP_MAX = int(os.getenv("WEBHOOK_DEDUP_MAX", "20000"))
+WEBHOOK_DEDUP_WAIT = float(os.getenv("WEBHOOK_DEDUP_WAIT", "10"))   # max wait on an original still running
+DEDUP_ENDPOINTS = ("/set_language", "/handle_answer", "/skip_question", "/handle_recording_fallback")
+
+# pre-synthesized prompt clips: <Play> them when rendered, otherwise fall back to live <Say> TTS
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_SYNTHESIZER = os.getenv("AUDIO_SYNTHESIZER", "")        # "google", "stub" or empty (no rendering)
+AUDIO_PRERENDER = os.getenv("AUDIO_PRERENDER", "0") == "1"    # render missing clips in the background at startup
+
+# durable call events (answers, skips, language, recommendations, latency samples); empty disables
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "events")
+EVENT_SEGMENT_MB = int(os.getenv("EVENT_SEGMENT_MB", "64"))
+EVENT_LOG_FSYNC = os.getenv("EVENT_LOG_FSYNC", "0") == "1"
+
+# speech-to-text for answers that fell back to a recording: "whisper", "stub" or empty (keep the placeholder)
+TRANSCRIBER = os.getenv("TRANSCRIBER", "")
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", "4"))          # recordings fetched/transcribed at once
+TRANSCRIBE_MAX_PENDING = int(os.getenv("TRANSCRIBE_MAX_PENDING", "200"))  # beyond this new recordings keep the placeholder
+TRANSCRIBE_WAIT = float(os.getenv("TRANSCRIBE_WAIT", "5"))              # seconds the final job waits for pending ones
+TWILIO_AUTH = (os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"))   # recordings may need basic auth
+
+# per-call spans (webhooks, Gemini calls, recommendation jobs) kept in memory for /calls/<sid>/trace
+TRACE_MAX_CALLS = int(os.getenv("TRACE_MAX_CALLS", "2000"))
+
+# append every incoming webhook to this JSONL file (replay it with loadtest.py)
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE")
+
+# warm-up: import and configure the Gemini SDK in the background at startup instead of on the first call
+GEMINI_WARM_UP = os.getenv("GEMINI_WARM_UP", "1") == "1"
+
+# logging: written by a background thread; TwiML bodies are logged only for calls with debug on
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")                  # debug, info, warning or error
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")                # text, or json (one object per line)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))  # fraction of calls whose info/debug lines are kept
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # records waiting for the writer; beyond this they're dropped
+LOG_DEBUG_CALLS = [sid.strip() for sid in os.getenv("LOG_DEBUG_CALLS", "").split(",") if sid.strip()]   # CallSids logged at debug
+LOG_DEBUG_TTL = int(os.getenv("LOG_DEBUG_TTL", "3600"))     # seconds a /calls/<sid>/debug switch stays on
+# /calls/<sid>/debug needs this in an X-Admin-Token header (debug logs hold transcripts);
+# when empty the route is off
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+log = get_logger("app")
+
+# app state; anything that opens files or connections is built by init_runtime() (create_app / asgi_app)
+webhooks = Blueprint("webhooks", __name__)   # routes and hooks, registered on the app by create_app()
+SESSION_STORE = None
+RECOMMENDATION_CACHE = None
+EVENT_LOG = None
+AUDIO_CACHE = None
+TRANSCRIPTION = None             # TranscriptionPool when TRANSCRIBER is set
+TRANSCRIPTS = OrderedDict()      # call_sid -> {recording_sid: text} finished here, applied on the call's next webhook
+TRANSCRIPTS_MAX = 10000
+TRANSCRIPTS_LOCK = threading.Lock()
+RUNTIME_LOCK = threading.Lock()
+WEBHOOK_DEDUP = WebhookDedup(ttl=WEBHOOK_DEDUP_TTL, max_entries=WEBHOOK_DEDUP_MAX)
+RECOMMENDATION_EXECUTOR = ThreadPoolExecutor(max_workers=RECOMMENDATION_WORKERS, thread_name_prefix="recommend")
+# the Futures are per-process; with several workers sharing the session store, the worker that
+# claims "rec:<CallSid>" in the store runs the job and publishes its text there for the others
+RECOMMENDATION_JOBS = {}         # call_sid -> Future for the final recommendation (.started: unix time)
+# drafts get their own pool so a final job waiting on its draft can never starve it
+DRAFT_EXECUTOR = ThreadPoolExecutor(max_workers=RECOMMENDATION_WORKERS, thread_name_prefix="draft")
+DRAFT_JOBS = {}                  # call_sid -> Future for the speculative draft (.started: unix time)
+SPECULATIVE_STATS = {"drafts": 0, "reused": 0, "refined": 0, "refine_failed": 0, "missed": 0}
+STATS_LOCK = threading.Lock()
+TRACER = CallTracer(max_calls=TRACE_MAX_CALLS)
+JOB_SWEEP_INTERVAL = 30          # seconds between sweeps for abandoned jobs
+LAST_JOB_SWEEP = 0.0
+
+# ------------------ QUESTION FLOW (question_flow.json, see flow.py) ------------------
+FLOW = compile_flow(load_flow(QUESTION_FLOW_FILE))
+QUESTION_FLOW = FLOW.questions
+seed_question_ids(FLOW.index)   # answers store question ids as their index here
 
 FALLBACK_MESSAGES = {"en": "I did not hear you. Let me ask again.", "hi": "मैंने आपको नहीं सुना। मैं फिर से पूछता हूं।", "gu": "મેં તમને સાંભળ્યું નહીં. હું ફરીથી પૂછું છું."}
 
@@ -112,72 +176,188 @@ VOICE_CONFIG = {
 
 # ---------------- helpers ----------------
 def get_session(call_sid, caller):
-    if call_sid not in SESSIONS:
-        SESSIONS[call_sid] = {"call_sid": call_sid, "caller": caller, "q_index": 0, "lang": "en", "answers": [], "created": time.time()}
-    return SESSIONS[call_sid]
+    session = SESSION_STORE.get(call_sid)
+    if session is None:
+        session = Session(call_sid, caller, scores=[0.0] * len(CATEGORIES), created=time.time())
+        SESSION_STORE.put(session)
+    elif TRANSCRIPTS:
+        apply_transcripts(session)
+    return session
+
+def save_session(session):
+    """Write back whatever a webhook handler changed (a no-op refresh for the memory store)."""
+    SESSION_STORE.put(session)
+
+def log_event(type, session=None, **fields):
+    """Queue one event for the durable log (no-op when EVENT_LOG_DIR is empty)."""
+    if EVENT_LOG is None:
+        return
+    if session is not None:
+        fields["call_sid"] = session.call_sid
+    EVENT_LOG.emit(type, **fields)
 
 def advance(session):
-    session["q_index"] = min(session["q_index"] + 1, len(QUESTION_FLOW) - 1)
+    """Move to the next question the flow picks for the running scores (branches, skip rules, early exit)."""
+    q_index = session.q_index
+    answered = sum(1 for a in session.answers if is_informative(a))
+    nxt, skipped, early_exit = FLOW.next_index(q_index, session_scores(session), answered)
+    if skipped:
+        log_event("flow_skip", session, question_ids=skipped)
+    if early_exit is not None:
+        log_event("early_exit", session, rule=early_exit, from_id=QUESTION_FLOW[q_index]["id"], to_id=QUESTION_FLOW[nxt]["id"])
+        log.info("early exit", call_sid=session.call_sid, rule=early_exit,
+                 from_id=QUESTION_FLOW[q_index]["id"], to_id=QUESTION_FLOW[nxt]["id"])
+    session.q_index = nxt
+
+# ---------- Metrics ----------
+HTTP_LATENCY = REGISTRY.histogram("careerbuddy_http_request_duration_seconds", "Webhook handling time.", ("endpoint", "status"))
+GEMINI_LATENCY = REGISTRY.histogram("careerbuddy_gemini_request_duration_seconds", "generate_content call time.", ("kind", "outcome"))
+GEMINI_CIRCUIT_OPENS = REGISTRY.counter("careerbuddy_gemini_circuit_opens_total", "Times the Gemini circuit breaker opened.")
+GEMINI_REJECTED = REGISTRY.counter("careerbuddy_gemini_rejected_total", "Gemini calls refused before reaching the API.", ("kind", "reason"))
+RECOMMENDATION_FALLBACKS = REGISTRY.counter("careerbuddy_recommendation_fallbacks_total", "Final recommendations served by rule_based_careers.", ("reason",))
+PROMPT_TOKENS = REGISTRY.histogram("careerbuddy_gemini_prompt_tokens", "Estimated prompt size per recommendation call.", ("kind",),
+                                   buckets=(50, 100, 200, 300, 400, 600, 800, 1200, 2000))
+REGISTRY.gauge("careerbuddy_sessions", "Sessions held by the session store.",
+               fn=lambda: len(SESSION_STORE) if SESSION_STORE.countable else None)
+REGISTRY.gauge("careerbuddy_webhook_dedup_entries", "Webhook responses held for retry replay.", fn=lambda: len(WEBHOOK_DEDUP))
+WEBHOOK_REPLAYS = REGISTRY.counter("careerbuddy_webhook_replays_total", "Twilio retries answered from the dedup cache.", ("endpoint",))
+REGISTRY.gauge("careerbuddy_recommendation_cache_entries", "Entries in the recommendation cache.", fn=lambda: len(RECOMMENDATION_CACHE))
+REGISTRY.counter_func("careerbuddy_recommendation_cache_hits_total", "Recommendation cache hits.", fn=lambda: RECOMMENDATION_CACHE.hits)
+REGISTRY.counter_func("careerbuddy_recommendation_cache_misses_total", "Recommendation cache misses.", fn=lambda: RECOMMENDATION_CACHE.misses)
+REGISTRY.counter_func("careerbuddy_events_written_total", "Events written to the event log.", fn=lambda: EVENT_LOG.written if EVENT_LOG else 0)
+REGISTRY.counter_func("careerbuddy_events_dropped_total", "Events dropped because the writer fell behind.", fn=lambda: EVENT_LOG.dropped if EVENT_LOG else 0)
+TRANSCRIPTION_LATENCY = REGISTRY.histogram("careerbuddy_transcription_duration_seconds", "Recording fetch + speech-to-text time.", ("outcome",))
+TRANSCRIPTION_REJECTED = REGISTRY.counter("careerbuddy_transcriptions_rejected_total", "Recordings not transcribed because the queue was full.")
+REGISTRY.gauge("careerbuddy_transcriptions_pending", "Recordings queued or being transcribed.", fn=lambda: len(TRANSCRIPTION) if TRANSCRIPTION is not None else 0)
+REGISTRY.gauge("careerbuddy_recommendation_jobs", "Final recommendation jobs not yet delivered.", fn=lambda: len(RECOMMENDATION_JOBS))
+REGISTRY.counter_func("careerbuddy_log_records_dropped_total", "Log records dropped because the writer fell behind.", fn=lambda: log_stats()["dropped"])
+REGISTRY.gauge("careerbuddy_log_records_queued", "Log records waiting for the writer thread.", fn=lambda: log_stats()["queued"])
+
+def observe_gemini(kind, outcome, seconds):
+    GEMINI_LATENCY.observe(seconds, kind=kind, outcome=outcome)
+    now = time.time()
+    TRACER.span(None, "gemini", now - seconds, now, kind=kind, outcome=outcome)
+    log_event("gemini", call_sid=CURRENT_CALL.get(), kind=kind, outcome=outcome, seconds=round(seconds, 4))
+
+def trace_webhook(call_sid, endpoint, status, q_index, seconds):
+    """Stamp one webhook for the call's timeline: an in-memory span plus a durable latency event."""
+    if not call_sid:
+        return
+    now = time.time()
+    TRACER.span(call_sid, "webhook", now - seconds, now, endpoint=endpoint, status=status, q_index=q_index)
+    log_event("latency", call_sid=call_sid, endpoint=endpoint, status=status, q_index=q_index, seconds=round(seconds, 4))
+
+GEMINI = GeminiClient(
+    rate_per_minute=GEMINI_RPM, burst=GEMINI_BURST, max_concurrent=GEMINI_MAX_CONCURRENT,
+    max_retries=MAX_GEMINI_RETRIES, failure_threshold=GEMINI_FAILURE_THRESHOLD, reset_timeout=GEMINI_RESET_TIMEOUT,
+    deadlines=GEMINI_DEADLINES,
+    on_open=lambda delay: GEMINI_CIRCUIT_OPENS.inc(),
+    observe=lambda kind, outcome, seconds: observe_gemini(kind, outcome, seconds),
+    on_reject=lambda kind, reason: GEMINI_REJECTED.inc(kind=kind, reason=reason),
+)
+def gemini_models():
+    """
+    (model, refine model), importing and configuring google.generativeai on first use so
+    importing app.py stays cheap. Both are None without GEMINI_API_KEY or if setup fails.
+    """
+    global genai_model, genai_refine_model, GEMINI_MODELS_READY
+    if GEMINI_MODELS_READY or genai_model is not None:
+        return genai_model, genai_refine_model
+    with GEMINI_INIT_LOCK:
+        if not GEMINI_MODELS_READY and genai_model is None:
+            if GEMINI_API_KEY:
+                try:
+                    import google.generativeai as genai
+                    genai.configure(api_key=GEMINI_API_KEY)
+                    genai_model = genai.GenerativeModel(GEMINI_MODEL)
+                    genai_refine_model = genai.GenerativeModel(GEMINI_REFINE_MODEL)
+                    log.info("gemini configured", model=GEMINI_MODEL, refine_model=GEMINI_REFINE_MODEL)
+                except Exception as e:
+                    log.warning("could not configure gemini", error=str(e))
+                    genai_model = genai_refine_model = None
+            else:
+                log.warning("GEMINI_API_KEY not set, running with rule-based fallbacks only")
+            GEMINI_MODELS_READY = True
+    return genai_model, genai_refine_model
+
+REGISTRY.gauge("careerbuddy_gemini_circuit_state", "0 closed, 1 half-open, 2 open.",
+               fn=lambda: {"closed": 0, "half_open": 1, "open": 2}[GEMINI.breaker.state])
+
+@webhooks.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    # Gemini spans recorded while handling this webhook belong to its call
+    CURRENT_CALL.set(request.form.get("CallSid") if request.method == "POST" else None)
+
+@webhooks.after_app_request
+def observe_latency(resp):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        seconds = time.perf_counter() - started
+        HTTP_LATENCY.observe(seconds, endpoint=endpoint, status=resp.status_code)
+        if request.method == "POST":
+            trace_webhook(request.form.get("CallSid"), endpoint, resp.status_code, request.args.get("q_index"), seconds)
+    return resp
+
+RECORD_LOCK = threading.Lock()
+
+def record_webhook(path, query, form):
+    line = json.dumps({"t": time.time(), "path": path, "query": query, "form": form}, ensure_ascii=False)
+    with RECORD_LOCK, open(WEBHOOK_RECORD_FILE, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+@webhooks.before_app_request
+def record_flask_webhook():
+    if WEBHOOK_RECORD_FILE and request.method == "POST":
+        record_webhook(request.path, request.query_string.decode(), request.form.to_dict())
 
 def rule_based_decision(session):
-    texts = " ".join([a.get("transcript","") for a in session["answers"]]).lower()
-    ENG_KEYWORDS = {"engineer","engineering","math","physics","computer","coding","electronics","mechanical","civil","electrical"}
-    MED_KEYWORDS = {"medical","medicine","doctor","biology","surgery","patient","pharmacy","nurse","health"}
-    eng_score = sum(1 for kw in ENG_KEYWORDS if kw in texts)
-    med_score = sum(1 for kw in MED_KEYWORDS if kw in texts)
-    # check explicit stream q2 (user may state stream)
-    for a in session["answers"]:
-        if a["question_id"] == "q2":
-            t = (a.get("transcript") or "").lower()
-            if "engineer" in t or "engineering" in t:
+    scores = session_scores(session)
+    eng_score, med_score = int(scores["engineering"]), int(scores["medical"])
+    # check the explicit stream question (user may state stream)
+    stream_id = FLOW.roles.get("stream")
+    for a in session.answers:
+        if a.question_id == stream_id:
+            explicit = dict(zip(EXPLICIT_INDEX.categories, EXPLICIT_INDEX.score(a.transcript)))
+            if explicit["engineering"]:
                 return "Engineering", "You explicitly mentioned engineering."
-            if "medical" in t or "doctor" in t or "medicine" in t:
+            if explicit["medical"]:
                 return "Medical", "You explicitly mentioned medical."
     if eng_score >= med_score:
         return "Engineering", f"Detected engineering-leaning answers ({eng_score} vs {med_score})."
     return "Medical", f"Detected medical-leaning answers ({med_score} vs {eng_score})."
 
-def set_gemini_cooldown_from_exception(e):
-    global GENIE_DISABLED_UNTIL
-    s = str(e).lower()
-    delay = 30
-    try:
-        # try parse numeric seconds from the error text
-        m = re.search(r"seconds[:=]?\s*(\d+)", s)
-        if m:
-            delay = int(m.group(1)) + 2
-        elif "quota" in s or "429" in s:
-            delay = 60
-    except Exception:
-        delay = 30
-    GENIE_DISABLED_UNTIL = time.time() + delay
-    print(f"[gemini] disabled until {GENIE_DISABLED_UNTIL} (delay {delay}s) due to error: {e}")
+CANNED_ACKS = {"en":["Thanks, noted.","Got it.","Noted."], "hi":["धन्यवाद, नोट कर लिया।","ठीक है।"], "gu":["આભાર, નોંધ્યું.","બરાબર."]}
 
 def canned_ack(lang_code):
-    canned = {"en":["Thanks, noted.","Got it.","Noted."], "hi":["धन्यवाद, नोट कर लिया।","ठीक है।"], "gu":["આભાર, નોંધ્યું.","બરાબર."]}
-    arr = canned.get(lang_code, canned["en"])
+    arr = CANNED_ACKS.get(lang_code, CANNED_ACKS["en"])
     return arr[int(time.time()) % len(arr)]
 
-def gemini_generate_ack(transcript, lang_code):
-    """Return a short ack. Uses Gemini only if allowed and not in cooldown."""
-    now = time.time()
-    if not genai_model or not USE_GEMINI_FOR_ACKS or now < GENIE_DISABLED_UNTIL:
-        return canned_ack(lang_code)
+def gemini_ack_allowed():
+    return USE_GEMINI_FOR_ACKS and GEMINI.available() and gemini_models()[0] is not None
 
+def ack_prompt(transcript, lang_code):
     prompt_map = {
         "en": f"Short acknowledgement (<=6 words) in English for: \"{transcript}\"",
         "hi": f"'{transcript}' के जवाब के लिए 6 शब्द से कम में एक संक्षिप्त स्वीकृति दें।",
         "gu": f"\"{transcript}\" માટે 6 શબ્દોથી ઓછી એક ટૂંકી સ્વીકૃતિ આપો."
     }
-    prompt = prompt_map.get(lang_code, prompt_map["en"])
+    return prompt_map.get(lang_code, prompt_map["en"])
+
+def gemini_generate_ack(transcript, lang_code):
+    """Return a short ack. Uses Gemini only if allowed and the circuit is not open."""
+    if not gemini_ack_allowed():
+        return canned_ack(lang_code)
+
+    prompt = ack_prompt(transcript, lang_code)
     try:
-        r = genai_model.generate_content([{"text": prompt}])
+        r = GEMINI.generate(gemini_models()[0], [{"text": prompt}], "ack")
         out = getattr(r, "text", None)
         if out:
             return out.strip().splitlines()[0]
     except Exception as e:
-        print("Gemini ack error:", e)
-        set_gemini_cooldown_from_exception(e)
+        log.warning("gemini ack failed", error=str(e))
     return canned_ack(lang_code)
 
 
@@ -246,22 +426,22 @@ def tts_chunks(text: str, max_len: int = 160) -> list:
 
 # ---------- New: career suggestions (Gemini + fallback) ----------
 
+CAREER_SUGGESTIONS = {
+    "engineering": ("Engineering (Computer/IT/Mech)", "Good at logical thinking & maths.", "Next: focus on maths & physics in 11th; try basic coding."),
+    "medical": ("Medical / Allied Health", "Interest in life sciences and helping people.", "Next: explore Biology in 11th; talk to a local clinic/paramedical course."),
+    "creative": ("Design / Creative fields", "Strong creative and visual interest.", "Next: build a small portfolio; try art/design classes."),
+    "trades": ("Trades / Diploma (ITI)", "Enjoys hands-on practical work.", "Next: look into local ITI or diploma courses."),
+}
+
 def rule_based_careers(session, lang_code):
     """
-    Fallback short 2-3 career suggestions based on simple keyword heuristics.
+    Fallback short 2-3 career suggestions ranked by the session's keyword scores.
     Returns a single string in the requested language ready for TTS.
     """
-    texts = " ".join([a.get("transcript","") for a in session["answers"]]).lower()
-    suggestions = []
-
-    if any(w in texts for w in ("math", "physics", "computer", "coding", "electronics", "engineer", "mechanical", "civil", "electrical")):
-        suggestions.append(("Engineering (Computer/IT/Mech)", "Good at logical thinking & maths.", "Next: focus on maths & physics in 11th; try basic coding."))
-    if any(w in texts for w in ("medical", "doctor", "biology", "patient", "nurse", "pharmacy")):
-        suggestions.append(("Medical / Allied Health", "Interest in life sciences and helping people.", "Next: explore Biology in 11th; talk to a local clinic/paramedical course."))
-    if any(w in texts for w in ("creative", "draw", "art", "design", "writing")):
-        suggestions.append(("Design / Creative fields", "Strong creative and visual interest.", "Next: build a small portfolio; try art/design classes."))
-    if any(w in texts for w in ("hands", "fix", "mechanic", "tools", "practical", "build")):
-        suggestions.append(("Trades / Diploma (ITI)", "Enjoys hands-on practical work.", "Next: look into local ITI or diploma courses."))
+    scores = session_scores(session)
+    # strongest categories first; ties keep the CAREER_SUGGESTIONS order
+    ranked = sorted((c for c in CAREER_SUGGESTIONS if scores.get(c, 0) > 0), key=lambda c: -scores[c])
+    suggestions = [CAREER_SUGGESTIONS[c] for c in ranked]
 
     if not suggestions:
         suggestions = [
@@ -293,10 +473,28 @@ def gemini_final_recommendation(session, lang_code):
     Returns a single text block (language-specific) ready for TwiML say().
     If Gemini is not configured or errors, uses rule_based_careers(...) fallback.
     """
-    if not genai_model or time.time() < GENIE_DISABLED_UNTIL:
-        return rule_based_careers(session, lang_code)
+    text = gemini_recommendation_text(session, lang_code)
+    if text:
+        cache_recommendation(session, lang_code, text)
+        return text
+    RECOMMENDATION_FALLBACKS.inc(reason="model_unavailable")
+    return rule_based_careers(session, lang_code)
+
+def report_prompt_size(prompt, kind, block):
+    tokens = estimate_tokens(prompt)
+    PROMPT_TOKENS.observe(tokens, kind=kind)
+    st = block.stats
+    log.info("prompt built", kind=kind, chars=len(prompt), tokens=tokens, lines=len(block.lines), **st)
 
-    answers_blob = "\n".join([f"{a['question_id']}: {a['transcript']}" for a in session["answers"]])
+def gemini_recommendation_text(session, lang_code, kind="final"):
+    """Model-only part of gemini_final_recommendation: returns the text, or None if Gemini is unavailable."""
+    model = gemini_models()[0]
+    if not model or not GEMINI.available():
+        return None
+
+    # short "topic: answer" lines within PROMPT_TOKEN_BUDGET (placeholders and repeats removed)
+    block = build_answers_block(session.answers, PROMPT_TOKEN_BUDGET, FLOW.tags)
+    answers_blob = block.text
     prompts = {
         "en": (
             "You are a friendly, concise career counselor. The student is in 10th standard. "
@@ -319,97 +517,601 @@ def gemini_final_recommendation(session, lang_code):
     }
 
     prompt = prompts.get(lang_code, prompts["en"])
+    report_prompt_size(prompt, kind, block)
     try:
-        r = genai_model.generate_content([{"text": prompt}])
+        r = GEMINI.generate(model, [{"text": prompt}], kind)
         out = getattr(r, "text", None)
         if out and out.strip():
             return out.strip()
     except Exception as e:
-        print("Gemini final error:", e)
-        set_gemini_cooldown_from_exception(e)
+        log.warning("gemini recommendation failed", kind=kind, error=str(e))
 
-    return rule_based_careers(session, lang_code)
+    return None
 
-# ---------------- Twilio endpoints ----------------
-@app.route("/voice", methods=["POST"])
-def voice():
-    call_sid = request.form.get("CallSid")
-    caller = request.form.get("From")
-    session = get_session(call_sid, caller)
+# ---------- Speculative draft + refinement ----------
+NO_ANSWER_PREFIXES = ("(no speech captured)", "(recording:")
+
+def is_informative(answer):
+    t = (answer.get("transcript") or "").strip()
+    return bool(t) and not t.startswith(NO_ANSWER_PREFIXES)
+
+def values_answers(session):
+    """Answers given after the aptitude block (the values questions)."""
+    cut = FLOW.speculative_after
+    if cut is None:
+        return []
+    values_ids = {q["id"] for q in QUESTION_FLOW[cut + 1:]}
+    return [a for a in session.answers if a.question_id in values_ids]
+
+def gemini_refine_recommendation(draft, answers, lang_code):
+    """
+    Cheaper follow-up call: adjust an existing draft using only the values answers.
+    Returns the refined text, or None so the caller can fall back to the draft.
+    """
+    model, refine_model = gemini_models()
+    model = refine_model or model
+    if not model or not GEMINI.available():
+        return None
 
+    block = build_answers_block(answers, PROMPT_TOKEN_BUDGET, FLOW.tags)
+    answers_blob = block.text
+    prompts = {
+        "en": (
+            "Below is a draft list of career suggestions for a 10th standard student, followed by their answers about values "
+            "(money, job security, helping people, work-life balance). Adjust the list if the values point elsewhere, "
+            "keep the same numbered format and length.\n\n"
+            f"Draft:\n{draft}\n\nValues answers:\n{answers_blob}\n\nReply with the final list only."
+        ),
+        "hi": (
+            "नीचे 10वीं कक्षा के छात्र के लिए करियर सुझावों की एक ड्राफ्ट सूची है, और उसके बाद उसके मूल्यों (पैसा, स्थिर नौकरी, लोगों की मदद, संतुलित जीवन) के उत्तर हैं। "
+            "अगर उत्तर किसी और दिशा में इशारा करें तो सूची बदलें, वही नंबरित प्रारूप और लंबाई रखें।\n\n"
+            f"ड्राफ्ट:\n{draft}\n\nउत्तर:\n{answers_blob}\n\nसिर्फ अंतिम सूची लिखें।"
+        ),
+        "gu": (
+            "નીચે 10મા ધોરણના વિદ્યાર્થી માટે કારકિર્દી સૂચનોની ડ્રાફ્ટ સૂચિ છે, અને પછી તેના મૂલ્યો (પૈસા, સ્થિર નોકરી, લોકોની મદદ, સંતુલિત જીવન) વિશેના જવાબો છે. "
+            "જો જવાબો બીજી દિશા બતાવે તો સૂચિ બદલો, એ જ નંબરિત રીત અને લંબાઈ રાખો.\n\n"
+            f"ડ્રાફ્ટ:\n{draft}\n\nજવાબો:\n{answers_blob}\n\nફક્ત અંતિમ સૂચિ લખો."
+        )
+    }
+
+    prompt = prompts.get(lang_code, prompts["en"])
+    report_prompt_size(prompt, "refine", block)
+    try:
+        r = GEMINI.generate(model, [{"text": prompt}], "refine")
+        out = getattr(r, "text", None)
+        if out and out.strip():
+            return out.strip()
+    except Exception as e:
+        log.warning("gemini refine failed", error=str(e))
+    return None
+
+def bump_speculative_stat(name):
+    with STATS_LOCK:
+        SPECULATIVE_STATS[name] += 1
+
+def speculative_stats():
+    with STATS_LOCK:
+        stats = dict(SPECULATIVE_STATS)
+    finals = stats["reused"] + stats["refined"] + stats["refine_failed"] + stats["missed"]
+    stats["enabled"] = SPECULATIVE_RECOMMENDATIONS
+    stats["hit_rate"] = round(stats["reused"] / finals, 3) if finals else 0.0
+    stats["draft_use_rate"] = round((stats["reused"] + stats["refined"]) / finals, 3) if finals else 0.0
+    return stats
+
+def start_draft_recommendation(session):
+    """Fire the speculative draft from the aptitude answers (once per call)."""
+    call_sid = session.call_sid
+    if call_sid in DRAFT_JOBS or not gemini_models()[0]:
+        return
+    snapshot = session.snapshot()
+    future = DRAFT_EXECUTOR.submit(bind(call_sid, gemini_recommendation_text), snapshot, session.lang, "draft")
+    future.started = time.time()
+    DRAFT_JOBS[call_sid] = future
+    bump_speculative_stat("drafts")
+    log.info("speculative draft started", call_sid=call_sid)
+
+def speculative_final_recommendation(session, lang_code, draft_future):
+    """
+    Final job when a draft exists: reuse it as-is if the values answers add nothing,
+    otherwise refine it; fall back to the full prompt if the draft or the refine failed
+    (the draft alone ignores the values answers, so it is never cached under their fingerprint).
+    """
+    try:
+        draft = draft_future.result(timeout=RECOMMENDATION_DEADLINE)
+    except Exception as e:
+        log.warning("speculative draft unavailable", error=str(e))
+        draft = None
+    if not draft:
+        bump_speculative_stat("missed")
+        return gemini_final_recommendation(session, lang_code)
+
+    extra = [a for a in values_answers(session) if is_informative(a)]
+    if not extra:
+        bump_speculative_stat("reused")
+        cache_recommendation(session, lang_code, draft)
+        return draft
+    refined = gemini_refine_recommendation(draft, extra, lang_code)
+    if not refined:
+        bump_speculative_stat("refine_failed")
+        return gemini_final_recommendation(session, lang_code)
+    bump_speculative_stat("refined")
+    cache_recommendation(session, lang_code, refined)
+    return refined
+
+# ---------- Recommendation cache ----------
+def recommendation_cache_key(session, lang_code):
+    # the student's name doesn't change the advice
+    skip = {FLOW.roles["name"]} if "name" in FLOW.roles else ()
+    return answers_fingerprint(session.answers, lang_code, FLOW.index, skip)
+
+def cache_recommendation(session, lang_code, text):
+    """Store model output for this answer fingerprint, unless it mentions the caller's name."""
+    name_id = FLOW.roles.get("name")
+    name = next((a.transcript for a in session.answers if a.question_id == name_id), "")
+    if is_informative({"transcript": name}) and name.strip().lower() in text.lower():
+        return
+    RECOMMENDATION_CACHE.put(recommendation_cache_key(session, lang_code), text)
+
+# ---------- Recording transcription ----------
+def patch_transcript(session, recording_sid, text):
+    """
+    Replace a recording's placeholder answer with its transcript and rescore. True if anything changed.
+    The Answer is swapped for a new one rather than edited, since snapshots share Answer objects.
+    """
+    for i, a in enumerate(session.answers):
+        if a.recording_sid == recording_sid and (a.transcript or "").startswith("(recording:"):
+            session.answers[i] = Answer(a.qid, text, a.confidence, recording_sid, transcribed=True)
+            session.scores = score_answers(session.answers)
+            return True
+    return False
+
+def transcript_ready(job, text):
+    """
+    TranscriptionPool callback (worker thread). The text waits in TRANSCRIPTS for the call's next
+    webhook, which applies it on the request thread; a memory-store session is the live object
+    that webhook mutates, so it is never patched from here. Shared stores hand out copies, so
+    the text is also written through for the workers that serve the rest of the call.
+    """
+    call_sid = job["call_sid"]
+    with TRANSCRIPTS_LOCK:
+        TRANSCRIPTS.setdefault(call_sid, {})[job["recording_sid"]] = text
+        TRANSCRIPTS.move_to_end(call_sid)
+        while len(TRANSCRIPTS) > TRANSCRIPTS_MAX:
+            TRANSCRIPTS.popitem(last=False)
+    if not SESSION_STORE.live:
+        # a webhook saving an older copy can undo this; the next get_session here re-applies it
+        session = SESSION_STORE.get(call_sid)
+        if session is not None and patch_transcript(session, job["recording_sid"], text):
+            save_session(session)
+    log_event("transcript", call_sid=call_sid, recording_sid=job["recording_sid"], transcript=text)
+    log.info("recording transcribed", call_sid=call_sid, recording_sid=job["recording_sid"], chars=len(text))
+    log.debug("transcript", call_sid=call_sid, recording_sid=job["recording_sid"], transcript=text)
+
+def apply_transcripts(session):
+    with TRANSCRIPTS_LOCK:
+        done = TRANSCRIPTS.pop(session.call_sid, None)
+    for recording_sid, text in (done or {}).items():
+        patch_transcript(session, recording_sid, text)
+
+def wait_for_transcripts(session, futures):
+    """Patch recordings still being transcribed into the job's snapshot, waiting TRANSCRIBE_WAIT at most in total."""
+    deadline = time.time() + TRANSCRIBE_WAIT
+    for fut in futures:
+        try:
+            text = fut.result(timeout=max(0.0, deadline - time.time()))
+        except Exception:
+            continue   # timed out or failed: the placeholder stays
+        if text:
+            patch_transcript(session, fut.job["recording_sid"], text)
+
+def observe_transcription(outcome, seconds):
+    TRANSCRIPTION_LATENCY.observe(seconds, outcome=outcome)
+
+# ---------- Background recommendation jobs ----------
+HOLD_MESSAGES = {"en": "Please stay on the line, almost ready.", "hi": "कृपया लाइन पर बने रहें, लगभग तैयार है।", "gu": "કૃપા કરીને લાઇન પર રહો, લગભગ તૈયાર છે."}
+
+def start_recommendation_job(session):
+    """
+    Submit gemini_final_recommendation to the background pool (once per call, across the
+    workers sharing the session store). The job gets a snapshot of the answers so later
+    webhooks can't mutate it mid-prompt. Returns the Future, or None if another worker runs it.
+    """
+    call_sid = session.call_sid
+    if call_sid in RECOMMENDATION_JOBS:
+        return RECOMMENDATION_JOBS[call_sid]
+    if not SESSION_STORE.put_if_absent(recommendation_key(call_sid), "", RECOMMENDATION_JOB_TTL):
+        return None   # another worker's job; poll_recommendation reads its text from the store
+    snapshot = session.snapshot()
+    draft_future = DRAFT_JOBS.pop(call_sid, None)
+    transcripts = TRANSCRIPTION.pending(call_sid) if TRANSCRIPTION is not None else []
+    # recordings still being transcribed will change the answers, so they skip the cache
+    cached = None if transcripts else RECOMMENDATION_CACHE.get(recommendation_cache_key(snapshot, session.lang))
+    if cached:
+        # served instantly: the first /recommendation_status poll finds the job done
+        future = Future()
+        future.set_result(cached)
+        if draft_future is not None:
+            draft_future.cancel()
+    elif draft_future is not None:
+        # queued once the draft is done, so no pool thread sits waiting on it
+        future = submit_after(draft_future, bind(call_sid, final_recommendation_job), snapshot, session.lang,
+                              draft_future, transcripts)
+    else:
+        future = RECOMMENDATION_EXECUTOR.submit(bind(call_sid, final_recommendation_job), snapshot, session.lang,
+                                                draft_future, transcripts)
+    future.started = started = time.time()
+    RECOMMENDATION_JOBS[call_sid] = future
+    session.rec_started = started
+    source = "cache" if cached else "speculative" if draft_future is not None else "model"
+    future.add_done_callback(lambda f: TRACER.span(call_sid, "recommendation_job", started, time.time(), source=source))
+    future.add_done_callback(lambda f: publish_recommendation(call_sid, f))
+    log_event("recommendation_job", session, source=source)
+    log.info("recommendation job started", call_sid=call_sid, source=source)
+    return future
+
+def submit_after(first, fn, *args):
+    """Future for fn(*args), submitted to RECOMMENDATION_EXECUTOR when `first` is done."""
+    out = Future()
+
+    def settle(job):
+        try:
+            if job.cancelled():
+                out.cancel()
+            elif job.exception() is not None:
+                out.set_exception(job.exception())
+            else:
+                out.set_result(job.result())
+        except InvalidStateError:
+            pass   # cancelled by the poll deadline meanwhile
+
+    def start(_):
+        if out.cancelled():
+            return
+        try:
+            RECOMMENDATION_EXECUTOR.submit(fn, *args).add_done_callback(settle)
+        except RuntimeError as e:   # pool shut down
+            out.set_exception(e)
+
+    first.add_done_callback(start)
+    return out
+
+def recommendation_key(call_sid):
+    return f"rec:{call_sid}"
+
+def publish_recommendation(call_sid, future):
+    """Done callback: share the job's text through the session store (a failed job publishes nothing)."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        SESSION_STORE.put_value(recommendation_key(call_sid), future.result(), RECOMMENDATION_JOB_TTL)
+    except Exception as e:
+        log.error("could not publish recommendation", call_sid=call_sid, error=str(e))
+
+def final_recommendation_job(session, lang_code, draft_future=None, transcripts=()):
+    """The background final job: pick up pending transcripts, then the speculative or full model path."""
+    if transcripts:
+        wait_for_transcripts(session, transcripts)
+    if draft_future is not None:
+        return speculative_final_recommendation(session, lang_code, draft_future)
+    return gemini_final_recommendation(session, lang_code)
+
+def sweep_jobs():
+    """
+    Drop jobs and drafts older than RECOMMENDATION_JOB_TTL. poll_recommendation removes a job
+    once its text is spoken and start_recommendation_job takes the draft, so what's left
+    belongs to calls that hung up while holding, or before reaching the end.
+    """
+    global LAST_JOB_SWEEP
+    now = time.time()
+    if now - LAST_JOB_SWEEP < JOB_SWEEP_INTERVAL:
+        return
+    LAST_JOB_SWEEP = now
+    for jobs in (RECOMMENDATION_JOBS, DRAFT_JOBS):
+        for call_sid, future in list(jobs.items()):
+            if now - future.started > RECOMMENDATION_JOB_TTL:
+                future.cancel()
+                jobs.pop(call_sid, None)
+
+def maybe_start_recommendation(session):
+    """
+    Kick off the final recommendation as soon as the session reaches the 'end' item,
+    and (in speculative mode) the draft once the aptitude block is done.
+    """
+    sweep_jobs()
+    q_index = session.q_index
+    if QUESTION_FLOW[q_index]["id"] == "end":
+        start_recommendation_job(session)
+    elif SPECULATIVE_RECOMMENDATIONS and FLOW.speculative_after is not None and session.answers:
+        # the flow may skip the speculative_after question itself, so look for the step across it
+        cut = FLOW.speculative_after
+        if FLOW.index.get(session.answers[-1].question_id, q_index) <= cut < q_index:
+            start_draft_recommendation(session)
+
+def poll_recommendation(session):
+    """
+    Non-blocking check of the background job.
+    Returns the final text when ready, the rule-based fallback once the deadline passes,
+    or None if the caller should keep holding.
+    """
+    if session.final_text:
+        return session.final_text
+    call_sid = session.call_sid
+    future = RECOMMENDATION_JOBS.get(call_sid) or start_recommendation_job(session)
+    outcome = "ready"
+    shared = None
+    if future is None:
+        shared = SESSION_STORE.get_value(recommendation_key(call_sid))
+        if session.rec_started is None:
+            session.rec_started = time.time()   # the owner's save hasn't reached us yet
+    if shared:
+        final_text = shared   # finished on the worker that runs the job
+    elif future is not None and future.done():
+        try:
+            final_text = future.result()
+        except Exception as e:
+            log.error("recommendation job failed", call_sid=call_sid, error=str(e))
+            RECOMMENDATION_FALLBACKS.inc(reason="job_error")
+            final_text = rule_based_careers(session, session.lang)
+            outcome = "job_error"
+    elif time.time() - (session.rec_started or time.time()) > RECOMMENDATION_DEADLINE:
+        if future is not None:
+            future.cancel()
+        log.warning("recommendation deadline passed, using rule-based fallback", call_sid=call_sid)
+        RECOMMENDATION_FALLBACKS.inc(reason="deadline")
+        final_text = rule_based_careers(session, session.lang)
+        outcome = "deadline"
+    else:
+        return None
+    RECOMMENDATION_JOBS.pop(call_sid, None)
+    session.final_text = final_text
+    log_event("recommendation", session, outcome=outcome, lang=session.lang, text=final_text,
+              wait=round(time.time() - (session.rec_started or time.time()), 3))
+    return final_text
+
+def say_final_recommendation(resp, final_text, voice_cfg):
+    """Speak the final text in TTS-friendly chunks and hang up."""
+    try:
+        chunks = tts_chunks(final_text, max_len=160)
+        if not chunks:
+            chunks = [final_text or ("Thanks. Could not prepare a suggestion right now.")]
+        for chunk in chunks:
+            try:
+                resp.say(chunk, voice=voice_cfg["voice"], language=voice_cfg["language"])
+            except Exception:
+                resp.say(chunk, voice="alice", language=voice_cfg["language"])
+            resp.pause(length=1)
+    except Exception:
+        # fallback if tts_chunks or speak fails
+        try:
+            resp.say(final_text, voice=voice_cfg["voice"], language=voice_cfg["language"])
+        except Exception:
+            resp.say(final_text or "Thanks. Unable to prepare suggestion right now.", voice="alice", language=voice_cfg["language"])
+    resp.hangup()
+
+# ---------- TwiML templates (pre-rendered per question/language) ----------
+LANGUAGE_CONFIRMATIONS = {"en": "Great — continuing in English.", "hi": "ठीक है, अब मैं हिंदी में पूछूंगा।", "gu": "સારું, હવે હું ગુજરાતી માં પૂછિશ."}
+MENU_INTRO_TEXT = "Hello — I am Career Buddy. Please pick a language by pressing a button."
+MENU_OPTIONS = (("menu_1", "Press 1 for English."), ("menu_2", "Press 2 for Hindi."), ("menu_3", "Press 3 for Gujarati."))
+LANGUAGE_DEFAULT_TEXT = "Could not detect language. Defaulting to English."
+MENU_VOICE = {"voice": "Google.en-IN-Wavenet-D", "language": "en-IN"}
+TWIML_CACHE = {}                 # key -> rendered TwiML bytes
+TWIML_CACHE_FLOW = None          # the QUESTION_FLOW object the cache was built from
+
+def speak(verb, clip_id, text, lang, voice_cfg):
+    """<Play> the pre-rendered clip for this prompt if there is one, else <Say> it."""
+    url = AUDIO_CACHE.url_for(clip_id, text, lang, voice_cfg["voice"]) if AUDIO_CACHE else None
+    if url:
+        verb.play(url)
+    else:
+        verb.say(text, voice=voice_cfg["voice"], language=voice_cfg["language"])
+
+def audio_prompts():
+    """Every fixed prompt as (clip id, text, lang, voice) — what audio_cache.py renders."""
+    yield "menu_intro", MENU_INTRO_TEXT, "en", MENU_VOICE["voice"]
+    for clip_id, text in MENU_OPTIONS:
+        yield clip_id, text, "en", MENU_VOICE["voice"]
+    yield "language_default", LANGUAGE_DEFAULT_TEXT, "en", MENU_VOICE["voice"]
+    for lang, voice_cfg in VOICE_CONFIG.items():
+        yield "language_confirm", LANGUAGE_CONFIRMATIONS[lang], lang, voice_cfg["voice"]
+        yield "hold", HOLD_MESSAGES[lang], lang, voice_cfg["voice"]
+        for ack in CANNED_ACKS.get(lang, CANNED_ACKS["en"]):
+            yield "ack", ack, lang, voice_cfg["voice"]
+        for q in QUESTION_FLOW:
+            if "text" in q:
+                yield q["id"], q["text"][lang], lang, voice_cfg["voice"]
+
+def prerender_audio():
+    """Render missing clips (in the background), then rebuild the TwiML cache so they are played."""
+    def run():
+        created = AUDIO_CACHE.prerender(list(audio_prompts()))
+        log.info("audio clips rendered", created=created, available=len(AUDIO_CACHE.files))
+        if created:
+            build_twiml_cache()
+    threading.Thread(target=run, name="audio-prerender", daemon=True).start()
+
+def append_question(resp, q_index, lang):
+    """
+    Append the TwiML for QUESTION_FLOW[q_index]: a speech <Gather> with a skip redirect,
+    or for the 'end' item the hold line and the /recommendation_status poll loop.
+    """
+    q = QUESTION_FLOW[q_index]
+    voice_cfg = VOICE_CONFIG.get(lang, VOICE_CONFIG["en"])
+
+    if q["id"] == "end":
+        speak(resp, q["id"], q["text"][lang], lang, voice_cfg)
+        resp.pause(length=RECOMMENDATION_POLL_PAUSE)
+        resp.redirect(f"{NGROK_URL}/recommendation_status", method="POST")
+        return
+
+    # Normal question flow: ask question, no retry messages; redirect to skip_question on timeout
+    gather = Gather(input="speech", action=f"{NGROK_URL}/handle_answer?q_index={q_index}", method="POST",
+                    timeout=8, speechTimeout=3, language=voice_cfg["language"])
+    speak(gather, q["id"], q["text"][lang], lang, voice_cfg)
+    resp.append(gather)
+
+    # If gather times out (no speech), skip_question will record "(no speech captured)" and continue
+    resp.redirect(f"{NGROK_URL}/skip_question?q_index={q_index}", method="POST")
+
+def render_voice_twiml():
     resp = VoiceResponse()
-    resp.say("Hello — I am Career Buddy. Please pick a language by pressing a button.", voice="Google.en-IN-Wavenet-D", language="en-IN")
+    speak(resp, "menu_intro", MENU_INTRO_TEXT, "en", MENU_VOICE)
     resp.pause(length=1)
 
     # DTMF only for language selection (press 1/2/3)
-    gather = Gather(input="dtmf", num_digits=1, timeout=8, action=f"{NGROK_URL}/set_language", method="POST")
-    gather.say("Press 1 for English.", voice="Google.en-IN-Wavenet-D", language="en-IN")
-    gather.say("Press 2 for Hindi.", voice="Google.en-IN-Wavenet-D", language="en-IN")
-    gather.say("Press 3 for Gujarati.", voice="Google.en-IN-Wavenet-D", language="en-IN")
+    gather = Gather(input="dtmf", num_digits=1, timeout=8, action=f"{NGROK_URL}/set_language?q_index=0", method="POST")
+    for clip_id, text in MENU_OPTIONS:
+        speak(gather, clip_id, text, "en", MENU_VOICE)
     resp.append(gather)
 
     # Instead of saying "I did not hear you" and repeating,
     # redirect to /skip_question which records an empty answer and continues.
-    resp.redirect(f"{NGROK_URL}/skip_question", method="POST")
-    print("Outgoing TwiML /voice:\n", str(resp))
-    return Response(str(resp), mimetype="application/xml")
-
-@app.route("/set_language", methods=["POST"])
-def set_language():
-    call_sid = request.form.get("CallSid")
-    caller = request.form.get("From")
-    session = get_session(call_sid, caller)
-    digits = request.form.get("Digits", "") or ""
-    chosen = None
-    if digits == "1": chosen = "en"
-    elif digits == "2": chosen = "hi"
-    elif digits == "3": chosen = "gu"
+    resp.redirect(f"{NGROK_URL}/skip_question?q_index=0", method="POST")
+    return str(resp)
 
+def render_language_twiml(chosen):
+    """Confirmation for the chosen language (None = not detected) followed by the first question."""
     resp = VoiceResponse()
     if not chosen:
-        resp.say("Could not detect language. Defaulting to English.", voice="Google.en-IN-Wavenet-D", language="en-IN")
-        session["lang"] = "en"
+        speak(resp, "language_default", LANGUAGE_DEFAULT_TEXT, "en", MENU_VOICE)
     else:
-        session["lang"] = chosen
         voice_cfg = VOICE_CONFIG[chosen]
-        if chosen == "hi":
-            resp.say("ठीक है, अब मैं हिंदी में पूछूंगा।", voice=voice_cfg["voice"], language=voice_cfg["language"])
-        elif chosen == "gu":
-            resp.say("સારું, હવે હું ગુજરાતી માં પૂછિશ.", voice=voice_cfg["voice"], language=voice_cfg["language"])
-        else:
-            resp.say("Great — continuing in English.", voice=voice_cfg["voice"], language=voice_cfg["language"])
-
+        speak(resp, "language_confirm", LANGUAGE_CONFIRMATIONS[chosen], chosen, voice_cfg)
     # ask first question (name)
-    session["q_index"] = 1
-    q = QUESTION_FLOW[1]
-    voice_cfg = VOICE_CONFIG[session["lang"]]
-    gather = Gather(input="speech", action=f"{NGROK_URL}/handle_answer", method="POST", timeout=8, speechTimeout=3, language=voice_cfg["language"])
-    gather.say(q["text"][session["lang"]], voice=voice_cfg["voice"], language=voice_cfg["language"])
-    resp.append(gather)
+    append_question(resp, FLOW.start_index, chosen or "en")
+    return str(resp)
+
+def render_question_twiml(q_index, lang, ack=None):
+    """The question at q_index, optionally preceded by an ack (merged mode)."""
+    resp = VoiceResponse()
+    if ack:
+        speak(resp, "ack", ack, lang, VOICE_CONFIG.get(lang, VOICE_CONFIG["en"]))
+    append_question(resp, q_index, lang)
+    return str(resp)
+
+def render_ack_redirect_twiml(q_index, lang, ack):
+    """Ack, short pause and a redirect to /ask_question (non-merged mode)."""
+    resp = VoiceResponse()
+    speak(resp, "ack", ack, lang, VOICE_CONFIG.get(lang, VOICE_CONFIG["en"]))
+    resp.pause(length=1)
+    resp.redirect(f"{NGROK_URL}/ask_question?q_index={q_index}", method="POST")
+    return str(resp)
+
+def render_redirect_twiml(q_index):
+    resp = VoiceResponse()
+    resp.redirect(f"{NGROK_URL}/ask_question?q_index={q_index}", method="POST")
+    return str(resp)
+
+def render_resync_twiml():
+    """For a retry whose original is still running past WEBHOOK_DEDUP_WAIT: re-enter at the session's question."""
+    resp = VoiceResponse()
+    resp.pause(length=1)
+    resp.redirect(f"{NGROK_URL}/ask_question", method="POST")
+    return str(resp)
+
+def build_twiml_cache():
+    """
+    Pre-render every static response: the language menu, each language confirmation,
+    and every (question, language) pair with and without each canned ack prefix.
+    """
+    global TWIML_CACHE, TWIML_CACHE_FLOW
+    flow = QUESTION_FLOW
+    cache = {("voice",): render_voice_twiml().encode(), ("resync",): render_resync_twiml().encode()}
+    for chosen in (None, *VOICE_CONFIG):
+        cache[("language", chosen)] = render_language_twiml(chosen).encode()
+    for q_index, q in enumerate(flow):
+        if "text" not in q:
+            continue
+        cache[("redirect", q_index)] = render_redirect_twiml(q_index).encode()
+        for lang in VOICE_CONFIG:
+            cache[("question", q_index, lang, None)] = render_question_twiml(q_index, lang).encode()
+            for ack in CANNED_ACKS.get(lang, CANNED_ACKS["en"]):
+                cache[("question", q_index, lang, ack)] = render_question_twiml(q_index, lang, ack).encode()
+                cache[("ack_redirect", q_index, lang, ack)] = render_ack_redirect_twiml(q_index, lang, ack).encode()
+    TWIML_CACHE, TWIML_CACHE_FLOW = cache, flow
+    log.info("twiml cache built", responses=len(cache), questions=len(flow))
+
+def reload_question_flow(flow):
+    """
+    Swap in a new question flow (a file path, a parsed flow document or a bare list of
+    questions) and rebuild the TwiML cache for it. A bad flow raises FlowError and the
+    current one stays in place.
+    """
+    global FLOW, QUESTION_FLOW
+    FLOW = compile_flow(load_flow(flow) if isinstance(flow, str) else flow)
+    QUESTION_FLOW = FLOW.questions
+    seed_question_ids(FLOW.index)
+    check_flow_roles()
+    build_twiml_cache()
+    if AUDIO_PRERENDER:
+        prerender_audio()
 
+def check_flow_roles():
+    """Warn about features the loaded flow turns off by leaving out their questions."""
+    if SPECULATIVE_RECOMMENDATIONS and FLOW.speculative_after is None:
+        log.warning("question flow has no speculative_after, speculative drafts are off")
+    for role in ("name", "stream"):
+        if role not in FLOW.roles:
+            log.warning("question flow has no question for a role", role=role)
+
+def cached_twiml(key, render, *args):
+    """
+    Serve pre-rendered bytes for key. Anything not in the cache (e.g. a Gemini ack)
+    is rendered on the fly and not stored, so the cache stays bounded.
+    """
+    if TWIML_CACHE_FLOW is not QUESTION_FLOW:
+        build_twiml_cache()
+    body = TWIML_CACHE.get(key)
+    if body is None:
+        body = render(*args).encode()
+    return body
+
+def twiml_response(body):
+    return Response(body, mimetype="application/xml")
+
+# ---------------- Webhook handlers ----------------
+# Each takes the Twilio form (and query args) and returns TwiML bytes, so the Flask routes
+# below and the async variant in asgi_app.py serve identical responses.
+def voice_twiml(form, args=None):
+    session = get_session(form.get("CallSid"), form.get("From"))
+    save_session(session)
+    log_event("call_start", session, caller=session.caller)
+
+    body = cached_twiml(("voice",), render_voice_twiml)
+    log.twiml("/voice", body)
+    return body
+
+def set_language_twiml(form, args=None):
+    session = get_session(form.get("CallSid"), form.get("From"))
+    digits = form.get("Digits", "") or ""
+    chosen = None
+    if digits == "1": chosen = "en"
+    elif digits == "2": chosen = "hi"
+    elif digits == "3": chosen = "gu"
+
+    session.lang = chosen or "en"
+    session.q_index = FLOW.start_index
+    save_session(session)
+    log_event("language", session, lang=session.lang, digits=digits)
     # If no speech happens, skip_question will record empty answer and continue.
-    resp.redirect(f"{NGROK_URL}/skip_question", method="POST")
-    print("Outgoing TwiML /set_language:\n", str(resp))
-    return Response(str(resp), mimetype="application/xml")
+    body = cached_twiml(("language", chosen), render_language_twiml, chosen)
+    log.twiml("/set_language", body)
+    return body
 
-@app.route("/ask_question", methods=["POST"])
-def ask_question():
+def ask_question_twiml(form, args):
     """
     Robust ask_question: always returns valid TwiML.
     If any exception occurs, log it and recover by advancing the session
     and redirecting to the next question.
     """
-    call_sid = request.form.get("CallSid")
-    caller = request.form.get("From")
     # get session first so error handler can still use it
-    session = get_session(call_sid, caller)
+    session = get_session(form.get("CallSid"), form.get("From"))
 
     try:
         # parse q_index (fallback to session value)
         try:
-            q_index = int(request.args.get("q_index", session["q_index"]))
+            q_index = int(args.get("q_index", session.q_index))
         except Exception:
-            q_index = session["q_index"]
+            q_index = session.q_index
 
         # guard bounds
         if q_index < 0:
@@ -417,155 +1119,397 @@ def ask_question():
         if q_index >= len(QUESTION_FLOW):
             q_index = len(QUESTION_FLOW) - 1
 
-        session["q_index"] = q_index
-        q = QUESTION_FLOW[q_index]
-        voice_cfg = VOICE_CONFIG.get(session.get("lang", "en"), VOICE_CONFIG["en"])
-        resp = VoiceResponse()
-
-        if q["id"] == "end":
-            final_text = gemini_final_recommendation(session, session["lang"])
-            # speak in safe, chunked way (uses tts_chunks if present, else a single say)
-            try:
-                # prefer chunked helper if available
-                chunks = tts_chunks(final_text, max_len=160) if "tts_chunks" in globals() else [final_text]
-                if not chunks:
-                    chunks = [final_text or ("Thanks. Could not prepare a suggestion right now.")]
-                for chunk in chunks:
-                    try:
-                        resp.say(chunk, voice=voice_cfg["voice"], language=voice_cfg["language"])
-                    except Exception:
-                        resp.say(chunk, voice="alice", language=voice_cfg["language"])
-                    resp.pause(length=1)
-            except Exception:
-                # fallback if tts_chunks or speak fails
-                try:
-                    resp.say(final_text, voice=voice_cfg["voice"], language=voice_cfg["language"])
-                except Exception:
-                    resp.say(final_text or "Thanks. Unable to prepare suggestion right now.", voice="alice", language=voice_cfg["language"])
-            resp.hangup()
-            print("Outgoing TwiML final:\n", str(resp))
-            return Response(str(resp), mimetype="application/xml")
-
-        # Normal question flow: ask question, no retry messages; redirect to skip_question on timeout
-        gather = Gather(input="speech", action=f"{NGROK_URL}/handle_answer", method="POST",
-                        timeout=8, speechTimeout=3, language=voice_cfg["language"])
-        gather.say(q["text"][session["lang"]], voice=voice_cfg["voice"], language=voice_cfg["language"])
-        resp.append(gather)
+        session.q_index = q_index
+        if QUESTION_FLOW[q_index]["id"] == "end":
+            # the job normally started in handle_answer; the response holds and starts polling
+            start_recommendation_job(session)
+        lang = session.lang
+        body = cached_twiml(("question", q_index, lang, None), render_question_twiml, q_index, lang)
+        save_session(session)
 
-        # If gather times out (no speech), skip_question will record "(no speech captured)" and continue
-        resp.redirect(f"{NGROK_URL}/skip_question", method="POST")
-
-        print(f"Outgoing TwiML for ask_question q_index={q_index}:\n", str(resp))
-        return Response(str(resp), mimetype="application/xml")
+        log.twiml("/ask_question", body, q_index=q_index)
+        return body
 
     except Exception as e:
         # Very defensive: log full traceback and advance the session to keep the call flowing.
-        print("ERROR in ask_question:", e)
-        traceback.print_exc()
+        log.exception("ask_question failed, advancing", q_index=session.q_index)
 
         # attempt to advance session and keep the caller moving forward
         try:
             advance(session)
-            next_q_index = session["q_index"]
+            next_q_index = session.q_index
         except Exception:
-            # if even that fails, reset to safe index 1
-            session["q_index"] = min(1, len(QUESTION_FLOW)-1)
-            next_q_index = session["q_index"]
+            # if even that fails, reset to the first question
+            session.q_index = FLOW.start_index
+            next_q_index = session.q_index
+        save_session(session)
 
-        resp = VoiceResponse()
         # do not say "error" to the caller; just continue flow silently
-        resp.redirect(f"{NGROK_URL}/ask_question?q_index={next_q_index}", method="POST")
-        print("Outgoing TwiML ask_question (error recovery):\n", str(resp))
-        return Response(str(resp), mimetype="application/xml")
+        body = render_redirect_twiml(next_q_index).encode()
+        log.twiml("/ask_question", body, recovery=True)
+        return body
+
+def recommendation_status_twiml(form, args=None):
+    """
+    Hold-and-poll loop for the final recommendation.
+    Never waits on the model: either speaks the finished text or pauses and redirects back here.
+    """
+    session = get_session(form.get("CallSid"), form.get("From"))
+    voice_cfg = VOICE_CONFIG.get(session.lang, VOICE_CONFIG["en"])
 
+    resp = VoiceResponse()
+    final_text = poll_recommendation(session)
+    if final_text is None:
+        polls = session.rec_polls = session.rec_polls + 1
+        save_session(session)
+        if polls % 3 == 0:
+            speak(resp, "hold", HOLD_MESSAGES.get(session.lang, HOLD_MESSAGES["en"]), session.lang, voice_cfg)
+        resp.pause(length=RECOMMENDATION_POLL_PAUSE)
+        resp.redirect(f"{NGROK_URL}/recommendation_status", method="POST")
+        return str(resp).encode()
 
+    save_session(session)
+    say_final_recommendation(resp, final_text, voice_cfg)
+    body = str(resp).encode()
+    log.twiml("/recommendation_status", body)
+    return body
 
-@app.route("/skip_question", methods=["POST"])
-def skip_question():
+def next_question_twiml(session):
+    """After an answer was stored: advance, maybe start the recommendation, then the next question (merged) or a redirect."""
+    advance(session)
+    maybe_start_recommendation(session)
+    save_session(session)
+    next_q_index = session.q_index
+    if MERGE_ACK_AND_QUESTION:
+        lang = session.lang
+        return cached_twiml(("question", next_q_index, lang, None), render_question_twiml, next_q_index, lang)
+    return cached_twiml(("redirect", next_q_index), render_redirect_twiml, next_q_index)
+
+def is_stale(session, args):
+    """
+    A webhook for a question the session has already moved past (the URL's q_index differs):
+    a Twilio retry that missed the in-process dedup, e.g. by reaching another worker.
+    Recording it would store the answer against the next question and advance again.
+    """
+    q_index = (args or {}).get("q_index")
+    if q_index is None:
+        return False
+    try:
+        return int(q_index) != session.q_index
+    except ValueError:
+        return False
+
+def stale_twiml(session, endpoint):
+    """Re-enter the call at the session's current question instead of recording a duplicate."""
+    log.info("stale webhook, resyncing", endpoint=endpoint, q_index=session.q_index)
+    log_event("stale_webhook", session, endpoint=endpoint, q_index=session.q_index)
+    return cached_twiml(("redirect", session.q_index), render_redirect_twiml, session.q_index)
+
+def skip_question_twiml(form, args=None):
     """
     Records an empty/no-speech answer for the current question and advances the session.
     This is called via Redirect after a Gather times out with no speech.
     """
-    call_sid = request.form.get("CallSid")
-    caller = request.form.get("From")
-    session = get_session(call_sid, caller)
+    session = get_session(form.get("CallSid"), form.get("From"))
+    if is_stale(session, args):
+        return stale_twiml(session, "/skip_question")
 
-    q_index = session["q_index"]
+    q_index = session.q_index
     q = QUESTION_FLOW[q_index]
     # Save an explicit no-speech placeholder
-    session["answers"].append({"question_id": q["id"], "transcript": "(no speech captured)", "confidence": "0"})
-    print(f"skip_question: saved empty answer for q{q_index}")
+    session.answers.append(Answer(q["id"], "(no speech captured)"))
+    log_event("skip", session, question_id=q["id"], q_index=q_index)
+    log.info("question skipped", question_id=q["id"], q_index=q_index)
 
-    # advance and redirect to next question
-    advance(session)
-    next_q_index = session["q_index"]
-    resp = VoiceResponse()
-    resp.redirect(f"{NGROK_URL}/ask_question?q_index={next_q_index}", method="POST")
-    return Response(str(resp), mimetype="application/xml")
+    # advance and go to next question (inline in merged mode, else via redirect)
+    return next_question_twiml(session)
 
-@app.route("/handle_answer", methods=["POST"])
-def handle_answer():
-    call_sid = request.form.get("CallSid")
-    caller = request.form.get("From")
-    session = get_session(call_sid, caller)
-    speech = (request.form.get("SpeechResult") or "").strip()
-    confidence = request.form.get("Confidence", "0")
-    q_index = session["q_index"]
+def begin_answer(form, args=None):
+    """
+    First half of handle_answer: store the speech result. Returns (session, transcript) for
+    the ack, or (session, None) for a stale retry (answer with stale_twiml).
+    """
+    session = get_session(form.get("CallSid"), form.get("From"))
+    if is_stale(session, args):
+        return session, None
+    speech = (form.get("SpeechResult") or "").strip()
+    confidence = form.get("Confidence", "0")
+    q_index = session.q_index
     q = QUESTION_FLOW[q_index]
     transcript = speech or "(no speech captured)"
-    print(f"DEBUG /handle_answer q{q_index} - Speech: '{speech}' Confidence: {confidence}")
 
     # Save answer
-    session["answers"].append({"question_id": q["id"], "transcript": transcript, "confidence": confidence})
-    print(f"Saved answer q{q_index}: {transcript}")
-
-    # Acknowledge (Gemini if allowed & not in cooldown; otherwise canned)
-    ack_text = gemini_generate_ack(transcript, session["lang"])
+    answer = Answer(q["id"], transcript, confidence)
+    session.answers.append(answer)
+    add_answer_score(session, transcript)
+    log_event("answer", session, question_id=q["id"], q_index=q_index, lang=session.lang,
+              transcript=transcript, confidence=answer.confidence)
+    log.info("answer saved", question_id=q["id"], q_index=q_index, confidence=answer.confidence, empty=not speech)
+    log.debug("speech", q_index=q_index, transcript=transcript)
+    return session, transcript
 
-    # advance & prepare redirect to next question
+def finish_answer(session, ack_text):
+    """Second half of handle_answer: advance and return the ack (+ next question in merged mode)."""
+    # advance & prepare redirect to next question; the last answer starts the recommendation job
     advance(session)
-    next_q_index = session["q_index"]
+    maybe_start_recommendation(session)
+    save_session(session)
+    next_q_index = session.q_index
 
-    resp = VoiceResponse()
+    lang = session.lang
+    if MERGE_ACK_AND_QUESTION:
+        body = cached_twiml(("question", next_q_index, lang, ack_text), render_question_twiml, next_q_index, lang, ack_text)
+        log.twiml("/handle_answer", body, merged=True)
+        return body
+    body = cached_twiml(("ack_redirect", next_q_index, lang, ack_text), render_ack_redirect_twiml, next_q_index, lang, ack_text)
+    log.twiml("/handle_answer", body)
+    return body
+
+def handle_answer_twiml(form, args=None):
+    session, transcript = begin_answer(form, args)
+    if transcript is None:
+        return stale_twiml(session, "/handle_answer")
+    # Acknowledge (Gemini if allowed & circuit not open; otherwise canned)
+    ack_text = gemini_generate_ack(transcript, session.lang)
+    return finish_answer(session, ack_text)
+
+def recording_fallback_twiml(form, args=None):
+    # repeated deliveries are answered by dedup_twiml before they get here, or (on another
+    # worker) caught by the RecordingSid already being among the answers
+    recording_url = form.get("RecordingUrl")
+    recording_sid = form.get("RecordingSid")
+    session = get_session(form.get("CallSid"), form.get("From"))
+    if is_stale(session, args) or (recording_sid and any(a.recording_sid == recording_sid for a in session.answers)):
+        return stale_twiml(session, "/handle_recording_fallback")
+
+    q_index = session.q_index
+    q = QUESTION_FLOW[q_index]
+    session.answers.append(Answer(q["id"], f"(recording: {recording_url})", recording_sid=recording_sid))
+    log_event("recording", session, question_id=q["id"], q_index=q_index, recording_url=recording_url, recording_sid=recording_sid)
+    log.info("fallback recording saved", question_id=q["id"], q_index=q_index, recording_sid=recording_sid)
+    # transcribed in the background; the text replaces the placeholder when it's ready
+    if TRANSCRIPTION is not None and recording_url and recording_sid:
+        if TRANSCRIPTION.submit(session.call_sid, recording_sid, recording_url, session.lang) is None:
+            TRANSCRIPTION_REJECTED.inc()
+
+    return next_question_twiml(session)
+
+# ---------------- Retry dedup ----------------
+def webhook_dedup_key(endpoint, form, args):
+    """
+    (CallSid, q_index, endpoint). q_index comes from the action URL; a recording without one
+    is keyed on its RecordingSid, and anything else on the session's current question.
+    """
+    call_sid = form.get("CallSid")
+    if not call_sid or endpoint not in DEDUP_ENDPOINTS:
+        return None
+    q_index = (args or {}).get("q_index") or form.get("RecordingSid")
+    if q_index is None:
+        session = SESSION_STORE.get(call_sid)
+        q_index = session.q_index if session else 0
+    return call_sid, str(q_index), endpoint
+
+def dedup_twiml(endpoint, handler, form, args=None):
+    """Run handler once per (CallSid, q_index, endpoint); Twilio retries get the same TwiML bytes back."""
+    key = webhook_dedup_key(endpoint, form, args)
+    if key is None:
+        return handler(form, args)
+    owner, fut = WEBHOOK_DEDUP.claim(key)
+    if not owner:
+        WEBHOOK_REPLAYS.inc(endpoint=endpoint)
+        log.info("replaying response for retry", endpoint=endpoint, q_index=key[1])
+        try:
+            return fut.result(timeout=WEBHOOK_DEDUP_WAIT)
+        except Exception:
+            return cached_twiml(("resync",), render_resync_twiml)
     try:
-        voice_cfg = VOICE_CONFIG[session["lang"]]
-        resp.say(ack_text, voice=voice_cfg["voice"], language=voice_cfg["language"])
-    except Exception:
-        # fallback to default voice if custom voice errors
-        resp.say(ack_text, voice="alice", language="en-US")
-    resp.pause(length=1)
-    resp.redirect(f"{NGROK_URL}/ask_question?q_index={next_q_index}", method="POST")
-    print("Outgoing TwiML handle_answer (ack + redirect):\n", str(resp))
-    return Response(str(resp), mimetype="application/xml")
+        body = handler(form, args)
+    except BaseException as e:
+        WEBHOOK_DEDUP.abandon(key, fut, e)
+        raise
+    WEBHOOK_DEDUP.resolve(fut, body)
+    return body
+
+def stats_json():
+    return {"speculative": speculative_stats(), "recommendation_cache": RECOMMENDATION_CACHE.stats(),
+            "webhook_dedup": WEBHOOK_DEDUP.stats(), "transcription": TRANSCRIPTION.stats() if TRANSCRIPTION is not None else None,
+            "logging": log_stats()}
+
+# ---------------- Call traces ----------------
+def call_created(call_sid):
+    session = SESSION_STORE.get(call_sid)
+    return session.created if session else None
+
+def call_trace_json(call_sid):
+    """(body, status) for /calls/<sid>/trace: the call's spans and dead-air timeline, from this process's tracer."""
+    spans = TRACER.spans(call_sid)
+    if not spans:
+        return {"error": f"no trace for {call_sid} (expired, or handled by another worker)"}, 404
+    trace = timeline(spans, call_created(call_sid), [q["id"] for q in QUESTION_FLOW])
+    return {"call_sid": call_sid, **trace}, 200
+
+def slowest_calls_json(args):
+    """(body, status) for /calls/slowest?n=20&by=silence|worst|recommendation over the calls still traced."""
+    by = args.get("by", "silence")
+    if by not in SLOWEST_KEYS:
+        return {"error": f"by must be one of {sorted(SLOWEST_KEYS)}"}, 400
+    try:
+        n = max(1, int(args.get("n", 20)))
+    except ValueError:
+        return {"error": "n must be an integer"}, 400
+    calls = TRACER.calls()
+    return {"calls": len(calls), "by": by, "slowest": slowest(calls, n, by, question_ids=[q["id"] for q in QUESTION_FLOW])}, 200
+
+def call_debug_json(call_sid, method, args, token=None):
+    """
+    (body, status) for /calls/<sid>/debug: POST ?minutes=N turns debug logging (TwiML included) on, DELETE off.
+    token is the request's X-Admin-Token; it must match ADMIN_TOKEN, and without one the route is off.
+    """
+    if not ADMIN_TOKEN:
+        return {"error": "not found"}, 404
+    if not hmac.compare_digest((token or "").encode(), ADMIN_TOKEN.encode()):
+        return {"error": "admin token required"}, 403
+    if method == "POST":
+        try:
+            minutes = float(args.get("minutes", LOG_DEBUG_TTL / 60))
+        except ValueError:
+            return {"error": "minutes must be a number"}, 400
+        DEBUG_CALLS.enable(call_sid, minutes * 60)
+        log.info("debug logging on", call_sid=call_sid, minutes=minutes)
+    elif method == "DELETE":
+        DEBUG_CALLS.disable(call_sid)
+    calls = DEBUG_CALLS.calls()
+    return {"call_sid": call_sid, "debug": call_sid in calls, "expires_in": calls.get(call_sid)}, 200
+
+# ---------------- App factory ----------------
+def init_runtime():
+    """
+    Open the session store, recommendation cache, event log and audio clip index (once per
+    process). Importing app.py does none of this, so tools that only need the helpers stay fast.
+    """
+    global SESSION_STORE, RECOMMENDATION_CACHE, EVENT_LOG, AUDIO_CACHE, TRANSCRIPTION
+    with RUNTIME_LOCK:
+        if SESSION_STORE is not None:
+            return
+        setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_DEBUG_CALLS, LOG_DEBUG_TTL, LOG_QUEUE_SIZE)
+        if not NGROK_URL:
+            log.warning("NGROK_URL not set, TwiML callbacks use relative URLs")
+        check_flow_roles()
+        RECOMMENDATION_CACHE = RecommendationCache(RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL, RECOMMENDATION_CACHE_FILE)
+        if EVENT_LOG_DIR:
+            EVENT_LOG = EventLog(EVENT_LOG_DIR, segment_bytes=EVENT_SEGMENT_MB * 1024 * 1024, fsync=EVENT_LOG_FSYNC)
+            atexit.register(EVENT_LOG.close)
+        AUDIO_CACHE = AudioCache(AUDIO_CACHE_DIR, f"{NGROK_URL}/audio", make_synthesizer(AUDIO_SYNTHESIZER))
+        transcriber = make_transcriber(TRANSCRIBER)
+        if transcriber is not None:
+            auth = TWILIO_AUTH if all(TWILIO_AUTH) else None
+            TRANSCRIPTION = TranscriptionPool(transcriber, fetch=lambda url: fetch_recording(url, auth),
+                                              workers=TRANSCRIBE_WORKERS, max_pending=TRANSCRIBE_MAX_PENDING,
+                                              on_done=transcript_ready, observe=observe_transcription)
+        # assigned last: it doubles as the "already initialized" flag
+        SESSION_STORE = make_session_store(SESSION_BACKEND, ttl=SESSION_TTL, max_sessions=SESSION_MAX,
+                                           sqlite_path=SESSION_DB_PATH, redis_url=REDIS_URL)
+        atexit.register(SESSION_STORE.close)   # the SQLite store's write-behind buffer
+
+def warm_up():
+    """
+    Get the process ready for its first call: render the TwiML cache, touch the session store,
+    and start configuring Gemini (and rendering audio clips) in the background.
+    Returns {step: seconds} for the startup log and loadtest.py startup.
+    """
+    init_runtime()
+    timings = {}
+    t0 = time.perf_counter()
+    build_twiml_cache()
+    timings["twiml_cache"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    SESSION_STORE.get("warm-up")
+    timings["session_store"] = time.perf_counter() - t0
+    if GEMINI_WARM_UP and GEMINI_API_KEY:
+        threading.Thread(target=gemini_models, name="gemini-warm-up", daemon=True).start()
+    if AUDIO_PRERENDER:
+        prerender_audio()
+    log.info("warm-up done", **{f"{k}_ms": round(v * 1000, 1) for k, v in timings.items()})
+    return timings
 
-@app.route("/handle_recording_fallback", methods=["POST"])
+def create_app(warm=True):
+    """
+    Flask app serving the webhooks; one per worker, e.g. gunicorn "app:create_app()".
+    With warm=True the worker renders its TwiML cache before it accepts the first call.
+    """
+    init_runtime()
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(webhooks)
+    if warm:
+        warm_up()
+    return flask_app
+
+def __getattr__(name):
+    # keeps "app:app" (gunicorn, flask run, tests) working: the default app is built on first access
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# ---------------- Twilio endpoints ----------------
+@webhooks.route("/voice", methods=["POST"])
+def voice():
+    return twiml_response(voice_twiml(request.form))
+
+@webhooks.route("/set_language", methods=["POST"])
+def set_language():
+    return twiml_response(dedup_twiml("/set_language", set_language_twiml, request.form, request.args))
+
+@webhooks.route("/ask_question", methods=["POST"])
+def ask_question():
+    return twiml_response(ask_question_twiml(request.form, request.args))
+
+@webhooks.route("/recommendation_status", methods=["POST"])
+def recommendation_status():
+    return twiml_response(recommendation_status_twiml(request.form))
+
+@webhooks.route("/skip_question", methods=["POST"])
+def skip_question():
+    return twiml_response(dedup_twiml("/skip_question", skip_question_twiml, request.form, request.args))
+
+@webhooks.route("/handle_answer", methods=["POST"])
+def handle_answer():
+    return twiml_response(dedup_twiml("/handle_answer", handle_answer_twiml, request.form, request.args))
+
+@webhooks.route("/handle_recording_fallback", methods=["POST"])
 def handle_recording_fallback():
-    call_sid = request.form.get("CallSid")
-    caller = request.form.get("From")
-    recording_url = request.form.get("RecordingUrl")
-    recording_sid = request.form.get("RecordingSid")
-    session = get_session(call_sid, caller)
-
-    if recording_sid and recording_sid in PROCESSED_RECORDINGS:
-        print("Already processed recording:", recording_sid)
-    else:
-        if recording_sid:
-            PROCESSED_RECORDINGS.add(recording_sid)
-        q_index = session["q_index"]
-        q = QUESTION_FLOW[q_index]
-        session["answers"].append({"question_id": q["id"], "transcript": f"(recording: {recording_url})", "recording_sid": recording_sid})
-        print("Fallback recording saved:", recording_url)
+    return twiml_response(dedup_twiml("/handle_recording_fallback", recording_fallback_twiml, request.form, request.args))
 
-    advance(session)
-    next_q_index = session["q_index"]
-    resp = VoiceResponse()
-    resp.redirect(f"{NGROK_URL}/ask_question?q_index={next_q_index}", method="POST")
-    return Response(str(resp), mimetype="application/xml")
+@webhooks.route("/audio/<name>")
+def audio(name):
+    status, headers, body = AUDIO_CACHE.serve(name, request.headers.get("Range"), request.headers.get("If-None-Match"))
+    return Response(body, status=status, headers=headers)
 
-@app.route("/health")
+@webhooks.route("/health")
 def health():
     return "ok", 200
 
+@webhooks.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+@webhooks.route("/calls/<call_sid>/trace")
+def call_trace(call_sid):
+    return call_trace_json(call_sid)
+
+@webhooks.route("/calls/<call_sid>/debug", methods=["GET", "POST", "DELETE"])
+def call_debug(call_sid):
+    return call_debug_json(call_sid, request.method, request.args, request.headers.get("X-Admin-Token"))
+
+@webhooks.route("/calls/slowest")
+def calls_slowest():
+    return slowest_calls_json(request.args)
+
+@webhooks.route("/stats")
+def stats():
+    return stats_json(), 200
+
 if __name__ == "__main__":
     print("Server starting. Ensure NGROK_URL is set and Twilio webhook points to NGROK_URL/voice")
-    app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
+    create_app().run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
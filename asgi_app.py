@@ -0,0 +1,177 @@
+# asgi_app.py — async serving mode for the same webhooks as app.py
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+#
+# Routes reuse the handlers in app.py, so the TwiML is byte-for-byte identical.
+# The only model call on the request path (the optional Gemini ack) is awaited
+# through app.GEMINI (shared rate budget, concurrency slots and circuit breaker)
+# instead of blocking a worker; the final recommendation already runs in
+# app.py's background pool (sized from GEMINI_MAX_CONCURRENT, and a speculative
+# final is only queued once its draft is done) and is polled via /recommendation_status.
+import time
+import json
+import asyncio
+from urllib.parse import parse_qsl
+
+import app as core
+from logs import get_logger
+
+log = get_logger("asgi")
+
+core.init_runtime()
+# the memory store is a dict lookup; anything else does I/O and goes to a thread
+INLINE_HANDLERS = core.SESSION_BACKEND == "memory"
+
+WEBHOOKS = {
+    "/voice": core.voice_twiml,
+    "/set_language": core.set_language_twiml,
+    "/ask_question": core.ask_question_twiml,
+    "/recommendation_status": core.recommendation_status_twiml,
+    "/skip_question": core.skip_question_twiml,
+    "/handle_recording_fallback": core.recording_fallback_twiml,
+}
+
+
+async def gemini_generate_ack_async(transcript, lang_code):
+    """Async twin of app.gemini_generate_ack: same prompt and fallbacks, but awaits the model."""
+    if not core.gemini_ack_allowed():
+        return core.canned_ack(lang_code)
+
+    parts = [{"text": core.ack_prompt(transcript, lang_code)}]
+    try:
+        r = await core.GEMINI.generate_async(core.gemini_models()[0], parts, "ack")
+        out = getattr(r, "text", None)
+        if out:
+            return out.strip().splitlines()[0]
+    except Exception as e:
+        log.warning("gemini ack failed", error=str(e))
+    return core.canned_ack(lang_code)
+
+
+async def run_sync(fn, *args):
+    if INLINE_HANDLERS:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+async def handle_answer(form, args):
+    session, transcript = await run_sync(core.begin_answer, form, args)
+    if transcript is None:
+        return await run_sync(core.stale_twiml, session, "/handle_answer")
+    ack_text = await gemini_generate_ack_async(transcript, session.lang)
+    return await run_sync(core.finish_answer, session, ack_text)
+
+
+async def dedup_async(path, form, args):
+    """Async twin of app.dedup_twiml: retries await the original's Future instead of blocking the loop."""
+    key = await run_sync(core.webhook_dedup_key, path, form, args)
+    if key is None:
+        return await dispatch(path, form, args)
+    owner, fut = core.WEBHOOK_DEDUP.claim(key)
+    if not owner:
+        core.WEBHOOK_REPLAYS.inc(endpoint=path)
+        log.info("replaying response for retry", endpoint=path, q_index=key[1])
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), core.WEBHOOK_DEDUP_WAIT)
+        except Exception:
+            return core.cached_twiml(("resync",), core.render_resync_twiml)
+    try:
+        body = await dispatch(path, form, args)
+    except BaseException as e:
+        core.WEBHOOK_DEDUP.abandon(key, fut, e)
+        raise
+    core.WEBHOOK_DEDUP.resolve(fut, body)
+    return body
+
+
+async def dispatch(path, form, args):
+    if path == "/handle_answer":
+        return await handle_answer(form, args)
+    return await run_sync(WEBHOOKS[path], form, args)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def respond(send, status, body, content_type, headers=None):
+    headers = {"Content-Type": content_type, "Content-Length": str(len(body)), **(headers or {})}
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await asyncio.to_thread(core.warm_up)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            core.SESSION_STORE.close()
+            if core.EVENT_LOG:
+                core.EVENT_LOG.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    started = time.perf_counter()
+    status = 200
+    headers = None
+    form, args = {}, {}
+
+    if method == "GET" and path == "/health":
+        body, content_type = b"ok", "text/html; charset=utf-8"
+    elif method == "GET" and path == "/metrics":
+        body, content_type = core.REGISTRY.render().encode(), core.METRICS_CONTENT_TYPE
+    elif method == "GET" and path == "/stats":
+        body, content_type = json.dumps(core.stats_json()).encode(), "application/json"
+    elif method == "GET" and path == "/calls/slowest":
+        result, status = core.slowest_calls_json(dict(parse_qsl(scope.get("query_string", b"").decode())))
+        body, content_type = json.dumps(result).encode(), "application/json"
+    elif method == "GET" and path.startswith("/calls/") and path.endswith("/trace"):
+        result, status = await run_sync(core.call_trace_json, path[len("/calls/"):-len("/trace")])
+        body, content_type = json.dumps(result, ensure_ascii=False).encode(), "application/json"
+        path = "/calls/<call_sid>/trace"
+    elif method in ("GET", "POST", "DELETE") and path.startswith("/calls/") and path.endswith("/debug"):
+        query = dict(parse_qsl(scope.get("query_string", b"").decode()))
+        token = next((v.decode() for k, v in scope.get("headers", []) if k.lower() == b"x-admin-token"), None)
+        result, status = core.call_debug_json(path[len("/calls/"):-len("/debug")], method, query, token)
+        body, content_type = json.dumps(result).encode(), "application/json"
+        path = "/calls/<call_sid>/debug"
+    elif method == "GET" and path.startswith("/audio/"):
+        request_headers = {k.decode().lower(): v.decode() for k, v in scope.get("headers", [])}
+        status, headers, body = await run_sync(core.AUDIO_CACHE.serve, path[len("/audio/"):],
+                                               request_headers.get("range"), request_headers.get("if-none-match"))
+        content_type = headers.pop("Content-Type")
+        path = "/audio/<name>"   # same label as the Flask route
+    elif method == "POST" and (path in WEBHOOKS or path == "/handle_answer"):
+        query = scope.get("query_string", b"").decode()
+        form = dict(parse_qsl((await read_body(receive)).decode(), keep_blank_values=True))
+        args = dict(parse_qsl(query, keep_blank_values=True))
+        if core.WEBHOOK_RECORD_FILE:
+            await asyncio.to_thread(core.record_webhook, path, query, form)   # file I/O, off the loop
+        core.CURRENT_CALL.set(form.get("CallSid"))
+        body = await dedup_async(path, form, args)
+        content_type = "application/xml"
+    else:
+        status, body, content_type = 404, b"not found", "text/plain"
+
+    await respond(send, status, body, content_type, headers)
+    seconds = time.perf_counter() - started
+    endpoint = path if status != 404 else "unmatched"
+    core.HTTP_LATENCY.observe(seconds, endpoint=endpoint, status=status)
+    if method == "POST":
+        core.trace_webhook(form.get("CallSid"), endpoint, status, args.get("q_index"), seconds)
@@ -0,0 +1,179 @@
+# audio_cache.py — pre-synthesized prompt clips, played with <Play> instead of live <Say> TTS
+#
+# Clips live in one directory, named <clip id>-<lang>-<voice>-<text hash>.<ext>, so editing a
+# prompt's text simply misses the cache (and falls back to <Say>) until it is rendered again.
+# Render missing clips offline with
+#
+#   AUDIO_SYNTHESIZER=google python audio_cache.py          # or =stub for silent placeholder clips
+import io
+import os
+import re
+import sys
+import wave
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from logs import get_logger
+
+log = get_logger("audio")
+
+CONTENT_TYPES = {"mp3": "audio/mpeg", "wav": "audio/wav"}
+CLIP_RE = re.compile(r"^[\w.-]+\.(mp3|wav)$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+MAX_AGE = 365 * 24 * 3600   # names are content-addressed, so a clip never changes under its URL
+
+
+class StubSynthesizer:
+    """Silent 8 kHz WAV roughly as long as the text would take to say. For local runs and tests."""
+
+    ext = "wav"
+
+    def __call__(self, text, lang, voice):
+        seconds = min(30.0, 0.5 + 0.06 * len(text))
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(1)
+            w.setframerate(8000)
+            w.writeframes(b"\x80" * int(8000 * seconds))
+        return buf.getvalue()
+
+
+class GoogleSynthesizer:
+    """Google Cloud Text-to-Speech with the same Wavenet voices Twilio's <Say voice="Google..."> uses."""
+
+    ext = "mp3"
+
+    def __init__(self):
+        from google.cloud import texttospeech   # optional dependency, only needed to render clips
+        self.tts = texttospeech
+        self.client = texttospeech.TextToSpeechClient()
+
+    def __call__(self, text, lang, voice):
+        name = voice.split(".", 1)[-1]                     # "Google.en-IN-Wavenet-D" -> "en-IN-Wavenet-D"
+        language_code = "-".join(name.split("-")[:2])
+        r = self.client.synthesize_speech(
+            input=self.tts.SynthesisInput(text=text),
+            voice=self.tts.VoiceSelectionParams(language_code=language_code, name=name),
+            audio_config=self.tts.AudioConfig(audio_encoding=self.tts.AudioEncoding.MP3),
+        )
+        return r.audio_content
+
+
+SYNTHESIZERS = {"stub": StubSynthesizer, "google": GoogleSynthesizer}
+
+
+def make_synthesizer(name):
+    if not name:
+        return None
+    try:
+        return SYNTHESIZERS[name]()
+    except KeyError:
+        raise ValueError(f"unknown AUDIO_SYNTHESIZER {name!r}; expected one of {sorted(SYNTHESIZERS)}")
+
+
+def slug(s):
+    return re.sub(r"[^\w]+", "_", s).strip("_")
+
+
+class AudioCache:
+    """
+    Index of rendered clips in directory. url_for() is a dict lookup and never synthesizes,
+    so the request path only ever plays what is already on disk; prerender() fills the gaps.
+    """
+
+    def __init__(self, directory, base_url, synthesizer=None):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+        self.synthesizer = synthesizer
+        self._lock = threading.Lock()
+        self.files = {}   # clip stem -> file name
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if CLIP_RE.match(name):
+                    self.files[name.rsplit(".", 1)[0]] = name
+
+    def stem(self, clip_id, text, lang, voice):
+        digest = hashlib.sha1(f"{voice}\n{text}".encode("utf-8")).hexdigest()[:12]
+        return f"{slug(clip_id)}-{lang}-{slug(voice)}-{digest}"
+
+    def url_for(self, clip_id, text, lang, voice):
+        name = self.files.get(self.stem(clip_id, text, lang, voice))
+        return f"{self.base_url}/{name}" if name else None
+
+    def render(self, clip_id, text, lang, voice):
+        """Synthesize one clip if missing. Returns True when a new file was written."""
+        stem = self.stem(clip_id, text, lang, voice)
+        if stem in self.files or self.synthesizer is None:
+            return False
+        audio = self.synthesizer(text, lang, voice)
+        name = f"{stem}.{self.synthesizer.ext}"
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = os.path.join(self.directory, name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(audio)
+        os.replace(tmp, os.path.join(self.directory, name))
+        with self._lock:
+            self.files[stem] = name
+        return True
+
+    def prerender(self, prompts, workers=4):
+        """Render every missing (clip_id, text, lang, voice). Returns the number of new clips."""
+        if self.synthesizer is None:
+            return 0
+        created = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts") as pool:
+            for fut in [pool.submit(self.render, *p) for p in prompts]:
+                try:
+                    created += fut.result()
+                except Exception as e:
+                    log.warning("synthesis failed", error=str(e))
+        return created
+
+    def serve(self, name, range_header=None, if_none_match=None):
+        """
+        (status, headers, body) for GET <base_url>/<name>: single byte ranges,
+        ETag / If-None-Match and long-lived immutable caching.
+        """
+        if self.files.get(name.rsplit(".", 1)[0]) != name:
+            return 404, {"Content-Type": "text/plain"}, b"not found"
+        path = os.path.join(self.directory, name)
+        size = os.path.getsize(path)
+        etag = '"%s"' % name.rsplit(".", 1)[0].rsplit("-", 1)[-1]
+        headers = {
+            "Content-Type": CONTENT_TYPES[name.rsplit(".", 1)[1]],
+            "Accept-Ranges": "bytes",
+            "Cache-Control": f"public, max-age={MAX_AGE}, immutable",
+            "ETag": etag,
+        }
+        if if_none_match and etag in if_none_match:
+            return 304, headers, b""
+        start, end = 0, size - 1
+        status = 200
+        m = RANGE_RE.match(range_header or "")
+        if m and (m.group(1) or m.group(2)):
+            if m.group(1):
+                start = int(m.group(1))
+                end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            else:
+                start = max(0, size - int(m.group(2)))   # suffix range: the last N bytes
+            if start > end or start >= size:
+                headers["Content-Range"] = f"bytes */{size}"
+                return 416, headers, b""
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        with open(path, "rb") as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+        headers["Content-Length"] = str(len(body))
+        return status, headers, body
+
+
+if __name__ == "__main__":
+    import app
+    app.init_runtime()
+    if app.AUDIO_CACHE.synthesizer is None:
+        sys.exit("set AUDIO_SYNTHESIZER (google or stub) to render clips")
+    prompts = list(app.audio_prompts())
+    print(f"{app.AUDIO_CACHE.prerender(prompts)} new clips, {len(prompts)} prompts, in {app.AUDIO_CACHE_DIR}")
@@ -0,0 +1,56 @@
+# dedup.py — replay the first response to a webhook instead of running it again on Twilio retries
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class WebhookDedup:
+    """
+    Bounded LRU + TTL map of request key -> Future holding the TwiML bytes.
+
+    The first request for a key claims it and runs the handler; a retry that arrives
+    while the first is still running waits on the same Future, and one that arrives
+    later gets the stored bytes straight away. If the handler raises, the key is
+    dropped so a retry is processed normally.
+    """
+
+    def __init__(self, ttl=600, max_entries=20000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()   # key -> (claimed_at, Future)
+        self._lock = threading.Lock()
+        self.replays = 0
+
+    def claim(self, key):
+        """Returns (owner, future). The owner must call resolve() or abandon() on the future."""
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and now - item[0] <= self.ttl:
+                self._data.move_to_end(key)
+                self.replays += 1
+                return False, item[1]
+            fut = Future()
+            self._data[key] = (now, fut)
+            self._data.move_to_end(key)
+            # entries are claimed in time order, so expired ones sit at the front
+            while self._data and (len(self._data) > self.max_entries or now - next(iter(self._data.values()))[0] > self.ttl):
+                self._data.popitem(last=False)
+            return True, fut
+
+    def resolve(self, fut, body):
+        fut.set_result(body)
+
+    def abandon(self, key, fut, exc):
+        with self._lock:
+            if self._data.get(key, (None, None))[1] is fut:
+                del self._data[key]
+        fut.set_exception(exc)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "replays": self.replays}
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,192 @@
+# event_log.py — durable, append-only call events (JSONL segments) with a streaming reader
+#
+#   python event_log.py export events/ --since 2026-10-01 --type answer > answers.jsonl
+#   python event_log.py summary events/
+#
+# emit() only appends to an in-memory buffer; a background thread writes batches to
+# events-<pid>-<seq>-<first unix ts>.jsonl and starts a new segment once the current one
+# passes segment_bytes, so the request path never touches the disk. Each worker process
+# writes its own chain of segments; the reader merges the chains by time.
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import heapq
+import threading
+from datetime import datetime
+from collections import Counter
+
+from logs import get_logger
+
+log = get_logger("events")
+
+SEGMENT_RE = re.compile(r"^events-(\d+)-(\d{6})-(\d+)\.jsonl$")
+
+
+class EventLog:
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, flush_interval=0.2, batch_size=500,
+                 max_pending=100000, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.dropped = 0          # events refused because the writer fell max_pending behind
+        self.written = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._file = None
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._writer.start()
+
+    def emit(self, type, **fields):
+        event = {"t": round(time.time(), 3), "type": type, **fields}
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(event)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _open_segment(self, first_ts):
+        if self._file:
+            self._file.close()
+        pid = os.getpid()
+        seq = 1 + max((seq for p, seq, _, _ in segments(self.directory) if p == pid), default=0)
+        name = f"events-{pid}-{seq:06d}-{int(first_ts)}.jsonl"
+        self._file = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        self._size = 0
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        for i in range(0, len(batch), self.batch_size):
+            chunk = batch[i:i + self.batch_size]
+            if self._file is None or self._size >= self.segment_bytes:
+                self._open_segment(chunk[0]["t"])
+            data = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in chunk)
+            self._file.write(data)
+            self._size += len(data.encode("utf-8"))
+            self.written += len(chunk)
+        if batch:
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log.error("write failed", error=str(e))
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._writer.join(timeout=5)
+        self.flush()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def segments(directory):
+    """[(pid, seq, first_ts, path)], each writer's chain in write order."""
+    found = []
+    for name in os.listdir(directory):
+        m = SEGMENT_RE.match(name)
+        if m:
+            found.append((int(m.group(1)), int(m.group(2)), int(m.group(3)), os.path.join(directory, name)))
+    return sorted(found)
+
+
+def iter_chain(chain, since, until):
+    """Events of one writer. Segments that end before `since` (the next one starts earlier) are never opened."""
+    for i, (_, _, first_ts, path) in enumerate(chain):
+        if until is not None and first_ts > until:
+            return
+        if since is not None and i + 1 < len(chain) and chain[i + 1][2] < since:
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue   # a line cut short by a crash
+                t = event.get("t", 0)
+                if (since is None or t >= since) and (until is None or t <= until):
+                    yield event
+
+
+def iter_events(directory, since=None, until=None, types=None, call_sid=None):
+    """
+    Stream events in time order, one line at a time; memory use is one open segment
+    per writer process, not the size of the log.
+    """
+    chains = {}
+    for seg in segments(directory):
+        chains.setdefault(seg[0], []).append(seg)
+    types = set(types) if types else None
+    merged = heapq.merge(*(iter_chain(chain, since, until) for chain in chains.values()), key=lambda e: e.get("t", 0))
+    for event in merged:
+        if types and event.get("type") not in types:
+            continue
+        if call_sid and event.get("call_sid") != call_sid:
+            continue
+        yield event
+
+
+def parse_time(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read the Career Buddy event log.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("export", "summary"):
+        p = sub.add_parser(name)
+        p.add_argument("directory")
+        p.add_argument("--since", help="unix time or ISO date/time")
+        p.add_argument("--until", help="unix time or ISO date/time")
+        p.add_argument("--type", action="append", dest="types", help="event type (repeatable)")
+        p.add_argument("--call-sid")
+    args = parser.parse_args(argv)
+
+    events = iter_events(args.directory, parse_time(args.since), parse_time(args.until), args.types, args.call_sid)
+    if args.cmd == "export":
+        out = sys.stdout
+        for event in events:
+            out.write(json.dumps(event, ensure_ascii=False) + "\n")
+        return
+
+    by_type, calls, first, last = Counter(), set(), None, None
+    for event in events:
+        by_type[event["type"]] += 1
+        calls.add(event.get("call_sid"))
+        first = event["t"] if first is None else first
+        last = event["t"]
+    calls.discard(None)
+    print(f"{sum(by_type.values())} events, {len(calls)} calls"
+          + (f", {datetime.fromtimestamp(first):%Y-%m-%d %H:%M} .. {datetime.fromtimestamp(last):%Y-%m-%d %H:%M}" if first else ""))
+    for type_, n in by_type.most_common():
+        print(f"  {type_:<20}{n:>10}")
+
+
+if __name__ == "__main__":
+    main()
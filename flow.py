@@ -0,0 +1,169 @@
+# flow.py — question flow loaded from a data file and compiled into an indexed graph
+#
+# The file (JSON, or YAML if PyYAML is installed) looks like
+#
+#   {"start": "q1",
+#    "roles": {"name": "q1", "stream": "q2"},
+#    "speculative_after": "q13",
+#    "early_exit": [{"min_answered": 8, "if": {"margin_gte": 3}, "goto": "q14"}],
+#    "questions": [
+#      {"id": "q1", "tag": "name", "text": {"en": "...", "hi": "...", "gu": "..."}},
+#      {"id": "q10", "text": {...}, "skip_if": {"score": "trades", "gte": 2}},
+#      {"id": "q8", "text": {...}, "branches": [{"if": {"top": "creative"}, "goto": "q11"}]},
+#      {"id": "end", "text": {...}}]}
+#
+# Conditions look at the running category scores (scoring.py):
+#   {"score": cat, "gte": n} / {"score": cat, "lte": n}   one category's score
+#   {"top": cat}                                         cat is strictly ahead of every other
+#   {"margin_gte": n}                                     leader's lead over the runner-up
+#   {"total_gte": n}                                      sum of all scores
+#   {"all": [...]}, {"any": [...]}, {"not": {...}}
+# After a question, the first matching branch wins, else the next question in the list;
+# questions whose skip_if holds are passed over, and an early_exit rule (first match,
+# once min_answered answers are in) jumps straight to its goto. Every jump must go forward,
+# so a call always reaches "end".
+#
+# roles names the questions app.py reads for something specific: "name" (kept out of the
+# recommendation cache key) and "stream" (where a caller may state engineering or medical).
+# speculative_after is the last aptitude question; the speculative draft starts once a call
+# is past it. All of them are checked here, so a flow without them just turns those features off.
+import json
+
+from scoring import CATEGORIES
+
+
+class FlowError(ValueError):
+    pass
+
+
+def load_flow(path):
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise FlowError(f"{path}: install PyYAML to load YAML flows")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def compile_condition(cond, where):
+    if not isinstance(cond, dict) or len(cond) == 0:
+        raise FlowError(f"{where}: condition must be a non-empty object, got {cond!r}")
+    if "all" in cond:
+        parts = [compile_condition(c, where) for c in cond["all"]]
+        return lambda s: all(p(s) for p in parts)
+    if "any" in cond:
+        parts = [compile_condition(c, where) for c in cond["any"]]
+        return lambda s: any(p(s) for p in parts)
+    if "not" in cond:
+        part = compile_condition(cond["not"], where)
+        return lambda s: not part(s)
+    if "score" in cond:
+        cat = check_category(cond["score"], where)
+        if "gte" in cond:
+            n = float(cond["gte"])
+            return lambda s: s[cat] >= n
+        if "lte" in cond:
+            n = float(cond["lte"])
+            return lambda s: s[cat] <= n
+        raise FlowError(f"{where}: score condition needs gte or lte")
+    if "top" in cond:
+        cat = check_category(cond["top"], where)
+        return lambda s: all(s[cat] > v for c, v in s.items() if c != cat)
+    if "margin_gte" in cond:
+        n = float(cond["margin_gte"])
+        return lambda s: margin(s) >= n
+    if "total_gte" in cond:
+        n = float(cond["total_gte"])
+        return lambda s: sum(s.values()) >= n
+    raise FlowError(f"{where}: unknown condition {cond!r}")
+
+
+def check_category(cat, where):
+    if cat not in CATEGORIES:
+        raise FlowError(f"{where}: unknown category {cat!r} (expected one of {', '.join(CATEGORIES)})")
+    return cat
+
+
+def margin(scores):
+    top = sorted(scores.values(), reverse=True)
+    return top[0] - top[1] if len(top) > 1 else top[0]
+
+
+class Flow:
+    """
+    Compiled flow. questions is the plain list the TwiML templates index into (so
+    q_index keeps its meaning); next_index() walks the compiled edges.
+    """
+
+    def __init__(self, doc):
+        if isinstance(doc, list):
+            doc = {"questions": doc}
+        self.questions = [dict(q) for q in doc["questions"]]
+        self.index = {}
+        for i, q in enumerate(self.questions):
+            if q["id"] in self.index:
+                raise FlowError(f"duplicate question id {q['id']!r}")
+            self.index[q["id"]] = i
+        if "end" not in self.index:
+            raise FlowError("flow needs an 'end' question")
+        self.end_index = self.index["end"]
+        self.start_index = self.target(doc.get("start", self.questions[min(1, len(self.questions) - 1)]["id"]), "start")
+        self.tags = {q["id"]: q["tag"] for q in self.questions if "tag" in q}
+        self.roles = {role: self.questions[self.target(qid, f"roles.{role}")]["id"]
+                      for role, qid in (doc.get("roles") or {}).items()}
+        after = doc.get("speculative_after")
+        self.speculative_after = self.target(after, "speculative_after") if after else None
+
+        self.skip = {}        # index -> condition
+        self.branches = {}    # index -> [(condition, target index)]
+        for i, q in enumerate(self.questions):
+            where = f"question {q['id']}"
+            if "skip_if" in q:
+                if i in (self.start_index, self.end_index):
+                    raise FlowError(f"{where}: the start and end questions can't be skipped")
+                self.skip[i] = compile_condition(q["skip_if"], where)
+            for b in q.get("branches", ()):
+                self.branches.setdefault(i, []).append(
+                    (compile_condition(b["if"], where), self.target(b["goto"], where, after=i)))
+        self.early_exit = []  # [(min_answered, condition, target index)]
+        rules = doc.get("early_exit") or []
+        for n, rule in enumerate([rules] if isinstance(rules, dict) else rules):
+            where = f"early_exit[{n}]"
+            self.early_exit.append((int(rule.get("min_answered", 0)), compile_condition(rule["if"], where),
+                                    self.target(rule.get("goto", "end"), where)))
+
+    def target(self, qid, where, after=None):
+        if qid not in self.index:
+            raise FlowError(f"{where}: goto to unknown question {qid!r}")
+        i = self.index[qid]
+        if after is not None and i <= after:
+            raise FlowError(f"{where}: goto {qid!r} jumps backwards")
+        return i
+
+    def next_index(self, q_index, scores, answered):
+        """
+        Where to go after q_index, given the running scores ({category: score}) and the
+        number of answers so far. Returns (index, skipped question ids, early-exit rule number or None).
+        """
+        if q_index >= self.end_index:
+            return self.end_index, [], None
+        nxt = q_index + 1
+        for cond, target in self.branches.get(q_index, ()):
+            if cond(scores):
+                nxt = target
+                break
+        for n, (min_answered, cond, target) in enumerate(self.early_exit):
+            if answered >= min_answered and target > nxt and cond(scores):
+                return target, [], n
+        skipped = []
+        while nxt < self.end_index and nxt in self.skip and self.skip[nxt](scores):
+            skipped.append(self.questions[nxt]["id"])
+            nxt += 1
+        return nxt, skipped, None
+
+
+def compile_flow(doc):
+    """doc (the parsed file, or a bare list of questions) -> Flow; raises FlowError on a bad flow."""
+    return Flow(doc)
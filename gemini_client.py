@@ -0,0 +1,266 @@
+# gemini_client.py — circuit breaker, rate limit, deadlines and retries around generate_content
+import re
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from logs import get_logger
+from rate_limit import TokenBucket
+
+log = get_logger("gemini")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+
+class GeminiUnavailable(Exception):
+    """Raised instead of calling the model (circuit open, no rate budget, no free slot, deadline)."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def retry_delay_from_exception(e, default=30):
+    """Seconds the API asked us to back off for, parsed from the error text (None if not a quota error)."""
+    s = str(e).lower()
+    m = re.search(r"seconds[:=]?\s*(\d+)", s)
+    if m:
+        return int(m.group(1)) + 2
+    if "quota" in s or "429" in s or "exhausted" in s:
+        return default
+    return None
+
+
+def is_retryable(e):
+    s = str(e).lower()
+    return isinstance(e, (TimeoutError, asyncio.TimeoutError, ConnectionError)) or any(
+        code in s for code in ("429", "500", "502", "503", "504", "deadline", "timeout", "unavailable", "exhausted")
+    )
+
+
+class CircuitBreaker:
+    """
+    closed -> open after failure_threshold consecutive failures;
+    open -> half_open once reset_timeout has passed (or the API's retry delay, if longer);
+    half_open lets half_open_max trial calls through and closes on the first success.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_max=1, on_open=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.on_open = on_open
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trials = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self.state == OPEN and time.time() >= self.opened_until:
+            self.state = HALF_OPEN
+            self.trials = 0
+
+    def available(self):
+        """Would a call be let through right now? (does not consume a half-open trial)"""
+        with self._lock:
+            self._refresh()
+            return self.state == CLOSED or (self.state == HALF_OPEN and self.trials < self.half_open_max)
+
+    def allow(self):
+        """Let a call through? Returns the state it was admitted under (CLOSED or HALF_OPEN), or False."""
+        with self._lock:
+            self._refresh()
+            if self.state == CLOSED:
+                return CLOSED
+            if self.state == HALF_OPEN and self.trials < self.half_open_max:
+                self.trials += 1
+                return HALF_OPEN
+            return False
+
+    def release_trial(self):
+        """Give back a half-open trial whose call never reached the API (rate limit, no slot, cancelled)."""
+        with self._lock:
+            if self.state == HALF_OPEN and self.trials > 0:
+                self.trials -= 1
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trials = 0
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                delay = max(self.reset_timeout, retry_after or 0)
+                self.state = OPEN
+                self.opened_until = time.time() + delay
+                self.trials = 0
+                opened = True
+            else:
+                opened = False
+        if opened:
+            log.warning("circuit open", seconds=delay, failures=self.failures)
+            if self.on_open:
+                self.on_open(delay)
+
+
+class GeminiClient:
+    """
+    Shared gate in front of every generate_content call. The model is passed per call
+    (so app.genai_model can still be swapped, e.g. by loadtest.py), while the breaker,
+    rate budget and concurrency slots are shared by all callers in the process.
+    """
+
+    def __init__(self, rate_per_minute=60, burst=10, max_concurrent=8, max_retries=1,
+                 failure_threshold=5, reset_timeout=30, deadlines=None, on_open=None, observe=None, on_reject=None):
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, on_open=on_open)
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self._executor = None           # threads for generate_async on models without an async API
+        self._executor_lock = threading.Lock()
+        self.max_retries = max_retries
+        self.deadlines = deadlines or {}
+        self.observe = observe          # observe(kind, outcome, seconds)
+        self.on_reject = on_reject      # on_reject(kind, reason)
+
+    def available(self):
+        return self.breaker.available()
+
+    def _record_error(self, e):
+        if is_retryable(e):
+            # quota / server trouble counts against the breaker; a bad request means the API is up
+            self.breaker.record_failure(retry_delay_from_exception(e))
+        else:
+            self.breaker.record_success()
+
+    def _settle(self, admitted):
+        # admitted is still set when the call left without the API answering (rejected,
+        # cancelled): a half-open trial it held goes back, or the breaker would never close
+        if admitted == HALF_OPEN:
+            self.breaker.release_trial()
+
+    def _reject(self, kind, reason):
+        if self.on_reject:
+            self.on_reject(kind, reason)
+        raise GeminiUnavailable(reason)
+
+    def _observe(self, kind, outcome, t0):
+        if self.observe:
+            self.observe(kind, outcome, time.perf_counter() - t0)
+
+    def _backoff(self, attempt, e, remaining):
+        """Jittered exponential backoff, honouring the API's retry delay; None if it won't fit the deadline."""
+        delay = random.uniform(0.5, 1.5) * (2 ** attempt)
+        asked = retry_delay_from_exception(e, default=0)
+        if asked:
+            delay = max(delay, asked)
+        return delay if delay < remaining else None
+
+    def generate(self, model, parts, kind="final", deadline=None):
+        deadline = deadline or self.deadlines.get(kind, 30)
+        end = time.monotonic() + deadline
+        admitted = self.breaker.allow()
+        if not admitted:
+            self._reject(kind, "circuit_open")
+        try:
+            for attempt in range(self.max_retries + 1):
+                if not self.bucket.acquire(end - time.monotonic()):
+                    self._reject(kind, "rate_limited")
+                if not self.slots.acquire(timeout=max(0.0, end - time.monotonic())):
+                    self._reject(kind, "no_slot")
+                t0 = time.perf_counter()
+                try:
+                    remaining = max(0.1, end - time.monotonic())
+                    r = model.generate_content(parts, request_options={"timeout": remaining})
+                except Exception as e:
+                    self._observe(kind, "error", t0)
+                    self._record_error(e)
+                    admitted = None
+                    delay = self._backoff(attempt, e, end - time.monotonic())
+                    if attempt >= self.max_retries or not is_retryable(e) or delay is None:
+                        raise
+                    admitted = self.breaker.allow()
+                    if not admitted:
+                        raise
+                    log.info("retrying", kind=kind, attempt=attempt + 1, error=str(e), delay=round(delay, 1))
+                    time.sleep(delay)
+                    continue
+                finally:
+                    self.slots.release()
+                self._observe(kind, "ok", t0)
+                self.breaker.record_success()
+                admitted = None
+                return r
+        finally:
+            self._settle(admitted)
+
+    async def generate_async(self, model, parts, kind="ack", deadline=None):
+        """Same policy as generate() for asyncio callers; waits with asyncio.sleep instead of blocking."""
+        deadline = deadline or self.deadlines.get(kind, 30)
+        loop = asyncio.get_running_loop()
+        end = loop.time() + deadline
+        admitted = self.breaker.allow()
+        if not admitted:
+            self._reject(kind, "circuit_open")
+        try:
+            for attempt in range(self.max_retries + 1):
+                while (wait := self.bucket.try_acquire()) > 0.0:
+                    if loop.time() + wait > end:
+                        self._reject(kind, "rate_limited")
+                    await asyncio.sleep(wait)
+                while not self.slots.acquire(blocking=False):
+                    if loop.time() + 0.05 > end:
+                        self._reject(kind, "no_slot")
+                    await asyncio.sleep(0.05)
+                t0 = time.perf_counter()
+                in_thread = False
+                try:
+                    remaining = max(0.1, end - loop.time())
+                    if hasattr(model, "generate_content_async"):
+                        call = model.generate_content_async(parts, request_options={"timeout": remaining})
+                    else:
+                        call = asyncio.wrap_future(self._in_thread(model, parts, remaining))
+                        in_thread = True
+                    r = await asyncio.wait_for(call, remaining)
+                except Exception as e:
+                    self._observe(kind, "error", t0)
+                    self._record_error(e)
+                    admitted = None
+                    delay = self._backoff(attempt, e, end - loop.time())
+                    if attempt >= self.max_retries or not is_retryable(e) or delay is None:
+                        raise
+                    admitted = self.breaker.allow()
+                    if not admitted:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                finally:
+                    if not in_thread:
+                        self.slots.release()
+                self._observe(kind, "ok", t0)
+                self.breaker.record_success()
+                admitted = None
+                return r
+        finally:
+            self._settle(admitted)
+
+    def _in_thread(self, model, parts, remaining):
+        """
+        Run a blocking generate_content on the client's threads. The slot is released when the
+        thread finishes, not when the awaiting coroutine gives up: a timed-out call keeps
+        running, and still counts against max_concurrent until it does.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="gemini")
+        fut = self._executor.submit(contextvars.copy_context().run, model.generate_content, parts,
+                                    request_options={"timeout": remaining})
+        fut.add_done_callback(lambda f: self.slots.release())
+        return fut
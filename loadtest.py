@@ -0,0 +1,390 @@
+# loadtest.py — drive app.py with synthetic Twilio calls, or replay recorded webhook traffic
+#
+#   python loadtest.py simulate --calls 200 --concurrency 50 --gemini-latency 8
+#   python loadtest.py simulate --http --serve --calls 200 --concurrency 50
+#   python loadtest.py simulate --http --base-url https://abc123.ngrok.io --calls 20
+#   python loadtest.py replay webhooks.jsonl --speed 10 --http --base-url http://localhost:5000
+#   python loadtest.py startup --runs 10
+#   python loadtest.py memory --sessions 5000
+#
+# Record real traffic by starting app.py with WEBHOOK_RECORD_FILE=webhooks.jsonl.
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+SAMPLE_ANSWERS = [
+    "alone", "with friends", "yes I like discussing", "a coding club", "I like to find out how it works",
+    "math puzzles", "easy", "careful work like calculating", "I would draw a diagram", "build with my hands",
+    "drawing and painting", "outdoors", "I fix phones for my family", "learn and grow", "government job",
+    "very important, I want to be a doctor", "the whole team doing well", "balanced life",
+]
+STUB_RECOMMENDATION = (
+    "1. Engineering (Computer) - enjoys logic and fixing things. Next: take maths and science in 11th.\n"
+    "2. Design - likes drawing. Next: build a small portfolio.\n"
+    "3. ITI diploma - hands-on skills. Next: visit the local ITI."
+)
+
+
+class StubGeminiModel:
+    """Stands in for genai.GenerativeModel with a configurable (jittered) latency."""
+
+    def __init__(self, latency=2.0, jitter=0.25, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def generate_content(self, parts, **kwargs):
+        time.sleep(max(0.0, self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)))
+        if random.random() < self.error_rate:
+            raise RuntimeError("429 Resource has been exhausted (stub)")
+        return type("StubResponse", (), {"text": STUB_RECOMMENDATION})()
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)   # endpoint -> [seconds]
+        self.errors = defaultdict(int)
+        self.calls_done = 0
+
+    def record(self, endpoint, seconds, ok=True):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def call_done(self):
+        with self.lock:
+            self.calls_done += 1
+
+    def report(self, wall):
+        def pct(sorted_vals, p):
+            if not sorted_vals:
+                return 0.0
+            k = min(len(sorted_vals) - 1, int(round(p / 100.0 * (len(sorted_vals) - 1))))
+            return sorted_vals[k]
+
+        lines = [f"{'endpoint':<26}{'n':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        total = 0
+        for endpoint in sorted(self.latencies):
+            vals = sorted(self.latencies[endpoint])
+            total += len(vals)
+            lines.append(
+                f"{endpoint:<26}{len(vals):>7}{self.errors[endpoint]:>6}"
+                f"{pct(vals, 50) * 1000:>10.1f}{pct(vals, 95) * 1000:>10.1f}{pct(vals, 99) * 1000:>10.1f}{vals[-1] * 1000:>10.1f}"
+            )
+        lines.append(f"requests: {total} in {wall:.2f}s ({total / wall if wall else 0:.1f} req/s)")
+        lines.append(f"calls completed: {self.calls_done} ({self.calls_done / wall if wall else 0:.2f} calls/s)")
+        return "\n".join(lines)
+
+
+class ClientTransport:
+    """Posts straight into the Flask app through its test client (no sockets)."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.local = threading.local()
+
+    def post(self, path, query, form):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.flask_app.test_client()
+        r = client.post(path, query_string=query, data=form)
+        return r.status_code, r.get_data(as_text=True)
+
+
+class HttpTransport:
+    """Real HTTP against a running server; one pooled requests.Session per thread."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.local = threading.local()
+
+    def post(self, path, query, form):
+        import requests
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        r = session.post(self.base_url + path, params=query, data=form, timeout=30)
+        return r.status_code, r.text
+
+
+def twilio_form(call_sid, caller, **extra):
+    form = {
+        "CallSid": call_sid, "AccountSid": "AC" + "0" * 32, "From": caller, "To": "+15005550006",
+        "CallStatus": "in-progress", "Direction": "outbound-api", "ApiVersion": "2010-04-01",
+    }
+    form.update(extra)
+    return form
+
+
+def split_url(url):
+    parts = urlsplit(url.replace("&amp;", "&"))
+    return parts.path, parts.query
+
+
+def timed_post(transport, stats, path, query, form):
+    t0 = time.perf_counter()
+    try:
+        status, body = transport.post(path, query, form)
+    except Exception as e:
+        stats.record(path, time.perf_counter() - t0, ok=False)
+        raise RuntimeError(f"{path} failed: {e}")
+    stats.record(path, time.perf_counter() - t0, ok=status == 200)
+    if status != 200:
+        raise RuntimeError(f"{path} returned HTTP {status}")
+    return body
+
+
+def simulate_call(transport, stats, n, args):
+    """One synthetic call: language menu, every question (some skipped), then the recommendation loop."""
+    rnd = random.Random(n)
+    call_sid = f"CA{n:032x}"
+    caller = f"+9190000{n:05d}"[:13]
+    body = timed_post(transport, stats, "/voice", "", twilio_form(call_sid, caller))
+    body = timed_post(transport, stats, "/set_language", "", twilio_form(call_sid, caller, Digits=rnd.choice("123")))
+    for _ in range(500):   # hard stop in case the flow never hangs up
+        if "<Hangup" in body:
+            stats.call_done()
+            return
+        gather = re.search(r'<Gather[^>]*action="([^"]+)"', body)
+        if gather:
+            if args.think_time:
+                time.sleep(rnd.uniform(0, args.think_time))
+            skip = re.search(r"<Redirect[^>]*>([^<]*/skip_question[^<]*)</Redirect>", body)
+            if skip and rnd.random() < args.skip_rate:
+                path, query = split_url(skip.group(1))
+                form = twilio_form(call_sid, caller)
+            else:
+                path, query = split_url(gather.group(1))
+                form = twilio_form(call_sid, caller, SpeechResult=rnd.choice(SAMPLE_ANSWERS),
+                                   Confidence=f"{rnd.uniform(0.6, 0.95):.2f}")
+            body = timed_post(transport, stats, path, query, form)
+            continue
+        redirect = re.search(r"<Redirect[^>]*>([^<]+)</Redirect>", body)
+        if not redirect:
+            raise RuntimeError(f"call {call_sid}: no Gather/Redirect/Hangup in {body[:200]}")
+        pause = sum(int(x) for x in re.findall(r'<Pause length="(\d+)"', body))
+        if pause and args.pause_scale:
+            time.sleep(pause * args.pause_scale)
+        path, query = split_url(redirect.group(1))
+        body = timed_post(transport, stats, path, query, twilio_form(call_sid, caller))
+    raise RuntimeError(f"call {call_sid}: flow did not finish")
+
+
+def run_pool(fn, items, concurrency):
+    errors = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for fut in [pool.submit(fn, item) for item in items]:
+            try:
+                fut.result()
+            except Exception as e:
+                errors += 1
+                print("error:", e, file=sys.stderr)
+    return errors
+
+
+def load_app(args):
+    """Build app.py's Flask app in-process with the stubbed Gemini model."""
+    os.environ.setdefault("NGROK_URL", args.base_url or "http://loadtest.local")
+    import app as app_module
+    app_module.genai_model = StubGeminiModel(args.gemini_latency, error_rate=args.gemini_error_rate)
+    app_module.genai_refine_model = StubGeminiModel(args.gemini_latency / 4, error_rate=args.gemini_error_rate)
+    return app_module.create_app()
+
+
+def serve_in_background(flask_app, port):
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", port, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_transport(args):
+    if not args.http:
+        return ClientTransport(load_app(args))
+    if args.serve:
+        args.base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+        serve_in_background(load_app(args), args.port)
+    if not args.base_url:
+        raise SystemExit("--http needs --base-url (or --serve)")
+    return HttpTransport(args.base_url)
+
+
+def cmd_simulate(args):
+    transport = make_transport(args)
+    stats = Stats()
+    t0 = time.perf_counter()
+    errors = run_pool(lambda n: simulate_call(transport, stats, n, args), range(args.calls), args.concurrency)
+    wall = time.perf_counter() - t0
+    print(stats.report(wall))
+    print(f"failed calls: {errors}")
+
+
+def cmd_replay(args):
+    """Re-send recorded webhooks, keeping their relative timing divided by --speed."""
+    with open(args.file, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        raise SystemExit("nothing to replay")
+    records.sort(key=lambda r: r["t"])
+    transport = make_transport(args)
+    stats = Stats()
+    t_first = records[0]["t"]
+    t0 = time.perf_counter()
+    suffix = args.sid_suffix
+
+    def send(rec):
+        delay = (rec["t"] - t_first) / args.speed - (time.perf_counter() - t0)
+        if delay > 0:
+            time.sleep(delay)
+        form = dict(rec["form"])
+        if suffix and "CallSid" in form:
+            form["CallSid"] += suffix
+        timed_post(transport, stats, rec["path"], rec.get("query", ""), form)
+
+    errors = run_pool(send, records, args.concurrency)
+    wall = time.perf_counter() - t0
+    stats.calls_done = len({r["form"].get("CallSid") for r in records if r["path"] == "/voice"})
+    print(stats.report(wall))
+    print(f"failed requests: {errors}")
+
+
+# run in a fresh interpreter per sample: what a new worker pays before it can answer a call
+STARTUP_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app(warm=False)
+t2 = time.perf_counter()
+app.warm_up()
+t3 = time.perf_counter()
+r = flask_app.test_client().post("/voice", data={"CallSid": "CAstartup", "From": "+910000000000"})
+t4 = time.perf_counter()
+print("STARTUP " + json.dumps({"import app": t1 - t0, "create_app": t2 - t1, "warm_up": t3 - t2,
+                               "first /voice": t4 - t3, "total": t4 - t0, "status": r.status_code}))
+"""
+
+
+def cmd_startup(args):
+    """Time worker boot phases over --runs fresh interpreters."""
+    env = dict(os.environ, EVENT_LOG_DIR=os.environ.get("EVENT_LOG_DIR", ""))
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = defaultdict(list)
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE], cwd=here, env=env, capture_output=True, text=True)
+        samples["process"].append(time.perf_counter() - t0)
+        line = next((l for l in out.stdout.splitlines() if l.startswith("STARTUP ")), None)
+        if out.returncode or line is None:
+            raise SystemExit(f"startup probe failed:\n{out.stdout}{out.stderr}")
+        result = json.loads(line[len("STARTUP "):])
+        if result.pop("status") != 200:
+            raise SystemExit("first /voice did not return 200")
+        for phase, seconds in result.items():
+            samples[phase].append(seconds)
+    print(f"{'phase':<16}{'runs':>6}{'p50 ms':>10}{'min ms':>10}{'max ms':>10}")
+    for phase in ("import app", "create_app", "warm_up", "first /voice", "total", "process"):
+        vals = samples[phase]
+        print(f"{phase:<16}{len(vals):>6}{statistics.median(vals) * 1000:>10.1f}{min(vals) * 1000:>10.1f}{max(vals) * 1000:>10.1f}")
+
+
+def cmd_memory(args):
+    """Bytes per in-memory session and per stored row: the old dict shapes vs session_model."""
+    import tracemalloc
+    from session_model import Answer, Session, encode_session, seed_question_ids
+
+    qids = [f"q{i + 1}" for i in range(args.answers)]
+    seed_question_ids(qids)
+    rng = random.Random(7)
+    words = "I like fixing phones and building things with my hands helping people drawing computers".split()
+    # built up front and shared by both shapes: only the session/answer containers are measured
+    calls = [(f"CA{n:032x}", "+919876543210",
+              [" ".join(rng.choices(words, k=rng.randint(2, 9))) for _ in qids],
+              [f"{rng.uniform(0.5, 1.0):.8f}" for _ in qids]) for n in range(args.sessions)]
+
+    def legacy(call_sid, caller, transcripts, confidences):
+        return {"call_sid": call_sid, "caller": caller, "q_index": len(qids), "lang": "en",
+                "answers": [{"question_id": q, "transcript": t, "confidence": c}
+                            for q, t, c in zip(qids, transcripts, confidences)],
+                "scores": [0.0] * 6, "created": time.time()}
+
+    def slotted(call_sid, caller, transcripts, confidences):
+        return Session(call_sid, caller, len(qids), "en",
+                       [Answer(q, t, c) for q, t, c in zip(qids, transcripts, confidences)],
+                       [0.0] * 6, time.time())
+
+    results = {}
+    for name, build in (("dict", legacy), ("slotted", slotted)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        sessions = [build(*c) for c in calls]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        rows = [json.dumps(s, ensure_ascii=False) for s in sessions] if name == "dict" \
+            else [encode_session(s) for s in sessions]
+        results[name] = (used / len(sessions), sum(len(r.encode()) for r in rows) / len(rows))
+        del sessions, rows
+
+    print(f"{args.sessions} sessions x {args.answers} answers (transcript text excluded from memory)")
+    print(f"{'shape':<10}{'bytes/session':>15}{'stored bytes':>14}")
+    for name, (mem, wire) in results.items():
+        print(f"{name:<10}{mem:>15.0f}{wire:>14.0f}")
+    (m0, w0), (m1, w1) = results["dict"], results["slotted"]
+    print(f"{'saved':<10}{1 - m1 / m0:>15.0%}{1 - w1 / w0:>14.0%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Career Buddy webhooks.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    def common(p):
+        p.add_argument("--concurrency", type=int, default=20)
+        p.add_argument("--http", action="store_true", help="use real HTTP instead of the Flask test client")
+        p.add_argument("--base-url", help="server to hit in --http mode (also used as NGROK_URL in-process)")
+        p.add_argument("--serve", action="store_true", help="with --http: start app.py in-process on --port")
+        p.add_argument("--port", type=int, default=5055)
+        p.add_argument("--gemini-latency", type=float, default=2.0, help="stub model latency in seconds")
+        p.add_argument("--gemini-error-rate", type=float, default=0.0)
+
+    p = sub.add_parser("simulate", help="N synthetic concurrent calls")
+    common(p)
+    p.add_argument("--calls", type=int, default=50)
+    p.add_argument("--skip-rate", type=float, default=0.1, help="fraction of questions answered by timeout")
+    p.add_argument("--think-time", type=float, default=0.0, help="max random seconds before each answer")
+    p.add_argument("--pause-scale", type=float, default=0.05, help="multiply TwiML <Pause> lengths by this")
+    p.set_defaults(func=cmd_simulate)
+
+    p = sub.add_parser("replay", help="replay a WEBHOOK_RECORD_FILE capture")
+    common(p)
+    p.add_argument("file")
+    p.add_argument("--speed", type=float, default=1.0, help="time compression factor (10 = 10x faster)")
+    p.add_argument("--sid-suffix", default="", help="append to CallSid so replays don't collide with live calls")
+    p.set_defaults(func=cmd_replay)
+
+    p = sub.add_parser("startup", help="time a fresh worker's import, app factory, warm-up and first webhook")
+    p.add_argument("--runs", type=int, default=5)
+    p.set_defaults(func=cmd_startup)
+
+    p = sub.add_parser("memory", help="bytes per session in memory and in the store, old dicts vs slotted types")
+    p.add_argument("--sessions", type=int, default=5000)
+    p.add_argument("--answers", type=int, default=18)
+    p.set_defaults(func=cmd_memory)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
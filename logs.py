@@ -0,0 +1,242 @@
+# logs.py — structured logging off the request path, with sampling and per-call debug
+#
+#   log = get_logger("app")
+#   log.info("answer saved", q_index=3, transcript="...")     # call_sid comes from tracing.CURRENT_CALL
+#   log.twiml("/voice", body)                                  # only for calls with debug on
+#
+# A request only builds a LogRecord and puts it on a bounded queue; a QueueListener thread
+# formats it (text or one JSON object per line) and writes it, so handlers never wait on
+# stdout. When the writer falls queue_size records behind, new records are dropped and
+# counted rather than blocking a webhook.
+#
+# A call's records below WARNING can be sampled (sample_rate); the choice is made per CallSid,
+# so a sampled call keeps all its lines. Calls in DEBUG_CALLS (LOG_DEBUG_CALLS, or POST
+# /calls/<sid>/debug with the admin token) log at DEBUG, TwiML bodies included, whatever the level and sampling.
+import sys
+import json
+import time
+import queue
+import zlib
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from tracing import CURRENT_CALL
+
+ROOT = "careerbuddy"
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+
+class DebugCalls:
+    """CallSids logging at DEBUG, each until its expiry (process-local, like the tracer)."""
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._calls = {}          # call_sid -> expiry (unix time)
+        self._lock = threading.Lock()
+
+    def enable(self, call_sid, seconds=None):
+        with self._lock:
+            self._calls[call_sid] = time.time() + (seconds or self.ttl)
+
+    def disable(self, call_sid):
+        with self._lock:
+            return self._calls.pop(call_sid, None) is not None
+
+    def enabled(self, call_sid):
+        if not self._calls or not call_sid:   # the common case: nobody is being debugged
+            return False
+        expiry = self._calls.get(call_sid)
+        if expiry is None:
+            return False
+        if expiry < time.time():
+            self.disable(call_sid)
+            return False
+        return True
+
+    def calls(self):
+        now = time.time()
+        with self._lock:
+            return {sid: round(expiry - now) for sid, expiry in self._calls.items() if expiry >= now}
+
+
+DEBUG_CALLS = DebugCalls()
+
+
+class Sampler:
+    """Keeps a fraction of calls' records below WARNING, decided per CallSid; lines outside a call are always kept."""
+
+    def __init__(self, rate=1.0):
+        self.rate = rate
+
+    def keep(self, call_sid):
+        if self.rate >= 1.0 or not call_sid:
+            return True
+        return zlib.crc32(call_sid.encode()) % 10000 < self.rate * 10000
+
+
+SAMPLER = Sampler()
+
+
+class StructuredLogger:
+    """
+    Wraps a logging.Logger: keyword arguments become the record's fields, and the level,
+    sampling and per-call debug checks run before any record is built.
+    """
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(f"{ROOT}.{name}")
+
+    def enabled(self, level, call_sid):
+        if DEBUG_CALLS.enabled(call_sid):
+            return True
+        if not self.logger.isEnabledFor(level):
+            return False
+        return level >= logging.WARNING or SAMPLER.keep(call_sid)
+
+    def log(self, level, msg, call_sid=None, exc_info=False, **fields):
+        call_sid = call_sid or CURRENT_CALL.get()
+        if not self.enabled(level, call_sid):
+            return
+        if exc_info is True:
+            exc_info = sys.exc_info()
+        record = self.logger.makeRecord(self.logger.name, level, "", 0, msg, (), exc_info or None,
+                                        extra={"call_sid": call_sid, "fields": fields})
+        # handle() rather than log(): the level was already decided above, per call
+        self.logger.handle(record)
+
+    def debug(self, msg, **fields):
+        self.log(logging.DEBUG, msg, **fields)
+
+    def info(self, msg, **fields):
+        self.log(logging.INFO, msg, **fields)
+
+    def warning(self, msg, **fields):
+        self.log(logging.WARNING, msg, **fields)
+
+    def error(self, msg, **fields):
+        self.log(logging.ERROR, msg, **fields)
+
+    def exception(self, msg, **fields):
+        self.log(logging.ERROR, msg, exc_info=True, **fields)
+
+    def twiml(self, endpoint, body, call_sid=None, **fields):
+        """Log an outgoing TwiML body (bytes or str) — only for calls with debug enabled."""
+        call_sid = call_sid or CURRENT_CALL.get()
+        if DEBUG_CALLS.enabled(call_sid):
+            self.log(logging.DEBUG, "outgoing twiml", call_sid=call_sid, endpoint=endpoint,
+                     twiml=body.decode() if isinstance(body, bytes) else str(body), **fields)
+
+
+def get_logger(name):
+    return StructuredLogger(name)
+
+
+def record_fields(record):
+    fields = {}
+    if getattr(record, "call_sid", None):
+        fields["call_sid"] = record.call_sid
+    fields.update(getattr(record, "fields", None) or {})
+    return fields
+
+
+class TextFormatter(logging.Formatter):
+    """2026-10-17 09:30:01.234 INFO app answer saved call_sid=CA.. q_index=3 (a TwiML body goes on the lines after)."""
+
+    def format(self, record):
+        fields = record_fields(record)
+        twiml = fields.pop("twiml", None)
+        line = f"{self.formatTime(record)}.{int(record.msecs):03d} {record.levelname} {record.name[len(ROOT) + 1:] or ROOT} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v!r}" if isinstance(v, str) and " " in v else f"{k}={v}" for k, v in fields.items())
+        if twiml:
+            line += "\n" + twiml
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+    def formatTime(self, record, datefmt=None):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: t, level, logger, msg, call_sid and the record's fields."""
+
+    def format(self, record):
+        out = {"t": round(record.created, 3), "level": record.levelname.lower(),
+               "logger": record.name[len(ROOT) + 1:] or ROOT, "msg": record.getMessage(), **record_fields(record)}
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+FORMATTERS = {"text": TextFormatter, "json": JsonFormatter}
+
+
+class BackgroundHandler(QueueHandler):
+    """QueueHandler that never blocks and leaves formatting to the listener thread."""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the stock prepare() formats here, on the request thread; the listener does it instead
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+HANDLER = None
+LISTENER = None
+SETUP_LOCK = threading.Lock()
+
+
+def setup_logging(level="info", fmt="text", sample_rate=1.0, debug_calls=(), debug_ttl=3600,
+                  queue_size=10000, stream=None):
+    """Route the careerbuddy.* loggers through the background handler (once per process)."""
+    global HANDLER, LISTENER
+    if fmt not in FORMATTERS:
+        raise ValueError(f"unknown LOG_FORMAT {fmt!r}; expected one of {sorted(FORMATTERS)}")
+    if level.lower() not in LEVELS:
+        raise ValueError(f"unknown LOG_LEVEL {level!r}; expected one of {sorted(LEVELS)}")
+    with SETUP_LOCK:
+        SAMPLER.rate = sample_rate
+        DEBUG_CALLS.ttl = debug_ttl
+        for call_sid in debug_calls:
+            DEBUG_CALLS.enable(call_sid)
+        root = logging.getLogger(ROOT)
+        root.setLevel(LEVELS[level.lower()])
+        if HANDLER is not None:
+            return HANDLER
+        out = logging.StreamHandler(stream or sys.stdout)
+        out.setFormatter(FORMATTERS[fmt]())
+        HANDLER = BackgroundHandler(queue.Queue(queue_size))
+        root.addHandler(HANDLER)
+        root.propagate = False
+        LISTENER = QueueListener(HANDLER.queue, out)
+        LISTENER.start()
+        atexit.register(stop_logging)
+        return HANDLER
+
+
+def stop_logging():
+    """Write out whatever is still queued and stop the listener thread."""
+    global LISTENER
+    with SETUP_LOCK:
+        if LISTENER is not None:
+            LISTENER.stop()
+            LISTENER = None
+
+
+def stats():
+    return {"enqueued": HANDLER.enqueued if HANDLER else 0, "dropped": HANDLER.dropped if HANDLER else 0,
+            "queued": HANDLER.queue.qsize() if HANDLER else 0, "sample_rate": SAMPLER.rate,
+            "debug_calls": len(DEBUG_CALLS.calls())}
@@ -1,26 +1,388 @@
-# make_call.py
+# make_call.py — place one outbound call, or run a campaign over a CSV roster
+#
+#   python make_call.py call +91XXXXXXXXXX
+#   python make_call.py campaign roster.csv --cps 1 --concurrency 10
+#   python make_call.py campaign roster.csv --progress roster.progress.jsonl    # resumes after a crash
+#
+# Try a campaign locally against the fake REST endpoint (no real calls, no Twilio account):
+#
+#   python make_call.py fake-twilio --port 8099 --busy 0.2 --no-answer 0.2
+#   TWILIO_API_BASE=http://127.0.0.1:8099 python make_call.py campaign roster.csv --poll 0.5 --backoff 1
 import os
+import re
+import csv
+import sys
+import json
+import time
+import heapq
+import random
+import argparse
+import threading
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
 from dotenv import load_dotenv
 
+from rate_limit import TokenBucket
+
 load_dotenv()
 
 account_sid = os.getenv("TWILIO_ACCOUNT_SID")
 auth_token = os.getenv("TWILIO_AUTH_TOKEN")
 twilio_number = os.getenv("TWILIO_PHONE_NUMBER")
 
-client = Client(account_sid, auth_token)
+# Your ngrok URL (same one you used in Twilio webhook)
+ngrok_url = os.getenv("NGROK_URL", "https://nicki-grizzled-trinh.ngrok-free.dev")
+# point the REST client somewhere else, e.g. the fake-twilio server below
+api_base = os.getenv("TWILIO_API_BASE")
+
+FINAL_STATUSES = {"completed", "busy", "no-answer", "failed", "canceled"}
+RETRY_STATUSES = {"busy", "no-answer"}
+# twilio error codes that mean "this number will never work" (invalid / unverified / blocked)
+PERMANENT_ERROR_CODES = {21210, 21211, 21214, 21215, 21216, 21217, 21219, 21401, 21408, 21610, 21612}
 
-# ✅ Replace this with your verified Indian number (must start with +91)
-to_number = "+91XXXXXXXXXX"
 
-# Your ngrok URL (same one you used in Twilio webhook)
-ngrok_url = "https://nicki-grizzled-trinh.ngrok-free.dev"
+def make_client(pool_size=10, timeout=15):
+    """One Twilio client for the whole process; its requests.Session keeps connections alive."""
+    http_client = TwilioHttpClient(pool_connections=True, timeout=timeout)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    http_client.session.mount("https://", adapter)
+    http_client.session.mount("http://", adapter)
+    client = Client(account_sid or "AC" + "0" * 32, auth_token or "fake", http_client=http_client)
+    if api_base:
+        client.api.base_url = api_base.rstrip("/")
+    return client
+
+
+def normalize_number(raw, country_code="+91"):
+    digits = re.sub(r"[^\d+]", "", raw or "")
+    if not digits:
+        return None
+    if digits.startswith("+"):
+        return digits
+    if digits.startswith("00"):
+        return "+" + digits[2:]
+    if len(digits) == 10:
+        return country_code + digits
+    if len(digits) == 11 and digits.startswith("0"):
+        return country_code + digits[1:]
+    return "+" + digits
+
+
+def read_roster(path, column=None, country_code="+91"):
+    """Yield normalized numbers from a CSV, one row at a time (header row optional)."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if not first:
+            return
+        if any(re.search(r"\d", cell) for cell in first):
+            # no header: numbers are in the first column
+            rows = chain([first[0]], (row[0] if row else "" for row in reader))
+        else:
+            fields = [c.strip().lower() for c in first]
+            want = (column or "").strip().lower()
+            idx = fields.index(want) if want in fields else next(
+                (i for i, c in enumerate(fields) if c in ("phone", "number", "mobile", "to")), 0)
+            rows = (row[idx] if len(row) > idx else "" for row in reader)
+        for raw in rows:
+            number = normalize_number(raw, country_code)
+            if number:
+                yield number
+
+
+class Progress:
+    """
+    Append-only JSONL of dial attempts and their outcomes. Replaying it on start tells
+    us which numbers are finished, which are waiting for a retry and which calls were
+    still ringing when the previous run died.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}        # number -> last record
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.state[rec["to"]] = rec
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, **rec):
+        rec["t"] = round(time.time(), 3)
+        with self._lock:
+            self.state[rec["to"]] = rec
+            self._file.write(json.dumps(rec) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class Campaign:
+    """
+    Dials a roster with at most `concurrency` calls in progress and at most `cps` new
+    calls per second. Each worker places a call and polls it to a final status; busy
+    and no-answer are re-queued with exponential backoff up to max_attempts.
+    """
+
+    def __init__(self, client, progress, from_number, url, cps=1.0, concurrency=5, max_attempts=3,
+                 backoff=300, poll_interval=5, max_ring=120):
+        self.client = client
+        self.progress = progress
+        self.from_number = from_number
+        self.url = url
+        self.bucket = TokenBucket(cps, 1)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.max_ring = max_ring
+        self.retries = []      # heap of (due, number, attempt)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, status):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def schedule_retry(self, number, attempt, status):
+        due = time.time() + self.backoff * (2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+        self.progress.record(to=number, attempt=attempt, status=status, retry_at=round(due, 3))
+        with self._lock:
+            heapq.heappush(self.retries, (due, number, attempt + 1))
+
+    def finish(self, number, attempt, status, sid=None, error=None):
+        if status in RETRY_STATUSES and attempt < self.max_attempts:
+            self.count("retry_" + status)
+            self.schedule_retry(number, attempt, status)
+            return
+        self.count(status)
+        self.progress.record(to=number, attempt=attempt, status=status, sid=sid, error=error, done=True)
+
+    def wait_for_result(self, sid):
+        end = time.time() + self.max_ring + 3600   # ringing is capped by `timeout`; the rest is talk time
+        while time.time() < end:
+            time.sleep(self.poll_interval)
+            try:
+                status = self.client.calls(sid).fetch().status
+            except TwilioRestException as e:
+                print(f"[campaign] status check for {sid} failed: {e.msg}")
+                continue
+            if status in FINAL_STATUSES:
+                return status
+        return "unknown"
+
+    def dial(self, number, attempt, sid=None):
+        """Worker: place the call (unless resuming one already placed) and wait for its outcome."""
+        try:
+            if sid is None:
+                if not self.bucket.acquire(timeout=3600):
+                    # no dial budget within the hour: back in line, without using up an attempt
+                    self.count("requeued")
+                    with self._lock:
+                        heapq.heappush(self.retries, (time.time(), number, attempt))
+                    return
+                try:
+                    call = self.client.calls.create(to=number, from_=self.from_number, url=self.url, timeout=self.max_ring)
+                except TwilioRestException as e:
+                    if e.code in PERMANENT_ERROR_CODES or attempt >= self.max_attempts:
+                        self.finish(number, attempt, "error", error=f"{e.code}: {e.msg}")
+                    else:
+                        self.count("retry_error")
+                        self.schedule_retry(number, attempt, "error")
+                    return
+                sid = call.sid
+                self.progress.record(to=number, attempt=attempt, status="dialed", sid=sid)
+                print(f"[campaign] {number} attempt {attempt}: {sid}")
+            status = self.wait_for_result(sid)
+            self.finish(number, attempt, status, sid=sid)
+        except Exception as e:
+            print(f"[campaign] {number} attempt {attempt} crashed: {e}")
+            self.finish(number, attempt, "error", sid=sid, error=str(e))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def resume_jobs(self):
+        """Split the progress log into retries to schedule and placed calls to keep watching."""
+        watch = []
+        for number, rec in self.progress.state.items():
+            if rec.get("done"):
+                continue
+            if rec["status"] == "dialed":
+                watch.append((number, rec["attempt"], rec["sid"]))
+            elif "retry_at" in rec:
+                heapq.heappush(self.retries, (rec["retry_at"], number, rec["attempt"] + 1))
+        return watch
+
+    def run(self, numbers):
+        t0 = time.time()
+        known = set(self.progress.state)
+        watch = self.resume_jobs()
+        if known:
+            print(f"[campaign] resuming: {len(known)} numbers seen, {len(watch)} calls to re-check, {len(self.retries)} retries pending")
+        numbers = iter(numbers)
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            def submit(*job):
+                self.slots.acquire()
+                with self._lock:
+                    self.in_flight += 1
+                pool.submit(self.dial, *job)
+
+            for number, attempt, sid in watch:
+                submit(number, attempt, sid)
+            while True:
+                with self._lock:
+                    due = self.retries[0] if self.retries and self.retries[0][0] <= time.time() else None
+                    if due:
+                        heapq.heappop(self.retries)
+                if due:
+                    submit(due[1], due[2])
+                    continue
+                if not exhausted:
+                    number = next(numbers, None)
+                    if number is None:
+                        exhausted = True
+                    elif number not in known:
+                        known.add(number)
+                        submit(number, 1)
+                    continue
+                # roster done: wait for in-flight calls (they may queue more retries)
+                with self._lock:
+                    idle = not self.retries and not self.in_flight
+                    next_due = self.retries[0][0] if self.retries else None
+                if idle:
+                    break
+                time.sleep(min(1.0, max(0.05, (next_due or time.time() + 1) - time.time())))
+
+        print(f"[campaign] finished in {time.time() - t0:.1f}s: {json.dumps(self.counts, sort_keys=True)}")
+        return self.counts
+
+
+# ---------- Local fake of the Twilio Calls API ----------
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    """
+    POST /2010-04-01/Accounts/<AC>/Calls.json creates a call; GET .../Calls/<CA>.json reports
+    queued -> ringing -> a final status drawn from the server's outcome weights after ring_time.
+    """
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        m = re.match(r"^/2010-04-01/Accounts/(\w+)/Calls\.json$", self.path)
+        if not m:
+            return self._send(404, {"code": 20404, "message": "not found", "status": 404})
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()).items()}
+        server = self.server
+        if not re.match(r"^\+\d{8,15}$", form.get("To", "")):
+            return self._send(400, {"code": 21211, "message": f"Invalid 'To' Phone Number: {form.get('To')}", "status": 400})
+        with server.lock:
+            server.created += 1
+            sid = f"CA{server.created:032x}"
+            outcome = random.choices(list(server.outcomes), weights=list(server.outcomes.values()))[0]
+            server.calls[sid] = {"to": form["To"], "created": time.time(), "outcome": outcome}
+            server.max_active = max(server.max_active, server.active())
+        self._send(201, {"sid": sid, "account_sid": m.group(1), "to": form["To"], "from": form.get("From"), "status": "queued"})
+
+    def do_GET(self):
+        m = re.match(r"^/2010-04-01/Accounts/(\w+)/Calls/(CA\w+)\.json$", self.path)
+        call = self.server.calls.get(m.group(2)) if m else None
+        if not call:
+            return self._send(404, {"code": 20404, "message": "not found", "status": 404})
+        status = call["outcome"] if time.time() - call["created"] >= self.server.ring_time else "ringing"
+        self._send(200, {"sid": m.group(2), "account_sid": m.group(1), "to": call["to"], "status": status})
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_fake_twilio(port, ring_time=1.0, busy=0.2, no_answer=0.2, failed=0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeTwilioHandler)
+    server.lock = threading.Lock()
+    server.calls = {}
+    server.created = 0
+    server.max_active = 0
+    server.ring_time = ring_time
+    server.outcomes = {"completed": max(0.0, 1 - busy - no_answer - failed), "busy": busy, "no-answer": no_answer, "failed": failed}
+    server.active = lambda: sum(1 for c in server.calls.values() if time.time() - c["created"] < ring_time)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Outbound calls for Career Buddy.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("call", help="place a single call")
+    p.add_argument("to", help="e.g. +91XXXXXXXXXX (must be verified on a trial account)")
+
+    p = sub.add_parser("campaign", help="dial every number in a CSV roster")
+    p.add_argument("roster", help="CSV with a phone/number/mobile column (or numbers in the first column)")
+    p.add_argument("--column", help="CSV column holding the number")
+    p.add_argument("--country-code", default="+91", help="prefix for bare 10-digit numbers")
+    p.add_argument("--progress", help="progress log (default: <roster>.progress.jsonl)")
+    p.add_argument("--cps", type=float, default=1.0, help="new calls per second (Twilio's default account limit is 1)")
+    p.add_argument("--concurrency", type=int, default=5, help="calls in progress at once")
+    p.add_argument("--max-attempts", type=int, default=3)
+    p.add_argument("--backoff", type=float, default=300, help="seconds before the first retry (doubles each time)")
+    p.add_argument("--poll", type=float, default=5, help="seconds between call status checks")
+    p.add_argument("--ring-timeout", type=int, default=40, help="seconds to ring before no-answer")
+
+    p = sub.add_parser("fake-twilio", help="serve a local fake of the Twilio Calls API")
+    p.add_argument("--port", type=int, default=8099)
+    p.add_argument("--ring-time", type=float, default=1.0)
+    p.add_argument("--busy", type=float, default=0.2)
+    p.add_argument("--no-answer", type=float, default=0.2)
+    p.add_argument("--failed", type=float, default=0.0)
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "fake-twilio":
+        server = serve_fake_twilio(args.port, args.ring_time, args.busy, args.no_answer, args.failed)
+        print(f"fake Twilio API on http://127.0.0.1:{args.port} (set TWILIO_API_BASE to this)")
+        server.serve_forever()
+        return
+
+    if args.cmd == "call":
+        client = make_client()
+        call = client.calls.create(
+            to=normalize_number(args.to),
+            from_=twilio_number,
+            url=f"{ngrok_url}/voice"  # Twilio will fetch this to start conversation
+        )
+        print(f"Call initiated! SID: {call.sid}")
+        return
+
+    client = make_client(pool_size=args.concurrency + 2)
+    progress = Progress(args.progress or args.roster + ".progress.jsonl")
+    try:
+        Campaign(client, progress, twilio_number, f"{ngrok_url}/voice", cps=args.cps, concurrency=args.concurrency,
+                 max_attempts=args.max_attempts, backoff=args.backoff, poll_interval=args.poll,
+                 max_ring=args.ring_timeout).run(read_roster(args.roster, args.column, args.country_code))
+    finally:
+        progress.close()
 
-call = client.calls.create(
-    to=to_number,
-    from_=twilio_number,
-    url=f"{ngrok_url}/voice"  # Twilio will fetch this to start conversation
-)
 
-print(f"Call initiated! SID: {call.sid}")
+if __name__ == "__main__":
+    main(sys.argv[1:])
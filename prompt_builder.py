@@ -0,0 +1,119 @@
+# prompt_builder.py — compact answers block for the recommendation prompts, within a token budget
+import re
+
+from scoring import CATEGORY_INDEX, tokenize
+
+PLACEHOLDER_RE = re.compile(r"^\((no speech captured|recording:.*)\)$", re.IGNORECASE)
+CLAUSE_SPLIT_RE = re.compile(r"(?<=[.!?।,;])\s+")
+SPACE_RE = re.compile(r"\s+")
+MAX_REPEAT = 4            # longest stutter (in words) collapsed by clean_answer
+MIN_LINE_TOKENS = 4       # below this a truncated answer says nothing; drop it instead
+
+
+def estimate_tokens(text):
+    """Cheap token estimate: ~4 chars per token for Latin text, ~2 for Devanagari/Gujarati."""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return max(1, round(ascii_chars / 4 + (len(text) - ascii_chars) / 2))
+
+
+def clean_answer(text):
+    """Collapse whitespace and drop repeated clauses / immediately repeated words."""
+    text = SPACE_RE.sub(" ", (text or "").strip())
+    if not text or PLACEHOLDER_RE.match(text):
+        return ""
+    seen, clauses = set(), []
+    for clause in CLAUSE_SPLIT_RE.split(text):
+        key = " ".join(tokenize(clause))
+        if key and key not in seen:
+            seen.add(key)
+            clauses.append(clause)
+    src = " ".join(clauses).split(" ")
+    lower = [w.lower() for w in src]
+    words, i = [], 0
+    while i < len(src):
+        # skip a run of up to MAX_REPEAT words that just repeats the run before it ("I like I like")
+        for n in range(min(MAX_REPEAT, i), 0, -1):
+            if lower[i:i + n] == lower[i - n:i] and [w.lower() for w in words[-n:]] == lower[i - n:i]:
+                i += n
+                break
+        else:
+            words.append(src[i])
+            i += 1
+    return " ".join(words)
+
+
+def informativeness(text):
+    """Keyword hits dominate; distinct words break ties, so "yes" ranks below "I fix phones"."""
+    tokens = tokenize(text)
+    return 2 * sum(CATEGORY_INDEX.score_tokens(tokens)) + min(len(set(tokens)), 10) / 10
+
+
+class AnswersBlock:
+    """The compacted "tag: answer" lines plus what was done to get there (for logs and metrics)."""
+
+    def __init__(self, lines, stats):
+        self.lines = lines
+        self.stats = stats
+        self.text = "\n".join(f"{tag}: {answer}" for tag, answer in lines)
+        self.tokens = estimate_tokens(self.text) if self.text else 0
+
+
+def build_answers_block(answers, budget_tokens=400, tags=None, skip=()):
+    """
+    answers -> AnswersBlock. Placeholders are dropped, a re-asked question keeps its last
+    answer, identical answers to different questions are merged under one line, and if the
+    block is over budget the least informative lines are cut down (or dropped) first.
+    tags maps question ids to the short topic shown instead (the flow file's "tag"s).
+    """
+    tags = tags or {}
+    stats = {"answers": len(answers), "empty": 0, "merged": 0, "truncated": 0, "dropped": 0}
+    by_id = {}
+    for a in answers:
+        qid = a.get("question_id")
+        if qid in skip:
+            continue
+        text = clean_answer(a.get("transcript"))
+        if not text:
+            stats["empty"] += 1
+            by_id.pop(qid, None)
+            continue
+        by_id.pop(qid, None)      # keep flow order of the latest answer
+        by_id[qid] = text
+
+    merged = {}                   # normalized answer -> [tags, text]
+    for qid, text in by_id.items():
+        key = " ".join(tokenize(text))
+        tag = tags.get(qid, qid)
+        if key in merged:
+            merged[key][0].append(tag)
+            stats["merged"] += 1
+        else:
+            merged[key] = [[tag], text]
+    lines = [[", ".join(tag_list), text] for tag_list, text in merged.values()]
+
+    def size(line):
+        return estimate_tokens(f"{line[0]}: {line[1]}") + 1   # + newline
+
+    total = sum(size(line) for line in lines)
+    if total > budget_tokens:
+        for line in sorted(lines, key=lambda l: (informativeness(l[1]), -len(l[1]))):
+            if total <= budget_tokens:
+                break
+            excess = total - budget_tokens
+            current = size(line)
+            words = line[1].split(" ")[:-1]
+            while words and current - size([line[0], " ".join(words) + "…"]) < excess:
+                words.pop()
+            shortened = " ".join(words) + "…"
+            # cut this line only if that alone meets the budget and leaves something worth sending
+            if words and size([line[0], shortened]) >= MIN_LINE_TOKENS:
+                total -= current - size([line[0], shortened])
+                line[1] = shortened
+                stats["truncated"] += 1
+            else:
+                total -= current
+                line[1] = None
+                stats["dropped"] += 1
+        lines = [line for line in lines if line[1] is not None]
+
+    return AnswersBlock([tuple(line) for line in lines], stats)
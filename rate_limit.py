@@ -0,0 +1,36 @@
+# rate_limit.py — token bucket shared by the Gemini client and the outbound dialer
+import time
+import threading
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst; acquire() waits at most its timeout."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token if one is available. Returns 0.0 on success, else seconds until the next token."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout):
+        """True once a token is taken; False if none would be free within timeout seconds."""
+        end = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0.0:
+                return True
+            if time.monotonic() + wait > end:
+                return False
+            time.sleep(wait)
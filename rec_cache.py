@@ -0,0 +1,112 @@
+# rec_cache.py — LRU + TTL cache of final recommendations keyed on normalized answers
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+EMPTY = "-"
+PLACEHOLDER_RE = re.compile(r"^\((no speech captured|recording:.*)\)$")
+PUNCT_RE = re.compile(r"[^\w\s]+")
+SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_answer(text):
+    """Lowercase, drop punctuation, collapse whitespace; every no-answer placeholder becomes EMPTY."""
+    t = (text or "").strip().lower()
+    if not t or PLACEHOLDER_RE.match(t):
+        return EMPTY
+    t = SPACE_RE.sub(" ", PUNCT_RE.sub(" ", t)).strip()
+    return t or EMPTY
+
+
+def answers_fingerprint(answers, lang_code, order, skip=()):
+    """
+    Stable key for a set of answers: question ids ordered by their position in the flow
+    (order maps id -> index), later answers to the same id win, ids in skip are ignored.
+    """
+    by_id = {}
+    for a in answers:
+        qid = a.get("question_id")
+        if qid in skip:
+            continue
+        by_id[qid] = normalize_answer(a.get("transcript"))
+    items = sorted(by_id.items(), key=lambda kv: (order.get(kv[0], len(order)), kv[0]))
+    raw = json.dumps([lang_code, items], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class RecommendationCache:
+    """
+    Thread-safe LRU with a TTL. With a path, entries are appended to a JSONL file and
+    reloaded on start, so a restart keeps the warm cache; the file is compacted on load.
+    """
+
+    def __init__(self, max_entries=5000, ttl=7 * 24 * 3600, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._data = OrderedDict()   # key -> (stored_at, text)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._load()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or time.time() - item[0] > self.ttl:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, text):
+        now = time.time()
+        with self._lock:
+            self._data[key] = (now, text)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"k": key, "t": now, "v": text}, ensure_ascii=False) + "\n")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._data), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        cutoff = time.time() - self.ttl
+        lines = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec["t"] >= cutoff:
+                    self._data[rec["k"]] = (rec["t"], rec["v"])
+                    self._data.move_to_end(rec["k"])
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+        if lines > 2 * max(len(self._data), 1):
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for key, (stored_at, text) in self._data.items():
+                    f.write(json.dumps({"k": key, "t": stored_at, "v": text}, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
@@ -0,0 +1,173 @@
+# rescore.py — re-run recommendations over stored sessions without redialing anyone
+#
+#   python rescore.py sessions.db --out rescored.jsonl --mode rules
+#   python rescore.py sessions.jsonl --out rescored.jsonl --mode both --stub --workers 16
+#   python rescore.py sessions.db --out rescored.jsonl --mode gemini --workers 4 --resume
+#
+# Input is the SQLite session store (SESSION_BACKEND=sqlite) or a JSONL file with one
+# session per line, e.g.  sqlite3 sessions.db "select data from sessions" > sessions.jsonl
+# Output is one JSON line per session, written as results arrive; --resume skips call_sids
+# already in --out, so an interrupted run picks up where it stopped. Real Gemini runs go
+# through app.GEMINI, so GEMINI_RPM / GEMINI_MAX_CONCURRENT still cap the request rate.
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from loadtest import Stats, StubGeminiModel
+from rate_limit import TokenBucket
+from session_model import decode_session
+
+core = None   # app.py, imported lazily (once per worker process in --processes mode)
+
+
+def load_core(stub, stub_latency):
+    global core
+    if core is None:
+        import app
+        if stub:
+            # offline: no API quota to protect, so lift the shared rate budget as well
+            app.genai_model = StubGeminiModel(stub_latency)
+            app.GEMINI.bucket = TokenBucket(rate=1e6, burst=1e6)
+        core = app
+    return core
+
+
+def iter_sessions(path):
+    """Stream Sessions from a SQLite store file or a JSONL dump (never loads the whole file).
+    Both the compact rows and the older dict-shaped ones are read."""
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            for (data,) in conn.execute("SELECT data FROM sessions ORDER BY updated"):
+                yield decode_session(data)
+        finally:
+            conn.close()
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield decode_session(line)
+
+
+def is_complete(session, end_index):
+    """The call got through the flow (with branches and early exits the last question asked varies)."""
+    return bool(session.final_text) or session.q_index >= end_index
+
+
+def done_call_sids(out_path):
+    """call_sids already written to out_path (the output file doubles as the checkpoint)."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["call_sid"])
+            except (ValueError, KeyError):
+                continue   # a line cut short by the interrupted run; it gets redone
+    return done
+
+
+def rescore_session(session, mode, stub=False, stub_latency=0.5):
+    """Runs in the worker (thread or process). Stored scores are dropped so current keyword rules apply."""
+    c = load_core(stub, stub_latency)
+    session = session.snapshot()
+    session.scores = None
+    lang = session.lang
+    out = {"call_sid": session.call_sid, "lang": lang, "answers": len(session.answers),
+           "scores": c.session_scores(session), "previous": session.final_text}
+    timings = {}
+    if mode in ("rules", "both"):
+        t0 = time.perf_counter()
+        out["rules"] = c.rule_based_careers(session, lang)
+        timings["rules"] = time.perf_counter() - t0
+    if mode in ("gemini", "both"):
+        # model text only: no live cache writes, and a fallback is flagged instead of hidden
+        t0 = time.perf_counter()
+        text = c.gemini_recommendation_text(session, lang)
+        timings["gemini"] = time.perf_counter() - t0
+        out["gemini"] = text or c.rule_based_careers(session, lang)
+        out["gemini_fallback"] = text is None
+    return out, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run career recommendations over stored sessions.")
+    parser.add_argument("input", help="sessions.db (SQLite store) or a JSONL dump")
+    parser.add_argument("--out", required=True, help="JSONL results file (appended to with --resume)")
+    parser.add_argument("--mode", choices=("rules", "gemini", "both"), default="rules")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--processes", action="store_true", help="process pool instead of threads (CPU-bound rules runs)")
+    parser.add_argument("--resume", action="store_true", help="skip call_sids already present in --out")
+    parser.add_argument("--all", action="store_true", help="include calls that hung up before the last question")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many sessions (0 = no limit)")
+    parser.add_argument("--stub", action="store_true", help="use the stub Gemini model (offline runs)")
+    parser.add_argument("--stub-latency", type=float, default=0.5)
+    parser.add_argument("--progress", type=float, default=5.0, help="seconds between progress lines on stderr")
+    args = parser.parse_args(argv)
+
+    c = load_core(args.stub, args.stub_latency)
+    end_index = c.FLOW.end_index
+    done = done_call_sids(args.out) if args.resume else set()
+    if done:
+        print(f"resuming: {len(done)} sessions already in {args.out}", file=sys.stderr)
+
+    stats = Stats()
+    skipped = errors = 0
+    pool_cls = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    window = args.workers * 4   # bounded in-flight work keeps memory flat on big dumps
+    t0 = last_report = time.perf_counter()
+
+    with pool_cls(max_workers=args.workers) as pool, open(args.out, "a" if args.resume else "w", encoding="utf-8") as out:
+        pending = set()
+
+        def drain(block):
+            nonlocal errors, last_report
+            if block:
+                finished = wait(pending, return_when=FIRST_COMPLETED).done
+            else:
+                finished = {f for f in pending if f.done()}
+            for fut in finished:
+                pending.discard(fut)
+                try:
+                    result, timings = fut.result()
+                except Exception as e:
+                    errors += 1
+                    print("error:", e, file=sys.stderr)
+                    continue
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                for kind, seconds in timings.items():
+                    stats.record(kind, seconds)
+                stats.call_done()
+            now = time.perf_counter()
+            if args.progress and now - last_report >= args.progress:
+                last_report = now
+                print(f"{stats.calls_done} sessions, {stats.calls_done / (now - t0):.1f}/s, {errors} errors", file=sys.stderr)
+
+        submitted = 0
+        for session in iter_sessions(args.input):
+            if session.call_sid in done or not (args.all or is_complete(session, end_index)):
+                skipped += 1
+                continue
+            if args.limit and submitted >= args.limit:
+                break
+            pending.add(pool.submit(rescore_session, session, args.mode, args.stub, args.stub_latency))
+            submitted += 1
+            while len(pending) >= window:
+                drain(block=True)
+            drain(block=False)
+        while pending:
+            drain(block=True)
+
+    wall = time.perf_counter() - t0
+    print(stats.report(wall))
+    print(f"skipped: {skipped}  failed: {errors}  written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
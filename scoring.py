@@ -0,0 +1,128 @@
+# scoring.py — keyword/phrase index (en/hi/gu) compiled once, scored per answer into a category vector
+import re
+import unicodedata
+
+CATEGORIES = ("engineering", "medical", "creative", "trades")
+
+# "word*" is a prefix match (engineer* -> engineer, engineering, engineers); everything else is a
+# whole-token match, so "art" no longer fires on "start". Multi-word entries are phrases.
+CATEGORY_KEYWORDS = {
+    "engineering": [
+        "engineer*", "math*", "physics", "computer*", "coding", "code", "coder", "program*", "electronic*",
+        "mechanical", "civil", "electrical", "science", "robot*", "technology", "software",
+        "इंजीनियर", "इंजीनियरिंग", "गणित", "भौतिकी", "कंप्यूटर", "कम्प्यूटर", "कोडिंग", "विज्ञान", "मशीन",
+        "એન્જિનિયર", "એન્જિનિયરિંગ", "ગણિત", "કમ્પ્યુટર", "કોમ્પ્યુટર", "કોડિંગ", "વિજ્ઞાન", "ભૌતિકશાસ્ત્ર", "મશીન",
+    ],
+    "medical": [
+        "medical", "medicine", "doctor*", "biology", "surgery", "surgeon", "patient*", "pharmacy", "nurse*",
+        "nursing", "health", "hospital",
+        "डॉक्टर", "डाक्टर", "दवा", "अस्पताल", "मरीज", "मरीज़", "नर्स", "स्वास्थ्य", "जीवविज्ञान",
+        "ડૉક્ટર", "ડોક્ટર", "દવા", "હોસ્પિટલ", "દર્દી", "નર્સ", "આરોગ્ય", "જીવવિજ્ઞાન",
+    ],
+    "creative": [
+        "creative", "draw*", "art", "arts", "artist", "design*", "writing", "write", "painting", "paint",
+        "music", "craft*",
+        "ड्राइंग", "चित्र", "चित्रकारी", "कला", "डिज़ाइन", "डिजाइन", "लिखना", "रचनात्मक", "संगीत",
+        "ચિત્ર", "ચિત્રકામ", "કલા", "ડિઝાઇન", "લખવું", "સર્જનાત્મક", "સંગીત",
+    ],
+    "trades": [
+        "hands", "fix*", "mechanic", "tool*", "practical", "build*", "repair*", "hands on", "with my hand",
+        "औज़ार", "औजार", "मरम्मत", "हाथ से", "ठीक करना", "ठीक करता", "ठीक करती", "बनाना",
+        "સાધન", "રિપેર", "હાથથી", "હાથ થી", "ઠીક કરવું", "બનાવવું",
+    ],
+}
+
+# explicit stream statements (used by rule_based_decision for q2)
+EXPLICIT_KEYWORDS = {
+    "engineering": ["engineer*", "इंजीनियर", "इंजीनियरिंग", "એન્જિનિયર", "એન્જિનિયરિંગ"],
+    "medical": ["medical", "doctor*", "medicine", "डॉक्टर", "डाक्टर", "ડૉક્ટર", "ડોક્ટર"],
+}
+
+# split on whitespace/punctuation only; \w would cut Devanagari/Gujarati words at their vowel signs
+TOKEN_SPLIT_RE = re.compile(r"[\s.,!?;:()\[\]{}\"'`।॥\-—–/]+")
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFC", text or "").lower()
+    return [t for t in TOKEN_SPLIT_RE.split(text) if t]
+
+
+class KeywordIndex:
+    """
+    Built once from {category: [keywords]}. score() walks the tokens a single time:
+    exact tokens are one dict lookup, prefixes are checked per token length, phrases
+    are keyed on their first token. Returns a list aligned with self.categories.
+    """
+
+    def __init__(self, keywords, categories=None):
+        self.categories = tuple(categories or keywords)
+        self.exact = {}     # token -> [category index]
+        self.prefix = {}    # prefix -> [category index]
+        self.phrases = {}   # first token -> [(rest tuple, category index)]
+        for ci, cat in enumerate(self.categories):
+            for kw in keywords.get(cat, ()):
+                tokens = tokenize(kw.rstrip("*"))
+                if len(tokens) > 1:
+                    self.phrases.setdefault(tokens[0], []).append((tuple(tokens[1:]), ci))
+                elif kw.endswith("*"):
+                    self.prefix.setdefault(tokens[0], []).append(ci)
+                else:
+                    self.exact.setdefault(tokens[0], []).append(ci)
+        self.prefix_lengths = sorted({len(p) for p in self.prefix})
+
+    def empty(self):
+        return [0.0] * len(self.categories)
+
+    def score_tokens(self, tokens, into=None):
+        """Add one point per category for each distinct keyword found in tokens."""
+        vec = into if into is not None else self.empty()
+        seen = set()
+        for i, tok in enumerate(tokens):
+            for ci in self.exact.get(tok, ()):
+                seen.add((tok, ci))
+            for n in self.prefix_lengths:
+                if n > len(tok):
+                    break
+                for ci in self.prefix.get(tok[:n], ()):
+                    seen.add((tok[:n] + "*", ci))
+            for rest, ci in self.phrases.get(tok, ()):
+                if tuple(tokens[i + 1:i + 1 + len(rest)]) == rest:
+                    seen.add(((tok,) + rest, ci))
+        for _, ci in seen:
+            vec[ci] += 1.0
+        return vec
+
+    def score(self, text, into=None):
+        return self.score_tokens(tokenize(text), into)
+
+
+CATEGORY_INDEX = KeywordIndex(CATEGORY_KEYWORDS, CATEGORIES)
+EXPLICIT_INDEX = KeywordIndex(EXPLICIT_KEYWORDS)
+
+
+def score_answers(answers):
+    """Category vector for a whole list of answers (used for sessions without running scores)."""
+    vec = CATEGORY_INDEX.empty()
+    for a in answers:
+        CATEGORY_INDEX.score(a.get("transcript", ""), into=vec)
+    return vec
+
+
+def add_answer_score(session, transcript):
+    """
+    Fold one just-appended answer into session["scores"]. Sessions without running
+    scores are scored from all their answers (which already include this one).
+    """
+    scores = session.get("scores")
+    if scores is None or len(scores) != len(CATEGORIES):
+        scores = session["scores"] = score_answers(session["answers"])
+    else:
+        CATEGORY_INDEX.score(transcript, into=scores)
+    return scores
+
+
+def session_scores(session):
+    scores = session.get("scores")
+    if scores is None or len(scores) != len(CATEGORIES):
+        scores = score_answers(session["answers"])
+    return dict(zip(CATEGORIES, scores))
@@ -0,0 +1,170 @@
+# session_model.py — compact call session / answer types and the wire format the stores persist
+#
+# A call keeps ~20 answers, and a busy worker holds thousands of calls, so both types use
+# __slots__, question ids are interned as small ints, and confidence is a float.
+# encode_session()/decode_session() give the compact JSON form for any persistent store;
+# decode_session() also reads the older dict-shaped rows.
+import sys
+import json
+import threading
+
+FORMAT_VERSION = 1
+
+# question id <-> small int; seeded from QUESTION_FLOW (seed_question_ids), so on a fresh
+# process a question's number is its index there. Ids only ever get appended, so numbers
+# stay valid across flow reloads within the process (they are never persisted).
+QUESTION_IDS = []
+QUESTION_NUMBERS = {}
+INTERN_LOCK = threading.Lock()
+
+
+def intern_question_id(qid):
+    n = QUESTION_NUMBERS.get(qid)
+    if n is None:
+        with INTERN_LOCK:
+            n = QUESTION_NUMBERS.get(qid)
+            if n is None:
+                n = QUESTION_NUMBERS[qid] = len(QUESTION_IDS)
+                QUESTION_IDS.append(qid)
+    return n
+
+
+def seed_question_ids(ids):
+    for qid in ids:
+        intern_question_id(qid)
+
+
+def parse_confidence(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Answer:
+    __slots__ = ("qid", "transcript", "confidence", "recording_sid", "transcribed")
+
+    def __init__(self, question_id, transcript, confidence=0.0, recording_sid=None, transcribed=False):
+        self.qid = question_id if isinstance(question_id, int) else intern_question_id(question_id)
+        self.transcript = transcript
+        self.confidence = parse_confidence(confidence)
+        self.recording_sid = recording_sid
+        self.transcribed = transcribed
+
+    @property
+    def question_id(self):
+        return QUESTION_IDS[self.qid]
+
+    # key access, for helpers that also read stored dicts (scoring, prompt_builder, rec_cache)
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def to_list(self):
+        row = [self.question_id, self.transcript, self.confidence, self.recording_sid, self.transcribed]
+        while len(row) > 3 and not row[-1]:
+            row.pop()
+        return row
+
+    @classmethod
+    def from_list(cls, row):
+        return cls(*row)
+
+    def to_dict(self):
+        d = {"question_id": self.question_id, "transcript": self.transcript, "confidence": self.confidence}
+        if self.recording_sid:
+            d["recording_sid"] = self.recording_sid
+        if self.transcribed:
+            d["transcribed"] = True
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["question_id"], d.get("transcript"), d.get("confidence"), d.get("recording_sid"), d.get("transcribed", False))
+
+    def __reduce__(self):
+        # pickle the id itself: another process has its own numbering
+        return Answer, tuple(self.to_list())
+
+    def __repr__(self):
+        return f"Answer({self.question_id!r}, {self.transcript!r}, {self.confidence})"
+
+
+class Session:
+    __slots__ = ("call_sid", "caller", "q_index", "lang", "answers", "scores", "created",
+                 "final_text", "rec_started", "rec_polls")
+
+    def __init__(self, call_sid, caller=None, q_index=0, lang="en", answers=None, scores=None, created=None,
+                 final_text=None, rec_started=None, rec_polls=0):
+        self.call_sid = call_sid
+        self.caller = caller
+        self.q_index = q_index
+        self.lang = sys.intern(lang)
+        self.answers = answers if answers is not None else []
+        self.scores = scores
+        self.created = created
+        self.final_text = final_text
+        self.rec_started = rec_started
+        self.rec_polls = rec_polls
+
+    def snapshot(self):
+        """Copy with its own answers list (the Answer objects are shared), for background jobs."""
+        copy = Session.__new__(Session)
+        for name in Session.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.answers = list(self.answers)
+        copy.scores = list(self.scores) if self.scores is not None else None
+        return copy
+
+    # key access, for helpers that also take stored dicts (scoring.session_scores, rescore.py)
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def to_dict(self):
+        d = {name: getattr(self, name) for name in Session.__slots__ if getattr(self, name) is not None}
+        d["answers"] = [a.to_dict() for a in self.answers]
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["call_sid"], d.get("caller"), d.get("q_index", 0), d.get("lang") or "en",
+                   [Answer.from_dict(a) for a in d.get("answers", ())], d.get("scores"), d.get("created"),
+                   d.get("final_text"), d.get("rec_started"), d.get("rec_polls", 0))
+
+    def __repr__(self):
+        return f"Session({self.call_sid!r}, q_index={self.q_index}, lang={self.lang!r}, answers={len(self.answers)})"
+
+
+def encode_session(session):
+    """Positional JSON: [version, call_sid, caller, q_index, lang, created, scores, final_text,
+    rec_started, rec_polls, [[question_id, transcript, confidence(, recording_sid, transcribed)], ...]]."""
+    return json.dumps([FORMAT_VERSION, session.call_sid, session.caller, session.q_index, session.lang, session.created,
+                       session.scores, session.final_text, session.rec_started, session.rec_polls,
+                       [a.to_list() for a in session.answers]], ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_session(raw):
+    data = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+    if isinstance(data, dict):
+        return Session.from_dict(data)   # rows written before the compact format
+    if data[0] != FORMAT_VERSION:
+        raise ValueError(f"unknown session format version {data[0]!r}")
+    _, call_sid, caller, q_index, lang, created, scores, final_text, rec_started, rec_polls, answers = data
+    return Session(call_sid, caller, q_index, lang, [Answer.from_list(a) for a in answers], scores, created,
+                   final_text, rec_started, rec_polls)
@@ -0,0 +1,325 @@
+# session_store.py — pluggable call-session storage (memory / SQLite WAL / Redis)
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from logs import get_logger
+from session_model import decode_session, encode_session
+
+log = get_logger("sessions")
+
+
+class SessionStore:
+    """
+    Minimal interface used by app.get_session/advance.
+    Sessions are session_model.Session objects keyed by their call_sid; the shared
+    stores persist them as text through encode/decode (session_model's compact format).
+    """
+
+    countable = True   # len() is cheap enough for every /metrics scrape
+    live = False       # get() hands out the very object webhooks are mutating
+
+    def __init__(self):
+        self._values = OrderedDict()   # key -> (expires, value), for the in-process put_if_absent/put_value
+        self._values_lock = threading.Lock()
+
+    def get(self, call_sid):
+        raise NotImplementedError
+
+    def put(self, session):
+        raise NotImplementedError
+
+    def delete(self, call_sid):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    # Small shared values next to the sessions (e.g. which worker runs a call's recommendation
+    # job, then its text), so workers sharing a store don't duplicate work. Written through,
+    # never buffered. This base version is in-process, which is all the memory store needs.
+    def put_if_absent(self, key, value, ttl):
+        """Store value unless key is already set. True if this call set it."""
+        with self._values_lock:
+            self._expire_values()
+            if key in self._values:
+                return False
+            self._values[key] = (time.time() + ttl, value)
+            return True
+
+    def put_value(self, key, value, ttl):
+        with self._values_lock:
+            self._values.pop(key, None)
+            self._values[key] = (time.time() + ttl, value)
+            self._expire_values()
+
+    def get_value(self, key):
+        with self._values_lock:
+            item = self._values.get(key)
+        return item[1] if item and item[0] > time.time() else None
+
+    def _expire_values(self):
+        # one ttl per use, so insertion order is expiry order
+        now = time.time()
+        while self._values and next(iter(self._values.values()))[0] <= now:
+            self._values.popitem(last=False)
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process dict with TTL + LRU eviction (the original behaviour, but bounded).
+    get() returns the live dict, so put() is only needed to refresh its position.
+    """
+
+    live = True
+
+    def __init__(self, ttl=3600, max_sessions=10000):
+        super().__init__()
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._data = OrderedDict()   # call_sid -> (last_touched, session)
+        self._lock = threading.Lock()
+
+    def get(self, call_sid):
+        with self._lock:
+            item = self._data.get(call_sid)
+            if item is None:
+                return None
+            touched, session = item
+            if time.time() - touched > self.ttl:
+                del self._data[call_sid]
+                return None
+            self._data[call_sid] = (time.time(), session)
+            self._data.move_to_end(call_sid)
+            return session
+
+    def put(self, session):
+        with self._lock:
+            call_sid = session.call_sid
+            self._data[call_sid] = (time.time(), session)
+            self._data.move_to_end(call_sid)
+            self._evict()
+
+    def delete(self, call_sid):
+        with self._lock:
+            self._data.pop(call_sid, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def _evict(self):
+        # oldest entries sit at the front; drop expired ones, then trim to size
+        cutoff = time.time() - self.ttl
+        while self._data:
+            call_sid, (touched, _) = next(iter(self._data.items()))
+            if touched >= cutoff and len(self._data) <= self.max_sessions:
+                break
+            del self._data[call_sid]
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite in WAL mode so several gunicorn workers can share one file.
+    Writes are buffered and flushed in batches by a background thread (write-behind);
+    reads check the local buffer first so a worker always sees its own writes.
+    Twilio's webhooks for one call are sequential and at least a TwiML <Say> apart,
+    so a flush interval in the tens of milliseconds keeps other workers consistent.
+    """
+
+    def __init__(self, path="sessions.db", ttl=3600, flush_interval=0.05, batch_size=200,
+                 encode=encode_session, decode=decode_session):
+        super().__init__()
+        self.path = path
+        self.encode = encode
+        self.decode = decode
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._pending = {}           # call_sid -> serialized session awaiting flush
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " call_sid TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated)")
+        conn.execute("CREATE TABLE IF NOT EXISTS shared_values (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        conn.commit()
+        self._writer = threading.Thread(target=self._run, name="session-writer", daemon=True)
+        self._writer.start()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, call_sid):
+        with self._lock:
+            raw = self._pending.get(call_sid)
+        if raw is not None:
+            return self.decode(raw)
+        row = self._conn().execute(
+            "SELECT data, updated FROM sessions WHERE call_sid = ?", (call_sid,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return self.decode(row[0])
+
+    def put(self, session):
+        # serialize on the caller's thread so later mutations can't race the writer
+        raw = self.encode(session)
+        with self._lock:
+            self._pending[session.call_sid] = raw
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def delete(self, call_sid):
+        with self._lock:
+            self._pending.pop(call_sid, None)
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE call_sid = ?", (call_sid,))
+        conn.commit()
+
+    def __len__(self):
+        self.flush()
+        cutoff = time.time() - self.ttl
+        return self._conn().execute("SELECT COUNT(*) FROM sessions WHERE updated >= ?", (cutoff,)).fetchone()[0]
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        now = time.time()
+        rows = [(sid, raw, now) for sid, raw in batch.items()]
+        conn = self._conn()
+        try:
+            conn.executemany(
+                "INSERT INTO sessions (call_sid, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(call_sid) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                rows,
+            )
+            conn.commit()
+        except Exception:
+            # keep the batch for the next flush unless a newer write replaced it
+            with self._lock:
+                for sid, raw in batch.items():
+                    self._pending.setdefault(sid, raw)
+            raise
+
+    def put_if_absent(self, key, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM shared_values WHERE key = ? AND expires <= ?", (key, now))
+            cur = conn.execute("INSERT OR IGNORE INTO shared_values (key, value, expires) VALUES (?, ?, ?)",
+                               (key, value, now + ttl))
+        return cur.rowcount == 1
+
+    def put_value(self, key, value, ttl):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO shared_values (key, value, expires) VALUES (?, ?, ?)",
+                         (key, value, time.time() + ttl))
+
+    def get_value(self, key):
+        row = self._conn().execute("SELECT value FROM shared_values WHERE key = ? AND expires > ?",
+                                   (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def evict_expired(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+        conn.execute("DELETE FROM shared_values WHERE expires <= ?", (time.time(),))
+        conn.commit()
+
+    def _run(self):
+        last_evict = time.time()
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.time() - last_evict > 60:
+                    self.evict_expired()
+                    last_evict = time.time()
+            except Exception as e:
+                log.error("flush failed", error=str(e))
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._writer.join(timeout=2)
+        self.flush()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Works with any redis-py compatible client (redis.Redis, fakeredis, a local
+    Valkey/KeyDB stand-in). Expiry is delegated to Redis via SET ... EX.
+    len() has to SCAN the keyspace, so the sessions gauge isn't exported for this store.
+    """
+
+    countable = False
+
+    def __init__(self, client, ttl=3600, prefix="careerbuddy:session:", encode=encode_session, decode=decode_session):
+        super().__init__()
+        self.client = client
+        self.encode = encode
+        self.decode = decode
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, call_sid):
+        raw = self.client.get(self.prefix + call_sid)
+        if raw is None:
+            return None
+        return self.decode(raw)
+
+    def put(self, session):
+        self.client.set(self.prefix + session.call_sid, self.encode(session), ex=self.ttl)
+
+    def delete(self, call_sid):
+        self.client.delete(self.prefix + call_sid)
+
+    def put_if_absent(self, key, value, ttl):
+        return bool(self.client.set(self.prefix + "value:" + key, value, nx=True, ex=max(1, int(ttl))))
+
+    def put_value(self, key, value, ttl):
+        self.client.set(self.prefix + "value:" + key, value, ex=max(1, int(ttl)))
+
+    def get_value(self, key):
+        raw = self.client.get(self.prefix + "value:" + key)
+        return raw.decode() if isinstance(raw, bytes) else raw
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+def make_session_store(backend, ttl=3600, max_sessions=10000, sqlite_path="sessions.db", redis_url=None):
+    """Build a store from config values ("memory", "sqlite" or "redis")."""
+    if backend == "sqlite":
+        return SQLiteSessionStore(sqlite_path, ttl=ttl)
+    if backend == "redis":
+        import redis
+        return RedisSessionStore(redis.Redis.from_url(redis_url or "redis://localhost:6379/0"), ttl=ttl)
+    return MemorySessionStore(ttl=ttl, max_sessions=max_sessions)
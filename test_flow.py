@@ -0,0 +1,119 @@
+# test_flow.py — question flow compilation and next_index (branches, skip_if, early exit)
+#
+#   python -m pytest -q test_flow.py
+import os
+
+import pytest
+
+from flow import FlowError, compile_flow, load_flow
+from scoring import CATEGORIES
+
+SHIPPED = compile_flow(load_flow(os.path.join(os.path.dirname(os.path.abspath(__file__)), "question_flow.json")))
+
+
+def scores(**values):
+    return {cat: float(values.get(cat, 0)) for cat in CATEGORIES}
+
+
+def after(flow, qid, s, answered):
+    """next_index from question qid, with question ids instead of indexes."""
+    nxt, skipped, rule = flow.next_index(flow.index[qid], s, answered)
+    return flow.questions[nxt]["id"], skipped, rule
+
+
+def mini(questions, **doc):
+    return compile_flow({"start": "q1", "questions": [{"id": "q0"}, *questions, {"id": "end"}], **doc})
+
+
+def test_shipped_flow_walks_in_order_without_scores():
+    assert after(SHIPPED, "q1", scores(), 1) == ("q2", [], None)
+    assert after(SHIPPED, "q9", scores(), 9) == ("q10", [], None)
+    assert after(SHIPPED, "q18", scores(), 18) == ("end", [], None)
+
+
+def test_shipped_flow_skips_q10_and_q13_for_trades():
+    s = scores(trades=2)
+    assert after(SHIPPED, "q9", s, 5) == ("q11", ["q10"], None)
+    assert after(SHIPPED, "q12", s, 7) == ("q14", ["q13"], None)
+    assert after(SHIPPED, "q9", scores(trades=1), 5) == ("q10", [], None)
+
+
+def test_shipped_flow_exits_early_from_q8_to_q14():
+    s = scores(engineering=5, medical=1)
+    assert after(SHIPPED, "q8", s, 8) == ("q14", [], 0)
+    assert after(SHIPPED, "q8", s, 7) == ("q9", [], None)               # too few answers yet
+    assert after(SHIPPED, "q8", scores(engineering=4, medical=2), 8)[2] is None   # margin under 3
+
+
+def test_shipped_flow_exits_to_end_after_14_answers():
+    s = scores(engineering=9, creative=2)
+    assert after(SHIPPED, "q14", s, 14) == ("end", [], 1)
+    assert after(SHIPPED, "q14", s, 13) == ("q15", [], None)
+
+
+def test_first_matching_early_exit_wins():
+    # both rules hold after q8; the first one (to q14) is taken
+    assert after(SHIPPED, "q8", scores(engineering=9, creative=2), 14) == ("q14", [], 0)
+
+
+def test_early_exit_never_jumps_backwards():
+    # past q14 rule 0's target is behind the call, so only rule 1 can apply
+    s = scores(engineering=5, medical=1)
+    assert after(SHIPPED, "q15", s, 9) == ("q16", [], None)
+
+
+def test_consecutive_skips():
+    flow = mini([{"id": "q1"},
+                 {"id": "q2", "skip_if": {"score": "trades", "gte": 1}},
+                 {"id": "q3", "skip_if": {"score": "creative", "gte": 1}},
+                 {"id": "q4"}])
+    assert after(flow, "q1", scores(trades=1, creative=1), 1) == ("q4", ["q2", "q3"], None)
+    assert after(flow, "q1", scores(trades=1), 1) == ("q3", ["q2"], None)
+
+
+def test_branch_then_skip():
+    flow = mini([{"id": "q1", "branches": [{"if": {"top": "creative"}, "goto": "q3"}]},
+                 {"id": "q2"},
+                 {"id": "q3", "skip_if": {"score": "creative", "gte": 3}},
+                 {"id": "q4"}])
+    assert after(flow, "q1", scores(creative=1), 1) == ("q3", [], None)
+    assert after(flow, "q1", scores(creative=3), 1) == ("q4", ["q3"], None)
+    assert after(flow, "q1", scores(), 1) == ("q2", [], None)
+
+
+def test_skip_stops_at_end():
+    flow = mini([{"id": "q1"}, {"id": "q2", "skip_if": {"total_gte": 0}}])
+    assert after(flow, "q1", scores(), 1) == ("end", ["q2"], None)
+
+
+def test_backward_goto_is_rejected():
+    with pytest.raises(FlowError, match="backwards"):
+        mini([{"id": "q1"}, {"id": "q2", "branches": [{"if": {"top": "creative"}, "goto": "q1"}]}])
+    with pytest.raises(FlowError, match="backwards"):
+        mini([{"id": "q1", "branches": [{"if": {"top": "creative"}, "goto": "q1"}]}])
+
+
+@pytest.mark.parametrize("doc", [
+    {"questions": [{"id": "q1", "branches": [{"if": {"top": "creative"}, "goto": "q9"}]}]},
+    {"questions": [{"id": "q1"}], "early_exit": [{"if": {"total_gte": 1}, "goto": "q9"}]},
+    {"questions": [{"id": "q1"}], "roles": {"name": "q9"}},
+    {"questions": [{"id": "q1"}], "speculative_after": "q9"},
+])
+def test_unknown_question_id_is_rejected(doc):
+    with pytest.raises(FlowError, match="unknown question 'q9'"):
+        doc = dict(doc)
+        mini(doc.pop("questions"), **doc)
+
+
+def test_bad_condition_is_rejected():
+    with pytest.raises(FlowError, match="unknown category"):
+        mini([{"id": "q1"}, {"id": "q2", "skip_if": {"score": "sports", "gte": 1}}])
+    with pytest.raises(FlowError, match="can't be skipped"):
+        mini([{"id": "q1", "skip_if": {"total_gte": 1}}])
+
+
+def test_roles_and_speculative_cut():
+    assert SHIPPED.roles == {"name": "q1", "stream": "q2"}
+    assert SHIPPED.questions[SHIPPED.speculative_after]["id"] == "q13"
+    bare = mini([{"id": "q1"}])
+    assert bare.roles == {} and bare.speculative_after is None
@@ -0,0 +1,96 @@
+# test_gemini_client.py — circuit breaker half-open recovery
+#
+#   python -m pytest -q test_gemini_client.py
+import time
+import asyncio
+
+import pytest
+
+from gemini_client import CLOSED, HALF_OPEN, OPEN, GeminiClient, GeminiUnavailable
+from rate_limit import TokenBucket
+
+
+class Model:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def generate_content(self, parts, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return "ok"
+
+
+def half_open_client(**kwargs):
+    client = GeminiClient(failure_threshold=1, reset_timeout=30, **kwargs)
+    client.breaker.record_failure()
+    client.breaker.opened_until = time.time() - 1   # cool-down over: next check goes half-open
+    assert client.available()
+    return client
+
+
+def test_rate_limited_trial_is_given_back():
+    client = half_open_client()
+    client.bucket = TokenBucket(rate=0.001, burst=0)
+    with pytest.raises(GeminiUnavailable) as e:
+        client.generate(Model(), [], "final", deadline=0.05)
+    assert e.value.reason == "rate_limited"
+    assert client.breaker.state == HALF_OPEN and client.available()
+
+    client.bucket = TokenBucket(rate=100, burst=10)
+    assert client.generate(Model(), [], "final") == "ok"
+    assert client.breaker.state == CLOSED
+
+
+def test_no_slot_trial_is_given_back():
+    client = half_open_client(max_concurrent=1)
+    client.slots.acquire()
+    with pytest.raises(GeminiUnavailable) as e:
+        client.generate(Model(), [], "final", deadline=0.05)
+    assert e.value.reason == "no_slot"
+    client.slots.release()
+    assert client.available()
+    assert client.generate(Model(), [], "final") == "ok"
+    assert client.breaker.state == CLOSED
+
+
+def test_cancelled_async_trial_is_given_back():
+    client = half_open_client()
+
+    async def run():
+        task = asyncio.create_task(client.generate_async(Model(latency=0.3), [], "ack"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert client.breaker.state == HALF_OPEN and client.available()
+
+
+def test_failed_trial_reopens():
+    client = half_open_client()
+
+    class Failing(Model):
+        def generate_content(self, parts, **kwargs):
+            raise RuntimeError("503 unavailable")
+
+    with pytest.raises(RuntimeError):
+        client.generate(Failing(), [], "final")
+    assert client.breaker.state == OPEN and not client.available()
+
+
+def test_timed_out_async_call_keeps_its_slot_until_the_thread_ends():
+    client = GeminiClient(max_concurrent=1, max_retries=0)
+    model = Model(latency=0.4)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await client.generate_async(model, [], "ack", deadline=0.1)
+        # the model call is still running on its thread, so the one slot is still taken
+        assert not client.slots.acquire(blocking=False)
+        await asyncio.sleep(0.5)
+        assert client.slots.acquire(blocking=False)
+        client.slots.release()
+
+    asyncio.run(run())
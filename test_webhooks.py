@@ -0,0 +1,117 @@
+# test_webhooks.py — Twilio retries: replayed TwiML (WebhookDedup) and stale q_index resyncs
+#
+#   python -m pytest -q test_webhooks.py
+import os
+import itertools
+
+os.environ["EVENT_LOG_DIR"] = ""   # no event log files from test calls
+
+import pytest
+
+import app as core
+from dedup import WebhookDedup
+
+CALLS = itertools.count()
+
+
+@pytest.fixture(scope="module")
+def client():
+    return core.app.test_client()
+
+
+def start_call(client):
+    """A call that picked English and is waiting on its first question."""
+    form = {"CallSid": f"CAtest{next(CALLS)}", "From": "+910000000000"}
+    client.post("/voice", data=form)
+    client.post("/set_language?q_index=0", data=dict(form, Digits="1"))
+    session = core.SESSION_STORE.get(form["CallSid"])
+    assert session.q_index == core.FLOW.start_index and not session.answers
+    return form, session.q_index
+
+
+def answer(client, form, q_index, text="I like maths"):
+    return client.post(f"/handle_answer?q_index={q_index}", data=dict(form, SpeechResult=text, Confidence="0.9"))
+
+
+def stored(form):
+    return core.SESSION_STORE.get(form["CallSid"])
+
+
+def forget_responses():
+    """What a retry sees when it reaches a worker that didn't serve the original."""
+    core.WEBHOOK_DEDUP._data.clear()
+
+
+def test_retried_answer_replays_the_same_twiml(client):
+    form, q = start_call(client)
+    first = answer(client, form, q)
+    replays = core.WEBHOOK_DEDUP.replays
+    second = answer(client, form, q)
+    assert second.status_code == 200 and second.data == first.data
+    assert core.WEBHOOK_DEDUP.replays == replays + 1
+    assert len(stored(form).answers) == 1
+
+
+def test_abandoned_claim_lets_the_retry_run():
+    dedup = WebhookDedup()
+    owner, fut = dedup.claim(("CA1", "1", "/handle_answer"))
+    assert owner
+    dedup.abandon(("CA1", "1", "/handle_answer"), fut, RuntimeError("boom"))
+    owner, _ = dedup.claim(("CA1", "1", "/handle_answer"))
+    assert owner
+
+
+def test_failed_handler_is_run_again_on_retry(client):
+    form, q = start_call(client)
+    runs = []
+
+    def handler(form, args):
+        runs.append(1)
+        if len(runs) == 1:
+            raise RuntimeError("store down")
+        return b"<Response />"
+
+    with pytest.raises(RuntimeError):
+        core.dedup_twiml("/handle_answer", handler, form, {"q_index": str(q)})
+    assert core.dedup_twiml("/handle_answer", handler, form, {"q_index": str(q)}) == b"<Response />"
+    assert len(runs) == 2
+
+
+def test_stale_answer_redirects_to_the_current_question(client):
+    form, q = start_call(client)
+    answer(client, form, q)
+    now = stored(form).q_index
+    forget_responses()
+    r = answer(client, form, q)
+    assert f"ask_question?q_index={now}" in r.data.decode()
+    assert len(stored(form).answers) == 1 and stored(form).q_index == now
+
+
+def test_stale_skip_redirects_to_the_current_question(client):
+    form, q = start_call(client)
+    answer(client, form, q)
+    now = stored(form).q_index
+    r = client.post(f"/skip_question?q_index={q}", data=form)
+    assert f"ask_question?q_index={now}" in r.data.decode()
+    assert len(stored(form).answers) == 1 and stored(form).q_index == now
+
+
+def test_stale_recording_redirects_to_the_current_question(client):
+    form, q = start_call(client)
+    answer(client, form, q)
+    now = stored(form).q_index
+    r = client.post(f"/handle_recording_fallback?q_index={q}",
+                    data=dict(form, RecordingUrl="http://example.invalid/rec", RecordingSid="REstale"))
+    assert f"ask_question?q_index={now}" in r.data.decode()
+    assert len(stored(form).answers) == 1 and stored(form).q_index == now
+
+
+def test_repeated_recording_without_q_index_is_recorded_once(client):
+    form, q = start_call(client)
+    rec = dict(form, RecordingUrl="http://example.invalid/rec", RecordingSid="REonce")
+    client.post("/handle_recording_fallback", data=rec)
+    forget_responses()
+    r = client.post("/handle_recording_fallback", data=rec)
+    now = stored(form).q_index
+    assert f"ask_question?q_index={now}" in r.data.decode()
+    assert [a.recording_sid for a in stored(form).answers] == ["REonce"]
@@ -0,0 +1,221 @@
+# tracing.py — per-call spans (webhooks, Gemini calls, recommendation jobs) and the dead-air timeline
+#
+#   python tracing.py slowest events/ --since 2026-10-01 -n 20
+#   python tracing.py trace events/ CA0123456789abcdef
+#
+# The app keeps recent calls' spans in memory (CallTracer, served at /calls/<sid>/trace and
+# /calls/slowest); the same spans are rebuilt from the event log here, across all workers.
+#
+# A turn starts when a gather ends (Twilio posts the speech, digits, timeout or recording) and
+# lasts until the next question's TwiML is ready. silence_ms is the time spent in our handlers
+# during the turn — the caller hears nothing while Twilio waits on us; turnaround_ms also
+# includes the ack being spoken and Twilio's own hops.
+import sys
+import json
+import time
+import argparse
+import threading
+import contextvars
+from collections import OrderedDict
+
+GATHER_END_ENDPOINTS = ("/set_language", "/handle_answer", "/skip_question", "/handle_recording_fallback")
+
+# the call a Gemini request belongs to; set per webhook and carried into background jobs by bind()
+CURRENT_CALL = contextvars.ContextVar("current_call", default=None)
+
+
+def bind(call_sid, fn):
+    """Wrap fn so spans recorded while it runs (e.g. in an executor thread) go to call_sid."""
+    def run(*args, **kwargs):
+        token = CURRENT_CALL.set(call_sid)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            CURRENT_CALL.reset(token)
+    return run
+
+
+class CallTracer:
+    """Spans of the most recent max_calls calls (LRU), at most max_spans each."""
+
+    def __init__(self, max_calls=2000, max_spans=400):
+        self.max_calls = max_calls
+        self.max_spans = max_spans
+        self._calls = OrderedDict()   # call_sid -> [span]
+        self._lock = threading.Lock()
+
+    def span(self, call_sid, name, start, end, **attrs):
+        call_sid = call_sid or CURRENT_CALL.get()
+        if not call_sid:
+            return
+        span = {"name": name, "start": start, "end": end, **attrs}
+        with self._lock:
+            spans = self._calls.get(call_sid)
+            if spans is None:
+                spans = self._calls[call_sid] = []
+                while len(self._calls) > self.max_calls:
+                    self._calls.popitem(last=False)
+            self._calls.move_to_end(call_sid)
+            if len(spans) < self.max_spans:
+                spans.append(span)
+
+    def spans(self, call_sid):
+        with self._lock:
+            return list(self._calls.get(call_sid, ()))
+
+    def calls(self):
+        with self._lock:
+            return {sid: list(spans) for sid, spans in self._calls.items()}
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def timeline(spans, created=None, question_ids=None):
+    """
+    spans -> {"events", "turns", "recommendation", "totals"}. Times are ms since created
+    (the session's creation time, else the first span).
+    """
+    spans = sorted(spans, key=lambda s: s["start"])
+    if not spans:
+        return {"events": [], "turns": [], "recommendation": None, "totals": {}}
+    origin = created if created is not None else spans[0]["start"]
+
+    def label(q_index):
+        try:
+            return question_ids[int(q_index)] if question_ids else q_index
+        except (TypeError, ValueError, IndexError):
+            return q_index
+
+    events = []
+    for s in spans:
+        attrs = {k: v for k, v in s.items() if k not in ("start", "end")}
+        events.append({"t": ms(s["start"] - origin), "ms": ms(s["end"] - s["start"]), **attrs})
+
+    turns, polls, current = [], [], None
+    for s in spans:
+        if s["name"] != "webhook":
+            continue
+        endpoint, took = s.get("endpoint"), s["end"] - s["start"]
+        if endpoint in GATHER_END_ENDPOINTS:
+            current = {"endpoint": endpoint, "question": label(s.get("q_index")), "gather_end": s["start"],
+                       "ack_ready": s["end"], "question_ready": None, "silence": took}
+            turns.append(current)
+        elif endpoint == "/ask_question" and current is not None and current["question_ready"] is None:
+            current["question_ready"] = s["end"]
+            current["next_question"] = label(s.get("q_index"))
+            current["silence"] += took
+        elif endpoint == "/recommendation_status":
+            polls.append(s)
+
+    recommendation = None
+    if polls:
+        answered = [t for t in turns if t["gather_end"] <= polls[0]["start"]]
+        start = answered[-1]["gather_end"] if answered else polls[0]["start"]
+        recommendation = {"polls": len(polls), "ready_at": ms(polls[-1]["end"] - origin),
+                          "wait_ms": ms(polls[-1]["end"] - start),
+                          "silence_ms": ms(sum(p["end"] - p["start"] for p in polls))}
+
+    out_turns = []
+    for t in turns:
+        ready = t["question_ready"] if t["question_ready"] is not None else t["ack_ready"]   # merged mode / last turn
+        out_turns.append({"endpoint": t["endpoint"], "question": t["question"], "next_question": t.get("next_question"),
+                          "gather_end": ms(t["gather_end"] - origin), "silence_ms": ms(t["silence"]),
+                          "turnaround_ms": ms(ready - t["gather_end"])})
+
+    worst = max(out_turns, key=lambda t: t["silence_ms"], default=None)
+    totals = {
+        "duration_ms": ms(max(s["end"] for s in spans) - origin),
+        "turns": len(out_turns),
+        "silence_ms": round(sum(t["silence_ms"] for t in out_turns), 1),
+        "worst_silence_ms": worst["silence_ms"] if worst else 0,
+        "worst_question": worst["question"] if worst else None,
+        "gemini_ms": ms(sum(s["end"] - s["start"] for s in spans if s["name"] == "gemini")),
+        "recommendation_wait_ms": recommendation["wait_ms"] if recommendation else None,
+    }
+    return {"events": events, "turns": out_turns, "recommendation": recommendation, "totals": totals}
+
+
+SLOWEST_KEYS = {
+    "silence": lambda t: t["silence_ms"],
+    "worst": lambda t: t["worst_silence_ms"],
+    "recommendation": lambda t: t["recommendation_wait_ms"] or 0,
+}
+
+
+def slowest(calls, n=20, by="silence", created=None, question_ids=None):
+    """calls: {call_sid: spans} -> the n calls with the most dead air, as [{"call_sid", **totals}]."""
+    if by not in SLOWEST_KEYS:
+        raise ValueError(f"unknown ordering {by!r}; expected one of {sorted(SLOWEST_KEYS)}")
+    rows = []
+    for call_sid, spans in calls.items():
+        totals = timeline(spans, (created or {}).get(call_sid), question_ids)["totals"]
+        if totals:
+            rows.append({"call_sid": call_sid, **totals})
+    rows.sort(key=SLOWEST_KEYS[by], reverse=True)
+    return rows[:n]
+
+
+def spans_from_events(events):
+    """Rebuild {call_sid: spans} from event-log records ("latency", "gemini", "recommendation_job")."""
+    calls = {}
+    for e in events:
+        call_sid = e.get("call_sid")
+        if not call_sid:
+            continue
+        t = e["t"]
+        if e["type"] == "latency":
+            span = {"name": "webhook", "start": t - e["seconds"], "end": t, "endpoint": e.get("endpoint"),
+                    "status": e.get("status"), "q_index": e.get("q_index")}
+        elif e["type"] == "gemini":
+            span = {"name": "gemini", "start": t - e["seconds"], "end": t, "kind": e.get("kind"), "outcome": e.get("outcome")}
+        elif e["type"] in ("recommendation_job", "recommendation", "early_exit", "flow_skip"):
+            span = {"name": e["type"], "start": t, "end": t,
+                    **{k: v for k, v in e.items() if k not in ("t", "type", "call_sid")}}
+        else:
+            continue
+        calls.setdefault(call_sid, []).append(span)
+    return calls
+
+
+def main(argv=None):
+    from event_log import iter_events, parse_time
+
+    parser = argparse.ArgumentParser(description="Per-call dead-air timelines from the Career Buddy event log.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("slowest")
+    p.add_argument("directory")
+    p.add_argument("-n", type=int, default=20)
+    p.add_argument("--by", choices=sorted(SLOWEST_KEYS), default="silence")
+    p.add_argument("--since", help="unix time or ISO date/time")
+    p.add_argument("--until", help="unix time or ISO date/time")
+    p = sub.add_parser("trace")
+    p.add_argument("directory")
+    p.add_argument("call_sid")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "trace":
+        spans = spans_from_events(iter_events(args.directory, call_sid=args.call_sid)).get(args.call_sid)
+        if not spans:
+            sys.exit(f"no events for {args.call_sid}")
+        json.dump(timeline(spans), sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+
+    started = time.perf_counter()
+    calls = spans_from_events(iter_events(args.directory, parse_time(args.since), parse_time(args.until),
+                                          types=("latency", "gemini", "recommendation_job", "recommendation")))
+    rows = slowest(calls, args.n, args.by)
+    print(f"{len(calls)} calls read in {time.perf_counter() - started:.1f}s; slowest {len(rows)} by {args.by}")
+    print(f"{'call_sid':<36}{'turns':>6}{'silence ms':>12}{'worst ms':>10}{'at':>6}{'gemini ms':>11}{'rec wait ms':>13}")
+    for r in rows:
+        wait = r["recommendation_wait_ms"]
+        print(f"{r['call_sid']:<36}{r['turns']:>6}{r['silence_ms']:>12.0f}{r['worst_silence_ms']:>10.0f}"
+              f"{str(r['worst_question']):>6}{r['gemini_ms']:>11.0f}{wait if wait is not None else '-':>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# transcribe.py — speech-to-text for answers that fell back to a recording, off the request path
+#
+# /handle_recording_fallback stores "(recording: <url>)" and hands the recording to a
+# TranscriptionPool; a worker downloads it, runs the configured backend and patches the
+# text into the session, so the answer counts for scoring and the Gemini prompt.
+import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from logs import get_logger
+
+log = get_logger("transcribe")
+
+
+class StubTranscriber:
+    """Fixed text after a delay, without downloading anything. For local runs and tests."""
+
+    fetches_audio = False
+
+    def __init__(self, text="I like fixing phones and building things with my hands", latency=1.0):
+        self.text = text
+        self.latency = latency
+
+    def __call__(self, audio, lang):
+        time.sleep(self.latency)
+        return self.text
+
+
+class WhisperTranscriber:
+    """OpenAI speech-to-text (the openai package is already in requirements.txt)."""
+
+    fetches_audio = True
+
+    def __init__(self, model="whisper-1"):
+        from openai import OpenAI   # reads OPENAI_API_KEY
+        self.client = OpenAI()
+        self.model = model
+
+    def __call__(self, audio, lang):
+        f = io.BytesIO(audio)
+        f.name = "answer.wav"
+        r = self.client.audio.transcriptions.create(model=self.model, file=f, language=lang)
+        return r.text
+
+
+TRANSCRIBERS = {"stub": StubTranscriber, "whisper": WhisperTranscriber}
+
+
+def make_transcriber(name):
+    if not name:
+        return None
+    try:
+        return TRANSCRIBERS[name]()
+    except KeyError:
+        raise ValueError(f"unknown TRANSCRIBER {name!r}; expected one of {sorted(TRANSCRIBERS)}")
+
+
+def fetch_recording(url, auth=None, timeout=10):
+    """Download a Twilio recording as WAV (auth is (account sid, token) when media auth is on)."""
+    import requests
+    r = requests.get(url if url.endswith((".wav", ".mp3")) else url + ".wav", auth=auth, timeout=timeout)
+    r.raise_for_status()
+    return r.content
+
+
+class TranscriptionPool:
+    """
+    At most `workers` recordings are fetched and transcribed at once. submit() never blocks:
+    past max_pending queued jobs it refuses, and the answer keeps its placeholder.
+
+    on_done(job, text) runs on the worker before the job's Future resolves, so anyone
+    waiting on pending(call_sid) sees the session already patched.
+    """
+
+    def __init__(self, transcriber, fetch=fetch_recording, workers=4, max_pending=200, attempts=3,
+                 on_done=None, observe=None):
+        self.transcriber = transcriber
+        self.fetch = fetch
+        self.max_pending = max_pending
+        self.attempts = attempts
+        self.on_done = on_done
+        self.observe = observe            # observe(outcome, seconds)
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transcribe")
+        self._pending = {}                # call_sid -> [Future]
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def submit(self, call_sid, recording_sid, url, lang):
+        """Queue one recording. Returns its Future (result: the text, or "" if nothing was heard), or None if refused."""
+        job = {"call_sid": call_sid, "recording_sid": recording_sid, "url": url, "lang": lang}
+        with self._lock:
+            if self._count >= self.max_pending:
+                self.rejected += 1
+                return None
+            self._count += 1
+            fut = self._executor.submit(self._run, job)
+            fut.job = job
+            self._pending.setdefault(call_sid, []).append(fut)
+        fut.add_done_callback(self._forget)
+        return fut
+
+    def _forget(self, fut):
+        with self._lock:
+            self._count -= 1
+            futures = self._pending.get(fut.job["call_sid"], [])
+            if fut in futures:
+                futures.remove(fut)
+            if not futures:
+                self._pending.pop(fut.job["call_sid"], None)
+
+    def _run(self, job):
+        t0 = time.perf_counter()
+        for attempt in range(self.attempts):
+            try:
+                audio = self.fetch(job["url"]) if self.transcriber.fetches_audio else b""
+                text = (self.transcriber(audio, job["lang"]) or "").strip()
+                break
+            except Exception as e:
+                if attempt + 1 == self.attempts:
+                    self._observe("failed", t0)
+                    log.error("transcription failed", call_sid=job["call_sid"], recording_sid=job["recording_sid"], error=str(e))
+                    raise
+                time.sleep(0.5 * 2 ** attempt)   # the recording may not be downloadable quite yet
+        self._observe("ok" if text else "empty", t0)
+        if text and self.on_done:
+            self.on_done(job, text)
+        return text
+
+    def _observe(self, outcome, t0):
+        if self.observe:
+            self.observe(outcome, time.perf_counter() - t0)
+
+    def pending(self, call_sid):
+        with self._lock:
+            return list(self._pending.get(call_sid, ()))
+
+    def stats(self):
+        with self._lock:
+            return {"pending": self._count, "calls": len(self._pending), "rejected": self.rejected}
+
+    def __len__(self):
+        return self._count